@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import asyncio
+import signal
+import socket
+import struct
+import traceback
+
+from server import Server
+from transport import SocketTransport
+import credits
+import dircache
+import leases
+
+
+#
+# Receive buffers are allocated in multiples of this and a connection keeps
+# at most POOL_BUFFERS of them, of up to POOL_MAX_SIZE bytes each, for
+# reuse. Larger frames, i.e. big LARGE_MTU writes, get a buffer of their own.
+#
+BUFFER_ALIGN = 65536
+POOL_BUFFERS = 4
+POOL_MAX_SIZE = 1048576 + BUFFER_ALIGN
+
+#
+# A WRITE too large for a pooled buffer has its data streamed to the file
+# in chunks of STREAM_CHUNK bytes. We stop reading from the socket while
+# STREAM_CHUNKS of them are being written.
+#
+STREAM_CHUNK = 1048576
+STREAM_CHUNKS = 2
+
+# SPL, SMB2 header and write request
+WRITE_HEADER_SIZE = 4 + 64 + 48
+
+
+class Connection(asyncio.BufferedProtocol):
+    """
+    A class for a single client connection driven by the asyncio event loop.
+    All per-connection state lives in the Server instance owned by
+    the connection.
+
+    The transport reads straight into a buffer from our pool. Once we have
+    the 4 byte SPL we know how large the frame is, switch to a bigger
+    buffer if needed, and only ask the transport for the rest of the frame.
+    The frame is handed to the Server as a memoryview and the decoders
+    slice views out of it, so the payload is never copied. The buffer goes
+    back to the pool once all the commands in the frame have completed.
+
+    The data of a large WRITE is not buffered at all, see StreamWrite.
+    """
+
+    def __init__(self, **kwargs):
+        self._transport = None
+        self._srv = None
+        self._buf = None
+        self._view = None
+        self._pos = 0
+        self._need = 0
+        self._pool = []
+        self._stream = None
+        self._left = 0
+        self._chunks = 0
+        self._paused = False
+
+    def connection_made(self, transport):
+        self._transport = transport
+        self._srv = Server(SocketTransport(transport))
+
+    def connection_lost(self, exc):
+        print('Socket closed by client')
+        if self._srv:
+            self._srv.Disconnect()
+        self._srv = None
+        self._pool = []
+
+    def _get_frame_buffer(self, size):
+        for idx, b in enumerate(self._pool):
+            if len(b) >= size:
+                return self._pool.pop(idx)
+        return bytearray((size + BUFFER_ALIGN - 1) // BUFFER_ALIGN * BUFFER_ALIGN)
+
+    def _put_frame_buffer(self, buf):
+        if len(buf) > POOL_MAX_SIZE or len(self._pool) >= POOL_BUFFERS:
+            return
+        if not self._srv:
+            return
+        self._pool.append(buf)
+
+    def _new_buffer(self, size, data):
+        """
+        Switch to a buffer of at least size bytes that starts with data
+        """
+        self._buf = self._get_frame_buffer(size)
+        self._view = memoryview(self._buf)
+        self._view[:len(data)] = data
+        self._pos = len(data)
+
+    def get_buffer(self, sizehint):
+        if self._buf is None and self._stream:
+            self._new_buffer(STREAM_CHUNK, b'')
+            self._need = min(len(self._buf), self._left)
+        if self._buf is None:
+            self._new_buffer(BUFFER_ALIGN, b'')
+        # Never read past the end of the current frame once we know
+        # where it ends
+        if self._need:
+            return self._view[self._pos:self._need]
+        return self._view[self._pos:]
+
+    def _start_stream(self):
+        """
+        Try to stream the data of the frame we are reading to the file.
+        Returns True if the frame is taken care of.
+        """
+        try:
+            self._stream = self._srv.StreamWrite(self._view[4:WRITE_HEADER_SIZE],
+                                                 self._need - 4)
+        except Exception as e:
+            print(e)
+            traceback.print_exc()
+            self._transport.close()
+            return True
+        if not self._stream:
+            return False
+
+        # We may already have the start of the data
+        _buf = self._buf
+        _data = self._view[WRITE_HEADER_SIZE:self._pos]
+        self._left = self._need - WRITE_HEADER_SIZE
+        self._buf = None
+        self._view = None
+        self._pos = 0
+        self._need = 0
+        self._feed(_buf, _data)
+        return True
+
+    def _feed(self, buf, data):
+        """
+        Hand a chunk of data in buf to the stream
+        """
+        _stream = self._stream
+        self._left = self._left - len(data)
+        if not self._left:
+            self._stream = None
+        if not data:
+            self._put_frame_buffer(buf)
+            return
+
+        self._chunks = self._chunks + 1
+        _stream.write(data, lambda: self._chunk_done(buf))
+        if self._chunks >= STREAM_CHUNKS and not self._paused:
+            self._paused = True
+            self._transport.pause_reading()
+
+    def _chunk_done(self, buf):
+        self._chunks = self._chunks - 1
+        self._put_frame_buffer(buf)
+        if self._paused and self._chunks < STREAM_CHUNKS:
+            self._paused = False
+            if not self._transport.is_closing():
+                self._transport.resume_reading()
+
+    def buffer_updated(self, nbytes):
+        self._pos = self._pos + nbytes
+
+        if self._stream:
+            if self._pos < self._need:
+                return
+            _buf = self._buf
+            _data = self._view[:self._pos]
+            self._buf = None
+            self._view = None
+            self._pos = 0
+            self._need = 0
+            self._feed(_buf, _data)
+            return
+
+        while self._pos >= 4:
+            if not self._need:
+                self._need = 4 + struct.unpack_from('>I', self._buf, 0)[0]
+            if self._need > len(self._buf):
+                # Large writes are streamed, once we have their header
+                if self._need > POOL_MAX_SIZE:
+                    if self._pos < WRITE_HEADER_SIZE:
+                        return
+                    if self._start_stream():
+                        return
+                _old = self._buf
+                self._new_buffer(self._need, self._view[:self._pos])
+                self._put_frame_buffer(_old)
+            if self._pos < self._need:
+                return
+
+            #
+            # We have a complete frame. Anything we read past its end
+            # belongs to the next frame and goes into a new buffer.
+            #
+            _frame = self._buf
+            buf = self._view[4:self._need]
+            _rest = self._view[self._need:self._pos]
+            self._new_buffer(max(len(_rest), BUFFER_ALIGN), _rest)
+            self._need = 0
+            if not buf:
+                self._put_frame_buffer(_frame)
+                continue
+
+            # The Server schedules the commands and sends the replies
+            # as they complete.
+            try:
+                self._srv.ProcessBuffer(buf,
+                        release=lambda b=_frame: self._put_frame_buffer(b))
+            except Exception as e:
+                print(e)
+                traceback.print_exc()
+                self._transport.close()
+                return
+
+
+async def serve(address, port, reuse_port=False):
+    """
+    Accept and serve client connections until cancelled
+    """
+    loop = asyncio.get_running_loop()
+    # kill -USR1 dumps the credit and directory cache counters of this
+    # process
+    loop.add_signal_handler(signal.SIGUSR1,
+                            lambda: print('Credits', credits.counters,
+                                          'Directory cache', dircache.counters,
+                                          'Leases', leases.counters))
+    srv = await loop.create_server(Connection, address, port,
+                                   reuse_address=True,
+                                   reuse_port=reuse_port,
+                                   backlog=socket.SOMAXCONN)
+    async with srv:
+        await srv.serve_forever()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from defaults import Config
+
+#
+# Process wide counters, summed over all connections
+#
+counters = {'granted': 0,
+            'consumed': 0,
+            'inflight': 0,
+            'throttled': 0,
+            'rejected': 0,
+            }
+
+
+class Credits(object):
+    """
+    A class for the SMB2 credits of a connection.
+
+    The command sequence window is every message id from 'low' up to, but
+    not including, 'high' that is not in 'used'. A request consumes
+    credit_charge message ids from the window and every reply grants
+    credits by growing the window at the top.
+    """
+
+    def __init__(self, **kwargs):
+        # The client starts with a single credit, message id 0
+        self.low = 0
+        self.high = 1
+        self.used = set()
+        self.inflight = 0
+        self.multi_credit = False
+        self.granted = 1
+        self.consumed = 0
+        self.throttled = 0
+        self.rejected = 0
+
+    def __del__(self):
+        counters['inflight'] = counters['inflight'] - self.inflight
+
+    def window(self):
+        """
+        Number of credits the client holds right now
+        """
+        return self.high - self.low - len(self.used)
+
+    def charge(self, h):
+        if not self.multi_credit:
+            return 1
+        return max(h['credit_charge'], 1)
+
+    def consume(self, h):
+        """
+        Consume the message ids of a request. A message id outside of the
+        window is a protocol violation and the connection must be
+        terminated so we raise ValueError.
+        """
+        _c = self.charge(h)
+        _mid = h['message_id']
+        for mid in range(_mid, _mid + _c):
+            if mid < self.low or mid >= self.high or mid in self.used:
+                self.rejected = self.rejected + 1
+                counters['rejected'] = counters['rejected'] + 1
+                print('Message id', mid, 'is not in the sequence window',
+                      self.low, self.high)
+                raise ValueError
+        for mid in range(_mid, _mid + _c):
+            self.used.add(mid)
+        while self.low in self.used:
+            self.used.remove(self.low)
+            self.low = self.low + 1
+
+        self.inflight = self.inflight + _c
+        self.consumed = self.consumed + _c
+        counters['inflight'] = counters['inflight'] + _c
+        counters['consumed'] = counters['consumed'] + _c
+
+    def charge_ok(self, h, payload):
+        """
+        A multi-credit request must be charged one credit per started
+        64k of payload, in either direction.
+        """
+        if not self.multi_credit or not payload:
+            return True
+        return self.charge(h) >= (payload - 1) // 65536 + 1
+
+    def grant(self, h):
+        """
+        Complete a request and return the number of credits to grant in
+        its reply. We grant what the client asks for up to max_credits
+        outstanding, counting requests still in flight. Once the process
+        as a whole has more than busy_requests in flight we only give back
+        what the request consumed so the window stops growing.
+        """
+        _c = self.charge(h)
+        self.inflight = self.inflight - _c
+        counters['inflight'] = counters['inflight'] - _c
+
+        _want = max(h['credit_request'], 1)
+        if _want > _c and counters['inflight'] > Config.busy_requests:
+            _want = _c
+            self.throttled = self.throttled + 1
+            counters['throttled'] = counters['throttled'] + 1
+
+        _grant = min(_want, Config.max_credits - self.window() - self.inflight)
+        # Never leave the client without any credits
+        if _grant <= 0:
+            _grant = 1 if self.window() + self.inflight == 0 else 0
+
+        self.high = self.high + _grant
+        self.granted = self.granted + _grant
+        counters['granted'] = counters['granted'] + _grant
+        return _grant
+
+    def stats(self):
+        return {'window': self.window(),
+                'low': self.low,
+                'high': self.high,
+                'inflight': self.inflight,
+                'granted': self.granted,
+                'consumed': self.consumed,
+                'throttled': self.throttled,
+                'rejected': self.rejected,
+                }
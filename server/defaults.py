@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+#
+# The Config of config.py, with a default for every setting that is
+# missing from it. A config.py written before a setting was added to
+# config.py.example keeps working and gets the value from there.
+#
+
+from config import Config
+
+defaults = {'listen_address': '0.0.0.0',
+            'port': 445,
+            'workers': 1,
+            'io_threads': 16,
+            'pending_timeout': 0.01,
+            'max_credits': 8192,
+            'busy_requests': 4096,
+            'max_io_size': 8388608,
+            'sendfile_min_size': 65536,
+            'stat_cache_ttl': 1.0,
+            'dir_cache_entries': 100000,
+            'leases': True,
+            'dir_leases': True,
+            'lease_break_timeout': 35,
+            }
+
+for _name, _value in defaults.items():
+    if not hasattr(Config, _name):
+        setattr(Config, _name, _value)
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import collections
+import os
+import struct
+import threading
+
+try:
+    import ctypes
+    import ctypes.util
+    _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    _libc.inotify_init1
+except (ImportError, OSError, AttributeError):
+    _libc = None
+
+from defaults import Config
+
+#
+# Process wide counters
+#
+counters = {'hits': 0,
+            'misses': 0,
+            'invalidations': 0,
+            'evictions': 0,
+            }
+
+IN_MODIFY      = 0x00000002
+IN_ATTRIB      = 0x00000004
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ONLYDIR     = 0x01000000
+
+# Anything that adds, removes or changes an entry of the directory
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | \
+    IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+
+# struct inotify_event, followed by len bytes of name
+_EVENT = struct.Struct('iIII')
+
+
+class _Dir(object):
+    """
+    A class for a directory in the cache
+    """
+    __slots__ = ('wd', 'gen', 'entries', 'pins')
+
+    def __init__(self, wd, **kwargs):
+        self.wd = wd
+        # Bumped whenever the directory changes
+        self.gen = 0
+        self.entries = None
+        # Pinned directories are watched until they are unpinned
+        self.pins = 0
+
+
+class DirCache(object):
+    """
+    A class for the entries of the directories clients list, shared by
+    all connections of the process and keyed by (st_dev, st_ino).
+
+    Every directory in the cache has an inotify watch and is dropped as
+    soon as one of its entries changes, the server also drops them itself
+    when it changes a directory so that its own changes are seen at once.
+    Without inotify nothing is cached. The cache holds at most
+    Config.dir_cache_entries entries and evicts the least recently used
+    directories to stay below that.
+
+    Directories are listed on the io threads so the cache is locked, the
+    inotify events are read from the event loop.
+
+    Others can pin a directory to have it watched until they unpin it,
+    whatever the size of the cache, and listen for the changes to the
+    directories we watch. A change the server makes is passed on with
+    who made it, and so are the inotify events of that change.
+    """
+
+    def __init__(self, **kwargs):
+        self._lock = threading.Lock()
+        self._dirs = collections.OrderedDict()
+        self._wds = {}
+        self._size = 0
+        self._loop = None
+        self._fd = -1
+        self._listeners = []
+        # (key, name) -> who is changing the entry, see own()
+        self._owners = {}
+        if _libc:
+            self._fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+
+    def attach(self, loop):
+        """
+        Read the inotify events from loop. Nothing is cached until then.
+        """
+        if self._fd < 0 or loop is self._loop:
+            return
+        # Events that arrived while no loop was reading them are lost
+        self.clear()
+        self._loop = loop
+        loop.add_reader(self._fd, self._read_events)
+
+    @property
+    def watching(self):
+        """
+        True if we see the changes made to the directories
+        """
+        return self._loop is not None
+
+    def listen(self, func):
+        """
+        Call func(key, by), on the event loop, whenever a directory we
+        watch changes. by is what was passed to invalidate(), or own(),
+        for the change, None if we do not know who made it.
+        """
+        self._listeners.append(func)
+
+    def get(self, key):
+        """
+        The cached entries of a directory, or None
+        """
+        with self._lock:
+            _d = self._dirs.get(key)
+            if _d is None or _d.entries is None:
+                counters['misses'] = counters['misses'] + 1
+                return None
+            self._dirs.move_to_end(key)
+            counters['hits'] = counters['hits'] + 1
+            return _d.entries
+
+    def watch(self, key, fd):
+        """
+        Start watching the directory open as fd before it is listed.
+        Returns the generation to pass to put(), or None if it can not
+        be cached.
+        """
+        if self._loop is None:
+            return None
+        with self._lock:
+            _d = self._add(key, fd)
+            return _d.gen if _d is not None else None
+
+    def pin(self, key, fd):
+        """
+        Watch the directory open as fd until unpin(). Returns False if
+        it can not be watched.
+        """
+        if self._loop is None:
+            return False
+        with self._lock:
+            _d = self._add(key, fd, True)
+            return _d is not None
+
+    def unpin(self, key):
+        with self._lock:
+            _d = self._dirs.get(key)
+            if _d is not None and _d.pins:
+                _d.pins = _d.pins - 1
+                self._evict()
+
+    def _add(self, key, fd, pin=False):
+        _d = self._dirs.get(key)
+        if _d is not None:
+            self._dirs.move_to_end(key)
+            if pin:
+                _d.pins = _d.pins + 1
+            return _d
+        _wd = _libc.inotify_add_watch(self._fd, b'/proc/self/fd/%d' % fd,
+                                      WATCH_MASK)
+        if _wd < 0:
+            return None
+        # The watch of a directory that has gone away, whose
+        # IN_IGNORED we have not read yet
+        if _wd in self._wds:
+            self._remove(self._wds[_wd], False)
+        _d = _Dir(_wd)
+        if pin:
+            _d.pins = 1
+        self._dirs[key] = _d
+        self._wds[_wd] = key
+        self._size = self._size + 1
+        self._evict()
+        # A new directory is only evicted if the cache can not even
+        # hold its watch
+        return self._dirs.get(key)
+
+    def put(self, key, gen, entries):
+        """
+        Store the entries of a directory unless it changed since watch()
+        """
+        if gen is None or len(entries) > Config.dir_cache_entries:
+            return
+        with self._lock:
+            _d = self._dirs.get(key)
+            if _d is None or _d.gen != gen:
+                return
+            _d.entries = entries
+            self._size = self._size + len(entries) - 1
+            self._dirs.move_to_end(key)
+            self._evict()
+
+    def invalidate(self, key, by=None):
+        """
+        The server changed an entry of the directory key, by is passed on
+        to the listeners
+        """
+        with self._lock:
+            _watched = key in self._dirs
+            self._invalidate(key)
+        if _watched:
+            self._changed({key: by})
+
+    def invalidate_parent(self, dir_fd, *paths, by=None):
+        """
+        Drop the directories that paths, relative to dir_fd, are in
+        """
+        for path in paths:
+            try:
+                _st = os.stat(os.path.dirname(path) or '.', dir_fd=dir_fd)
+            except OSError:
+                continue
+            self.invalidate((_st.st_dev, _st.st_ino), by)
+
+    def own(self, key, name, by):
+        """
+        The server is about to change the entry name of the directory key
+        for by. The inotify events of it are passed on with by, until
+        disown().
+        """
+        self._owners.setdefault((key, os.fsencode(name)), []).append(by)
+
+    def disown(self, key, name, by):
+        # The events of the changes made so far are queued, they are
+        # read while they are still ours
+        if self._loop is not None:
+            self._read_events()
+        _n = (key, os.fsencode(name))
+        _o = self._owners.get(_n)
+        if _o and by in _o:
+            _o.remove(by)
+            if not _o:
+                del self._owners[_n]
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._dirs):
+                self._invalidate(key)
+
+    def _invalidate(self, key):
+        _d = self._dirs.get(key)
+        if _d is None:
+            return
+        _d.gen = _d.gen + 1
+        if _d.entries is None:
+            return
+        self._size = self._size - len(_d.entries) + 1
+        _d.entries = None
+        counters['invalidations'] = counters['invalidations'] + 1
+
+    def _remove(self, key, rm_watch=True):
+        _d = self._dirs.pop(key)
+        del self._wds[_d.wd]
+        self._size = self._size - (len(_d.entries) if _d.entries is not None else 1)
+        if rm_watch:
+            _libc.inotify_rm_watch(self._fd, _d.wd)
+
+    def _evict(self):
+        _n = len(self._dirs)
+        while self._size > Config.dir_cache_entries and _n:
+            _n = _n - 1
+            key = next(iter(self._dirs))
+            _d = self._dirs[key]
+            if not _d.pins:
+                self._remove(key)
+                counters['evictions'] = counters['evictions'] + 1
+                continue
+            # Keep watching a pinned directory, only its entries go
+            self._dirs.move_to_end(key)
+            if _d.entries is not None:
+                self._size = self._size - len(_d.entries) + 1
+                _d.entries = None
+                counters['evictions'] = counters['evictions'] + 1
+
+    def _changed(self, keys):
+        for func in self._listeners:
+            for key, by in keys.items():
+                func(key, by)
+
+    def _read_events(self):
+        while True:
+            try:
+                _b = os.read(self._fd, 65536)
+            except (BlockingIOError, InterruptedError):
+                return
+            _pos = 0
+            # key -> by, None as soon as a change has no owner, or
+            # another one
+            _keys = {}
+            with self._lock:
+                while _pos < len(_b):
+                    _wd, _mask, _, _len = _EVENT.unpack_from(_b, _pos)
+                    _pos = _pos + _EVENT.size + _len
+                    if _mask & IN_Q_OVERFLOW:
+                        for key in list(self._dirs):
+                            self._invalidate(key)
+                            _keys[key] = None
+                        continue
+                    key = self._wds.get(_wd)
+                    if key is None:
+                        continue
+                    _by = None
+                    if self._owners:
+                        # The name is padded with NULs
+                        _o = self._owners.get((key, _b[_pos - _len:_pos].rstrip(b'\0')))
+                        _by = _o[-1] if _o else None
+                    _keys[key] = _by if _keys.get(key, _by) is _by else None
+                    if _mask & IN_IGNORED:
+                        self._remove(key, False)
+                        continue
+                    self._invalidate(key)
+            self._changed(_keys)
+
+_dir_cache = None
+
+def dir_cache():
+    global _dir_cache
+    if not _dir_cache:
+        _dir_cache = DirCache()
+    return _dir_cache
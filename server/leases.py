@@ -0,0 +1,426 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import asyncio
+import contextlib
+import os
+import stat
+
+from defaults import Config
+from dircache import dir_cache
+from smb2.header import Direction, Status
+from smb2.create import *
+from smb2.oplock_break import *
+
+#
+# Process wide counters
+#
+counters = {'granted': 0,
+            'breaks': 0,
+            'timeouts': 0,
+            }
+
+R = SMB2_LEASE_READ_CACHING
+H = SMB2_LEASE_HANDLE_CACHING
+W = SMB2_LEASE_WRITE_CACHING
+
+# The caching an oplock level stands for
+_OPLOCK_STATE = {Oplock.LEVEL_II.value: R,
+                 Oplock.LEVEL_EXCLUSIVE.value: R | W,
+                 Oplock.LEVEL_BATCH.value: R | W | H,
+                 }
+
+
+def oplock_state(level):
+    """
+    The lease state of an oplock level
+    """
+    return _OPLOCK_STATE.get(level, 0)
+
+def oplock_level(state):
+    """
+    The oplock level of a lease state
+    """
+    if state & W:
+        if state & H:
+            return Oplock.LEVEL_BATCH.value
+        return Oplock.LEVEL_EXCLUSIVE.value
+    if state & R:
+        return Oplock.LEVEL_II.value
+    return Oplock.LEVEL_NONE.value
+
+
+class Lease(object):
+    """
+    A class for a lease a client holds on a file. The oplock of an open
+    is a lease too, one that is never shared with another open.
+    """
+    __slots__ = ('key', 'file', 'dir', 'state', 'epoch', 'v2', 'opens',
+                 'breaking_to', 'broken')
+
+    def __init__(self, key, file, dir, v2, **kwargs):
+        # (client guid, lease key), None for an oplock
+        self.key = key
+        # (st_dev, st_ino) of the file
+        self.file = file
+        # A directory lease, broken when an entry of the directory changes
+        self.dir = dir
+        self.state = 0
+        self.epoch = 0
+        self.v2 = v2
+        # Every open under the lease: File -> (Server, file id)
+        self.opens = {}
+        # The state we break to, until the client acknowledges it
+        self.breaking_to = None
+        self.broken = None
+
+    def valid(self, state):
+        """
+        The state as we can grant it. Nothing is cached without R and an
+        oplock only caches handles as a batch oplock.
+        """
+        if not state & R:
+            return 0
+        if self.key is None and state & H and not state & W:
+            return R
+        if self.dir:
+            return state & (R | H)
+        return state & (R | W | H)
+
+
+class ParentLease(object):
+    """
+    A class for the directory lease an open was made under, the parent
+    lease key of its CREATE. The changes the open makes to its entry in
+    the directory do not break that lease.
+    """
+    __slots__ = ('key', 'dir', 'name')
+
+    def __init__(self, key, dir, name, **kwargs):
+        # (client guid, lease key) of the directory lease
+        self.key = key
+        # (st_dev, st_ino) of the directory
+        self.dir = dir
+        # The name of the entry in it
+        self.name = name
+
+
+class LeaseManager(object):
+    """
+    A class for the leases and oplocks clients hold on files, shared by
+    all connections of the process.
+
+    Any number of clients can cache reads and handles, but write caching
+    is only granted to the only open of a file. A new open breaks the
+    write caching of the other clients, writes and truncates break their
+    read caching and renames and deletes their handle caching. Breaks from
+    a state with write or handle caching are waited for, for up to
+    Config.lease_break_timeout seconds, so that the client can flush what
+    it has cached first.
+
+    Clients can also cache the entries of a directory under a read and
+    handle lease on it, that is broken as soon as any of the entries
+    changes. The directory cache tells us about the changes the server
+    makes and, with inotify, the ones made outside of it. Without inotify
+    no directory leases are granted. The changes a client makes through
+    an open it made under its lease on the directory do not break it.
+
+    The workers of a pre-forked server do not see each other's opens, so
+    nothing is granted with more than one worker.
+    """
+
+    def __init__(self, **kwargs):
+        # (st_dev, st_ino) -> [number of opens, leases]
+        self._files = {}
+        # (client guid, lease key) -> Lease
+        self._leases = {}
+        # File -> (st_dev, st_ino), for every open we account for
+        self._opens = {}
+        dir_cache().listen(self._dir_changed)
+
+    @property
+    def enabled(self):
+        return Config.leases and Config.workers <= 1
+
+    def lease_file(self, srv, lease_key):
+        """
+        The (st_dev, st_ino) of the file a lease key of srv is used for,
+        None if it is not in use. A lease key can only be used for one file.
+        """
+        _l = self._leases.get((srv.client_guid, bytes(lease_key)))
+        if _l is None:
+            return None
+        return _l.file
+
+    def parent_lease(self, srv, parent_lease_key, path):
+        """
+        The ParentLease of a new open of path under the directory lease
+        parent_lease_key of srv, None if there is no such lease. The
+        changes to the entry are the client's from now on, until the
+        open is closed.
+        """
+        _l = self._leases.get((srv.client_guid, bytes(parent_lease_key)))
+        if _l is None or not _l.dir:
+            return None
+        _p = ParentLease(_l.key, _l.file, os.path.basename(path))
+        dir_cache().own(_p.dir, _p.name, _p)
+        return _p
+
+    def release(self, p):
+        """
+        The open of ParentLease p is gone, or was never made
+        """
+        if p is not None:
+            dir_cache().disown(p.dir, p.name, p)
+
+    @contextlib.contextmanager
+    def renaming(self, p, path):
+        """
+        The with block renames the entry of ParentLease p to path
+        """
+        if p is None:
+            yield
+            return
+        _name = os.path.basename(path)
+        dir_cache().own(p.dir, _name, p)
+        try:
+            yield
+        except BaseException:
+            dir_cache().disown(p.dir, _name, p)
+            raise
+        dir_cache().disown(p.dir, p.name, p)
+        p.name = _name
+
+    async def open(self, srv, fid, f, requested, lease_key=None, v2=False,
+                   changes_data=False):
+        """
+        Account for a new open, fid of srv, of f and break the caching of
+        the other clients that it conflicts with. requested is the lease
+        state the client asks for, with the lease key for a lease and
+        without for an oplock. Returns the Lease of the open, or None.
+        """
+        if not self.enabled:
+            return None
+        _st = f.stat()
+        _fkey = (_st.st_dev, _st.st_ino)
+        _l = None
+        if lease_key is not None:
+            _l = self._leases.get((srv.client_guid, bytes(lease_key)))
+        _e = self._files.setdefault(_fkey, [0, []])
+        self._opens[f] = _fkey
+        _e[0] = _e[0] + 1
+
+        # Nobody else can cache writes now, and if we are about to change
+        # the data nobody else can cache reads either
+        await self._break_others(_e, _l, 0 if changes_data else ~W)
+
+        if lease_key is not None:
+            # It may have gone while we waited
+            _l = self._leases.get((srv.client_guid, bytes(lease_key)))
+        if _l is None:
+            if not requested & R:
+                return None
+            _dir = stat.S_ISDIR(_st.st_mode)
+            # We have to see every change made to a leased directory
+            if _dir and not dir_cache().pin(_fkey, f.fd):
+                return None
+            _l = Lease((srv.client_guid, bytes(lease_key))
+                       if lease_key is not None else None, _fkey, _dir, v2)
+            _e[1].append(_l)
+            if _l.key is not None:
+                self._leases[_l.key] = _l
+        _grant = requested
+        if _e[0] > len(_l.opens) + 1:
+            # The file has other opens
+            _grant = _grant & ~W
+        _grant = _l.valid(_l.state | _grant)
+        if _l.breaking_to is None and _grant != _l.state:
+            _l.state = _grant
+            _l.epoch = _l.epoch + 1
+            counters['granted'] = counters['granted'] + 1
+        _l.opens[f] = (srv, fid)
+        f.lease = _l
+        return _l
+
+    def close(self, f):
+        """
+        f is closed, or its connection has gone away
+        """
+        self.release(f.parent_lease)
+        _fkey = self._opens.pop(f, None)
+        if _fkey is None:
+            return
+        _e = self._files[_fkey]
+        _e[0] = _e[0] - 1
+        _l = f.lease
+        f.lease = None
+        if _l is not None:
+            del _l.opens[f]
+            if not _l.opens:
+                self._drop(_l, _e)
+        if not _e[0]:
+            del self._files[_fkey]
+
+    def modified(self, f):
+        """
+        f changed the data of the file, the other clients can no longer
+        cache it. We do not wait for them.
+        """
+        _fkey = self._opens.get(f)
+        if _fkey is None:
+            return
+        _e = self._files[_fkey]
+        if len(_e[1]) == (1 if f.lease else 0):
+            return
+        for _l in list(_e[1]):
+            if _l is not f.lease:
+                self._break(_l, 0)
+
+    async def unlinking(self, f):
+        """
+        f is about to be renamed or deleted, the other clients must close
+        the handles they cache first
+        """
+        _fkey = self._opens.get(f)
+        if _fkey is None:
+            return
+        await self._break_others(self._files[_fkey], f.lease, ~H)
+
+    def ack_lease(self, srv, lease_key, state):
+        """
+        A Lease Break acknowledgment, returns its Status
+        """
+        _l = self._leases.get((srv.client_guid, bytes(lease_key)))
+        if _l is None:
+            return Status.OBJECT_NAME_NOT_FOUND
+        if _l.breaking_to is None or state & ~_l.breaking_to:
+            return Status.REQUEST_NOT_ACCEPTED
+        self._acked(_l, state)
+        return Status.SUCCESS
+
+    def ack_oplock(self, f, level):
+        """
+        An Oplock Break acknowledgment, returns its Status
+        """
+        _l = f.lease
+        if _l is None or _l.key is not None or _l.breaking_to is None:
+            return Status.INVALID_OPLOCK_PROTOCOL
+        _s = oplock_state(level)
+        if _s & ~_l.breaking_to:
+            return Status.INVALID_OPLOCK_PROTOCOL
+        self._acked(_l, _s)
+        return Status.SUCCESS
+
+    def _dir_changed(self, key, by):
+        """
+        An entry of the directory changed, its leases are broken. Not the
+        lease of ParentLease by though, the client made the change itself.
+        The change is made so we do not wait for them.
+        """
+        _e = self._files.get(key)
+        if _e is None:
+            return
+        for _l in list(_e[1]):
+            if _l.dir and (by is None or _l.key != by.key):
+                self._break(_l, 0)
+
+    async def _break_others(self, e, own, mask):
+        """
+        Break every lease in e other than own down to mask, and wait
+        until the breaks are acknowledged or time out
+        """
+        _loop = asyncio.get_running_loop()
+        _deadline = None
+        while True:
+            _wait = {}
+            for _l in list(e[1]):
+                if _l is own:
+                    continue
+                _b = self._break(_l, _l.valid(_l.state & mask))
+                if _b is not None:
+                    _wait[_b] = _l
+            if not _wait:
+                return
+            if _deadline is None:
+                _deadline = _loop.time() + Config.lease_break_timeout
+            _, _pending = await asyncio.wait(list(_wait),
+                                             timeout=max(_deadline - _loop.time(), 0))
+            for _b in _pending:
+                # The client did not answer, it does not get to cache
+                # any more than we asked for
+                counters['timeouts'] = counters['timeouts'] + 1
+                _l = _wait[_b]
+                if _l.broken is _b:
+                    self._acked(_l, _l.breaking_to)
+
+    def _break(self, l, to):
+        """
+        Start breaking l down to state to. Returns a future that is done
+        once the client has acknowledged the break, or None if there is
+        nothing to wait for.
+        """
+        if l.breaking_to is not None:
+            # One break at a time, it is broken further once this one
+            # is acknowledged
+            return l.broken
+        if not l.state & ~to:
+            return None
+        counters['breaks'] = counters['breaks'] + 1
+        _ack = l.state & (W | H)
+        l.epoch = l.epoch + 1
+        if not self._notify(l, to, _ack) or not _ack:
+            l.state = to
+            return None
+        l.breaking_to = to
+        l.broken = asyncio.get_running_loop().create_future()
+        return l.broken
+
+    def _notify(self, l, to, ack):
+        """
+        Send the break on the most recent connection of the lease that is
+        still there. Returns False if there is none.
+        """
+        for srv, fid in reversed(list(l.opens.values())):
+            if l.key is None:
+                _b = OplockBreak.encode(Direction.REPLY,
+                                        {'oplock_level': oplock_level(to),
+                                         'file_id': fid,
+                                         })
+            else:
+                _b = OplockBreak.encode(Direction.REPLY,
+                                        {'new_epoch': l.epoch if l.v2 else 0,
+                                         'flags': SMB2_NOTIFY_BREAK_LEASE_FLAG_ACK_REQUIRED if ack else 0,
+                                         'lease_key': l.key[1],
+                                         'current_lease_state': l.state,
+                                         'new_lease_state': to,
+                                         })
+            if srv.SendBreak(_b):
+                return True
+        return False
+
+    def _acked(self, l, state):
+        l.state = state
+        l.breaking_to = None
+        if l.broken is not None and not l.broken.done():
+            l.broken.set_result(None)
+        l.broken = None
+
+    def _drop(self, l, e):
+        """
+        The last open of l is closed
+        """
+        e[1].remove(l)
+        if l.key is not None:
+            del self._leases[l.key]
+        if l.dir:
+            dir_cache().unpin(l.file)
+        if l.broken is not None and not l.broken.done():
+            l.broken.set_result(None)
+
+_lease_manager = None
+
+def lease_manager():
+    global _lease_manager
+    if not _lease_manager:
+        _lease_manager = LeaseManager()
+    return _lease_manager
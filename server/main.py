@@ -1,35 +1,83 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-import socket
+import asyncio
+import os
+import signal
+import time
 import traceback
 
-from smb2.header import Direction
-from server import Server
+from defaults import Config
+from async_server import serve
+
+def run_worker(address, port, reuse_port=False):
+    """
+    Serve client connections from an asyncio event loop in this process
+    """
+    asyncio.run(serve(address, port, reuse_port=reuse_port))
+
+def spawn_worker(address, port):
+    """
+    Fork a worker process. Every worker binds its own listening socket with
+    SO_REUSEPORT and the kernel spreads new connections across them.
+    """
+    pid = os.fork()
+    if pid:
+        return pid
+
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    try:
+        run_worker(address, port, reuse_port=True)
+    except Exception as e:
+        print(e)
+        traceback.print_exc()
+    os._exit(1)
+
+def run_master(address, port, workers):
+    """
+    Fork the workers and respawn any worker that exits
+    """
+    children = {}
+
+    def shutdown(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                True
+        os._exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    for _ in range(workers):
+        children.update({spawn_worker(address, port): time.monotonic()})
+
+    while True:
+        pid, status = os.wait()
+        if not pid in children:
+            continue
+        print('Worker', pid, 'exited with status', status)
+        # Do not spin if workers die straight away, for example if the
+        # port is already in use.
+        if time.monotonic() - children[pid] < 1:
+            time.sleep(1)
+        del children[pid]
+        children.update({spawn_worker(address, port): time.monotonic()})
 
 def main():
     print('SMB2 server in Python says: Hi there!')
 
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind(('0.0.0.0', 445))
-        # For now we only run as a single process and we will terminate once
-        # the a client has connected and then disconnected.
-        # We should change this to run the master process to only
-        # listen to the socket, then immediately accept and fork a slave
-        # process to manage the connection.
-        # Having one one process for each connected client.
-        s.listen()
-        while True:
-            print('Waiting for connection')
-            conn, addr = s.accept()
-            with conn:
-                try:
-                    Server(conn)
-                except Exception as e:
-                    print(e)
-                    traceback.print_exc()
-                    True
-            
+    # All client connections are served concurrently from an asyncio
+    # event loop, each connection with its own Server instance.
+    # With more than one worker we run as a master that forks and
+    # supervises that many worker processes, each with its own loop.
+    print('Waiting for connections')
+    if Config.workers > 1:
+        run_master(Config.listen_address, Config.port, Config.workers)
+    else:
+        run_worker(Config.listen_address, Config.port)
+
 if __name__ == "__main__":
     main()
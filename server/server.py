@@ -3,6 +3,9 @@
 
 from Crypto.Hash import CMAC
 from Crypto.Cipher import AES
+import asyncio
+import concurrent.futures
+import contextvars
 import hashlib
 import hmac
 import os
@@ -10,10 +13,12 @@ import secrets
 import socket
 import stat
 import struct
+import threading
 import time
+import traceback
 import spnego
 try:
-    from config import Config
+    from defaults import Config
 except:
     print('FATAL: No configuration file found.')
     raise
@@ -38,83 +43,470 @@ from smb2.query_directory import *
 from smb2.file_info import *
 from smb2.filesystem_info import *
 from smb2.dir_info import *
+from smb2.oplock_break import *
+from smb2.wildcard import compile_pattern, is_wildcard
+from credits import Credits
+from transport import FileRange
+from dircache import dir_cache
+from leases import lease_manager, oplock_level, oplock_state
 
 SMB2_KEY_SIZE = 16
 
+#
+# Commands that run concurrently on one connection each get their own
+# copy of the compound state, see Server._compound_error and _last_fid.
+#
+_compound_error_ctx = contextvars.ContextVar('compound_error',
+                                             default=Status.SUCCESS)
+_last_fid_ctx = contextvars.ContextVar('last_fid', default=(0, 0))
+_compound_ctx = contextvars.ContextVar('compound', default=False)
+
+#
+# Bounded thread pool for the filesystem syscalls that can block.
+# It is created on first use so that forked workers get their own threads.
+#
+_io_executor = None
+
+def io_executor():
+    global _io_executor
+    if not _io_executor:
+        _io_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=Config.io_threads,
+            thread_name_prefix='io')
+    return _io_executor
+
+class Stat(object):
+    """
+    A class for the attributes of an open file, as returned by fstat.
+    They are shared by all opens of the file and updated as we change it.
+    """
+    __slots__ = ('st_mode', 'st_ino', 'st_dev', 'st_nlink', 'st_size',
+                 'st_atime', 'st_mtime', 'st_ctime')
+
+    def __init__(self, st, **kwargs):
+        for _n in self.__slots__:
+            setattr(self, _n, getattr(st, _n))
+
+#
+# The attributes of every open file, so that a change made through one
+# open, on any connection, is seen through all the others.
+# (st_dev, st_ino) -> [Stat or None, when it was fetched, number of opens]
+# Files are opened on the io threads, and may be collected on any thread.
+#
+_stats = {}
+_stats_lock = threading.RLock()
+
 class File(object):
 
     def __init__(self, path, flags, at, **kwargs):
         self.path = '.' if not path else path
         self.flags = flags
         self.fd = os.open(self.path, flags, dir_fd=at)
-        _st = os.stat(self.fd)
-        self.de = []
+        # A new open, possibly truncating, refreshes the attributes
+        _st = Stat(os.fstat(self.fd))
+        self._key = (_st.st_dev, _st.st_ino)
+        with _stats_lock:
+            self._stat = _stats.setdefault(self._key, [None, 0, 0])
+            self._stat[0] = _st
+            self._stat[1] = time.monotonic()
+            self._stat[2] = self._stat[2] + 1
+        # Created by the first QUERY_DIRECTORY, queries of the same
+        # handle take turns with it
+        self.cursor = None
+        self.cursor_lock = asyncio.Lock()
         self.delete_on_close = False
-        if stat.S_ISDIR(_st.st_mode):
-            self.scandir()
+        # The ParentLease of the directory lease the client opened the
+        # file under, its changes do not break that lease
+        self.parent_lease = None
+        # The directory the file is in, whose cached entries our writes
+        # make stale. We are on an io thread, so stat() it now.
+        self.parent = None
+        if dir_cache().watching:
+            self.parent = file_key(os.path.dirname(self.path), at)
+        # The lease, or oplock, of the open
+        self.lease = None
 
     def __del__(self):
+        self.close()
+
+    def close(self):
+        if hasattr(self, 'cursor') and self.cursor:
+            self.cursor.close()
+            self.cursor = None
+        if hasattr(self, '_stat') and self._stat:
+            with _stats_lock:
+                self._stat[2] = self._stat[2] - 1
+                if not self._stat[2] and _stats.get(self._key) is self._stat:
+                    del _stats[self._key]
+            self._stat = None
         if hasattr(self, 'fd') and self.fd:
             os.close(self.fd)
+            self.fd = None
     
     def stat(self):
-        return os.fstat(self.fd)
-
-    def scandir(self):
-        _dirents = []
-        with os.scandir(self.fd) as it:
-            for _e in it:
-                _st = _e.stat(follow_symlinks=False)
-                _a = FILE_ATTRIBUTE_SPARSE_FILE
-                if stat.S_ISDIR(_st.st_mode):
-                    _a = _a | FILE_ATTRIBUTE_DIRECTORY
-                _de = {'file_index': 0,
-                       'creation_time': (0, 0, 0),
-                       'last_access_time': (int(_st.st_atime), 0, 0),
-                       'last_write_time': (int(_st.st_mtime), 0, 0),
-                       'change_time': (int(_st.st_ctime), 0, 0),
-                       'end_of_file': _st.st_size,
-                       'allocation_size': _st.st_size,
-                       'file_attributes': _a,
-                       'ea_size': 0,
-                       'file_id': _st.st_ino,
-                       'file_name': bytes(_e.name, encoding='utf=8'),
-                       }
-                _dirents.append((_e, _de,))
-        self.de = _dirents
+        """
+        The attributes of the file. They are only fetched again once
+        invalidated, or when they are older than Config.stat_cache_ttl
+        seconds, to catch changes made outside of the server.
+        """
+        _e = self._stat
+        _now = time.monotonic()
+        if _e[0] is None or (Config.stat_cache_ttl is not None and
+                             _now - _e[1] > Config.stat_cache_ttl):
+            _e[0] = Stat(os.fstat(self.fd))
+            _e[1] = _now
+        return _e[0]
+
+    def invalidate(self):
+        """
+        The file has changed, for every open of it
+        """
+        self._stat[0] = None
+
+    def wrote(self, offset, count):
+        """
+        Update the attributes after writing count bytes at offset
+        """
+        if self.parent is not None:
+            dir_cache().invalidate(self.parent, self.parent_lease)
+        _st = self._stat[0]
+        if _st is None:
+            return
+        _st.st_size = max(_st.st_size, offset + count)
+        _st.st_mtime = _st.st_ctime = time.time()
 
     def pread(self, length, offset):
         return os.pread(self.fd, length, offset)
 
+def file_key(path, at):
+    """
+    The (st_dev, st_ino) of path, relative to the directory at, or None
+    if there is no such file
+    """
+    try:
+        _st = os.stat(path or '.', dir_fd=at)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return (_st.st_dev, _st.st_ino)
+
+class DirCursor(object):
+    """
+    A class for the position of a QUERY_DIRECTORY enumeration.
+    The entries come from the directory cache if it has them. Otherwise
+    they are read from the directory as the replies need them, so a huge
+    directory only ever has one reply worth of entries in memory, and the
+    cache is filled on the way if the directory is small enough for it.
+    Only the entries that match the search pattern are returned, a pattern
+    without wildcards is a single name that is looked up with stat()
+    instead of reading the directory.
+    """
+
+    def __init__(self, f, pattern=b'', **kwargs):
+        # Only the fd, the File closes us when it goes away
+        self._fd = f.fd
+        _st = f.stat()
+        self._key = (_st.st_dev, _st.st_ino)
+        # Only the names that match, None if all of them do
+        self._match = None
+        # The entries from the cache, or of the one name we looked up,
+        # and the position in them
+        if pattern and not is_wildcard(pattern):
+            self._entries = self._lookup(pattern)
+        else:
+            self._match = compile_pattern(pattern)
+            self._entries = dir_cache().get(self._key)
+        self._pos = 0
+        # Or the scandir iterator, opened by the first batch
+        self._it = None
+        self._done = False
+        self._gen = None
+        self._collect = None
+        # The entry the encoder took from us but had no room for
+        self._pending = None
+        self._last = None
+        self._taken = 0
+
+    def close(self):
+        if self._it:
+            self._it.close()
+            self._it = None
+
+    @property
+    def cached(self):
+        """
+        True if the entries are in memory and the next batch does not
+        need any syscalls
+        """
+        return self._entries is not None
+
+    @property
+    def done(self):
+        if self._entries is not None:
+            return self._pos >= len(self._entries)
+        return self._done and self._pending is None
+
+    @staticmethod
+    def _entry(name, st):
+        _a = FILE_ATTRIBUTE_SPARSE_FILE
+        if stat.S_ISDIR(st.st_mode):
+            _a = _a | FILE_ATTRIBUTE_DIRECTORY
+        return {'file_index': 0,
+                'creation_time': (0, 0, 0),
+                'last_access_time': (int(st.st_atime), 0, 0),
+                'last_write_time': (int(st.st_mtime), 0, 0),
+                'change_time': (int(st.st_ctime), 0, 0),
+                'end_of_file': st.st_size,
+                'allocation_size': st.st_size,
+                'file_attributes': _a,
+                'ea_size': 0,
+                'file_id': st.st_ino,
+                'file_name': name,
+                }
+
+    def _lookup(self, name):
+        """
+        The entry of a single name, without reading the directory
+        """
+        # Never a path, and never an entry we do not list
+        if b'/' in name or b'\0' in name or name in (b'.', b'..'):
+            return []
+        try:
+            _st = os.stat(name, dir_fd=self._fd, follow_symlinks=False)
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+        return [self._entry(name, _st)]
+
+    def _scan(self):
+        # The cached entries from _pos on, that match
+        _e = self._entries
+        while self._pos < len(_e):
+            _de = _e[self._pos]
+            self._pos = self._pos + 1
+            if self._match is not None and not self._match(_de['file_name']):
+                continue
+            self._last = self._pos - 1
+            self._taken = self._taken + 1
+            yield _de
+
+    def _stream(self):
+        if self._pending is not None:
+            self._last = self._pending
+            self._pending = None
+            self._taken = self._taken + 1
+            yield self._last
+        if self._done:
+            return
+        if self._it is None:
+            # Watch before listing so that we see the changes made
+            # while we list it
+            self._gen = dir_cache().watch(self._key, self._fd)
+            if self._gen is not None:
+                self._collect = []
+            self._it = os.scandir(self._fd)
+
+        for _e in self._it:
+            _name = os.fsencode(_e.name)
+            _match = self._match is None or self._match(_name)
+            # The entries that do not match are only stat()ed for the cache
+            if not _match and self._collect is None:
+                continue
+            try:
+                _de = self._entry(_name, _e.stat(follow_symlinks=False))
+            except FileNotFoundError:
+                # Removed since we read the directory
+                continue
+            if self._collect is not None:
+                self._collect.append(_de)
+                if len(self._collect) > Config.dir_cache_entries:
+                    self._collect = None
+            if not _match:
+                continue
+            self._last = _de
+            self._taken = self._taken + 1
+            yield _de
+
+        self.close()
+        self._done = True
+        if self._collect is not None:
+            # The list is shared through the cache and is never modified
+            dir_cache().put(self._key, self._gen, self._collect)
+            self._collect = None
+
+    def batch(self, dic, max_len, reserve):
+        """
+        Encode the next entries that fit in max_len bytes, after reserve
+        bytes for the reply. Returns the buffer and the number of entries.
+        """
+        self._taken = 0
+        if self._entries is not None:
+            _b, _num = DirInfo.encode_batch(dic, self._scan(), max_len, reserve)
+            # The encoder takes the first entry that does not fit, it goes
+            # first in the next batch
+            if self._taken > _num:
+                self._pos = self._last
+        else:
+            _b, _num = DirInfo.encode_batch(dic, self._stream(), max_len,
+                                            reserve)
+            if self._taken > _num:
+                self._pending = self._last
+        return _b, _num
+
+class WriteStream(object):
+    """
+    A class for a WRITE whose data is not buffered with the rest of its
+    frame. The transport hands us the data in chunks as it arrives and
+    every chunk is written to the file straight away.
+    """
+
+    def __init__(self, srv, h, req, f, **kwargs):
+        self._srv = srv
+        self.h = h
+        self._f = f
+        self.fd = os.dup(f.fd)
+        lease_manager().modified(f)
+        self.offset = req.offset
+        self.length = req.length
+        self.received = 0
+        self.count = 0
+        self.pending = 0
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def write(self, buf, done):
+        """
+        Write the next chunk of data. done() is called once buf is no
+        longer needed.
+        """
+        if self.fd < 0:
+            done()
+            return
+        _offset = self.offset + self.received
+        self.received = self.received + len(buf)
+        self.pending = self.pending + 1
+        task = asyncio.ensure_future(self._srv._offload(os.pwrite, self.fd,
+                                                        buf, _offset))
+        task.add_done_callback(lambda t: self._written(t, done))
+
+    def _written(self, task, done):
+        self.pending = self.pending - 1
+        done()
+        if task.cancelled():
+            return
+        if task.exception():
+            e = task.exception()
+            print(e)
+            traceback.print_exception(e)
+            self.close()
+            self._srv._s.close()
+            return
+
+        self.count = self.count + task.result()
+        self._f.wrote(self.offset, self.count)
+        if self.received < self.length or self.pending:
+            return
+        self.close()
+        h = self.h
+        self._srv.SendReplies([(self._srv._reply_header(h, Status.SUCCESS,
+                                        RESPONSE, self._srv.credits.grant(h)),
+                                Write.encode(Direction.REPLY,
+                                             {'count': self.count,
+                                              }))])
 
 class Server(object):
     """
-    A class for a SMB2 Server
+    A class for a SMB2 Server.
+    It sends its replies through s, a transport such as a SocketTransport
+    or a MemoryTransport, see transport.py.
     """
 
-    sessions = {}
-    trees = {}
-    files = {}
-    dialect = 0
-    
     def __init__(self, s, **kwargs):
         self._s = s
+        self.sessions = {}
+        self.trees = {}
+        self.files = {}
+        self.dialect = 0
         self._sp = spnego.server(socket.gethostname())
         self._guest = False
         self._sesid = 1
         self._treeid = 1
         self._fileid = 1
-        self._last_fid = (0, 0)
+        self._async_id = 1
+        self._pending = {}
+        self._requests = {}
+        # The commands that may still go async, by message id, and the
+        # ones of them a CANCEL asked us to stop
+        self._running = {}
+        self._cancelled = set()
+        self.credits = Credits()
+        self.max_io_size = min(max(Config.max_io_size, 65536), 8388608)
         self.signing_key = None
         self._use_signing = False
+        # Leases are held by the client, over all of its connections
+        self.client_guid = bytes(16)
+        self.dir_leasing = False
+        dir_cache().attach(asyncio.get_running_loop())
 
         print('Socket', self._s)
-        self.Run()
 
     def __del__(self):
         True
 
-    def srv_read(self, hdr, pdu):
+    @property
+    def _compound_error(self):
+        return _compound_error_ctx.get()
+
+    @_compound_error.setter
+    def _compound_error(self, status):
+        _compound_error_ctx.set(status)
+
+    @property
+    def _compound(self):
+        return _compound_ctx.get()
+
+    @_compound.setter
+    def _compound(self, compound):
+        _compound_ctx.set(compound)
+
+    @property
+    def _last_fid(self):
+        return _last_fid_ctx.get()
+
+    @_last_fid.setter
+    def _last_fid(self, fid):
+        _last_fid_ctx.set(fid)
+
+    async def _offload(self, func, *args):
+        """
+        Run a blocking syscall on the io thread pool
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            io_executor(), func, *args)
+
+    def Disconnect(self):
+        """
+        Release all trees and open files once the client has gone away
+        """
+        for task in list(self._requests.values()) + list(self._running.values()):
+            task.cancel()
+        self._requests = {}
+        self._pending = {}
+        self._running = {}
+        for t in self.trees.values():
+            os.close(t[0])
+        self.trees = {}
+        for f in self.files.values():
+            lease_manager().close(f)
+        self.files = {}
+        self.sessions = {}
+        self._s.release()
+
+    async def srv_read(self, hdr, pdu):
         #
         # Read
         #
@@ -122,7 +514,7 @@ class Server(object):
             self._compound_error = Status.INVALID_PARAMETER
             return (self._compound_error,
                     ErrorResponse.encode({'error_data' : bytes(1)}))
-        _fid = pdu['file_id']
+        _fid = pdu.file_id
         if _fid == (0xffffffffffffffff, 0xffffffffffffffff):
             _fid = self._last_fid
 
@@ -133,21 +525,51 @@ class Server(object):
             return (self._compound_error,
                     ErrorResponse.encode({'error_data' : bytes(1)}))
 
+        if pdu.length > self.max_io_size:
+            self._compound_error = Status.INVALID_PARAMETER
+            return (self._compound_error,
+                    ErrorResponse.encode({'error_data' : bytes(1)}))
+
+        #
+        # Without signing, and outside of a compound, we send large reads
+        # straight from the file to the socket
+        #
+        _sendfile = not self._use_signing and not self._compound and \
+            pdu.length >= Config.sendfile_min_size
+
         _st = _f.stat()
-        if pdu['offset'] >= _st.st_size:
+        # Another handle, or process, may have changed the size since we
+        # cached it, make sure before we tell the client where the file
+        # ends. With sendfile the reply promises the number of bytes we
+        # send so it always has to be the size of the file right now.
+        if _sendfile or pdu.offset + pdu.length > _st.st_size:
+            _f.invalidate()
+            _st = _f.stat()
+        if pdu.offset >= _st.st_size:
             self._compound_error = Status.END_OF_FILE
             return (self._compound_error,
                     ErrorResponse.encode({'error_data' : bytes(1)}))
             
-        _b = _f.pread(pdu['length'], pdu['offset'])
+        _count = min(pdu.length, _st.st_size - pdu.offset)
+        if _sendfile and _count >= Config.sendfile_min_size:
+            return (Status.SUCCESS,
+                    Read.encode(Direction.REPLY,
+                           {'data_remaining': 0,
+                            'data_length': _count,
+                            }),
+                    FileRange(_f.fd, pdu.offset, _count))
+
+        _b = await self._offload(_f.pread, pdu.length, pdu.offset)
+        # The data is sent as its own buffer after the reply
         return (Status.SUCCESS,
                 Read.encode(Direction.REPLY,
                        {'data_remaining': 0,
-                        'data': _b,
-                        }))
+                        'data_length': len(_b),
+                        }),
+                _b)
 
         
-    def srv_write(self, hdr, pdu):
+    async def srv_write(self, hdr, pdu):
         #
         # Write
         #
@@ -155,7 +577,7 @@ class Server(object):
             self._compound_error = Status.INVALID_PARAMETER
             return (self._compound_error,
                     ErrorResponse.encode({'error_data' : bytes(1)}))
-        _fid = pdu['file_id']
+        _fid = pdu.file_id
         if _fid == (0xffffffffffffffff, 0xffffffffffffffff):
             _fid = self._last_fid
 
@@ -166,13 +588,20 @@ class Server(object):
             return (self._compound_error,
                     ErrorResponse.encode({'error_data' : bytes(1)}))
 
-        _len = os.pwrite(_f.fd, pdu['data'], pdu['offset'])
+        if pdu.length > self.max_io_size:
+            self._compound_error = Status.INVALID_PARAMETER
+            return (self._compound_error,
+                    ErrorResponse.encode({'error_data' : bytes(1)}))
+
+        lease_manager().modified(_f)
+        _len = await self._offload(os.pwrite, _f.fd, pdu.data, pdu.offset)
+        _f.wrote(pdu.offset, _len)
         return (Status.SUCCESS,
                 Write.encode(Direction.REPLY,
                              {'count': _len,
                               }))
 
-    def srv_close(self, hdr, pdu):
+    async def srv_close(self, hdr, pdu):
         #
         # Close
         #
@@ -182,38 +611,44 @@ class Server(object):
                     ErrorResponse.encode({'error_data' : bytes(1)}))
         t = self.trees[hdr['tree_id']]
 
-        _fid = pdu['file_id']
+        _fid = pdu.file_id
         if _fid == (0xffffffffffffffff, 0xffffffffffffffff):
             _fid = self._last_fid
 
+        # Gone from the handles before we wait for the io threads, so
+        # nothing else uses it meanwhile
         try:
-            _f = self.files[_fid]
+            _f = self.files.pop(_fid)
         except KeyError:
             self._compound_error = Status.INVALID_PARAMETER
             return (self._compound_error,
                     ErrorResponse.encode({'error_data' : bytes(1)}))
-        if _f.delete_on_close:
-            if _f.flags & os.O_DIRECTORY:
-                try:
-                    os.rmdir(_f.path, dir_fd=t[0])
-                except OSError:
-                    del self.files[_fid]
-                    del _f
-                    return (Status.DIRECTORY_NOT_EMPTY,
-                            Close.encode(Direction.REPLY,
-                                         {'flags': 0,
-                                          }))
-            else:
-                os.unlink(_f.path, dir_fd=t[0])
-        del self.files[_fid]
+        _status = Status.SUCCESS
+        try:
+            if _f.delete_on_close:
+                if _f.flags & os.O_DIRECTORY:
+                    try:
+                        await self._offload(lambda: os.rmdir(_f.path, dir_fd=t[0]))
+                        _f.invalidate()
+                        dir_cache().invalidate_parent(t[0], _f.path, by=_f.parent_lease)
+                    except OSError:
+                        _status = Status.DIRECTORY_NOT_EMPTY
+                else:
+                    await self._offload(lambda: os.unlink(_f.path, dir_fd=t[0]))
+                    _f.invalidate()
+                    dir_cache().invalidate_parent(t[0], _f.path, by=_f.parent_lease)
+        finally:
+            # After the delete, whose inotify events are still those of
+            # the open
+            lease_manager().close(_f)
         del _f
-        return (Status.SUCCESS,
+        return (_status,
                 Close.encode(Direction.REPLY,
                        {'flags': 0,
                         }))
 
 
-    def srv_flush(self, hdr, pdu):
+    async def srv_flush(self, hdr, pdu):
         #
         # Flush
         #
@@ -221,7 +656,7 @@ class Server(object):
             self._compound_error = Status.INVALID_PARAMETER
             return (self._compound_error,
                     ErrorResponse.encode({'error_data' : bytes(1)}))
-        _fid = pdu['file_id']
+        _fid = pdu.file_id
         if _fid == (0xffffffffffffffff, 0xffffffffffffffff):
             _fid = self._last_fid
 
@@ -231,13 +666,13 @@ class Server(object):
             self._compound_error = Status.INVALID_PARAMETER
             return (self._compound_error,
                     ErrorResponse.encode({'error_data' : bytes(1)}))
-        os.fsync(_f.fd)
+        await self._offload(os.fsync, _f.fd)
         return (Status.SUCCESS,
                 Flush.encode(Direction.REPLY,
                        {}))
 
 
-    def srv_query_dir(self, hdr, pdu):
+    async def srv_query_dir(self, hdr, pdu):
         #
         # Query Directory
         #
@@ -246,14 +681,14 @@ class Server(object):
             return (self._compound_error,
                     ErrorResponse.encode({'error_data' : bytes(1)}))
         try:
-            DirInfoClass(pdu['info_class'])
+            DirInfoClass(pdu.info_class)
         except ValueError:
-            print('QueryDir: Can not handle info_type', pdu['info_class'])
+            print('QueryDir: Can not handle info_type', pdu.info_class)
             self._compound_error = Status.INVALID_PARAMETER
             return (self._compound_error,
                     ErrorResponse.encode({'error_data' : bytes(1)}))
 
-        _fid = pdu['file_id']
+        _fid = pdu.file_id
         if _fid == (0xffffffffffffffff, 0xffffffffffffffff):
             _fid = self._last_fid
 
@@ -264,32 +699,40 @@ class Server(object):
             return (self._compound_error,
                     ErrorResponse.encode({'error_data' : bytes(1)}))
 
-        if pdu['flags'] & (SMB2_RESTART_SCANS | SMB2_REOPEN):
-            _f.scandir()
-
-        if not _f.de:
-            self._compound_error = Status.NO_MORE_FILES
+        # Only one query at a time moves the cursor of a handle
+        async with _f.cursor_lock:
+            _first = pdu.flags & (SMB2_RESTART_SCANS | SMB2_REOPEN) or not _f.cursor
+            if _first:
+                if _f.cursor:
+                    _f.cursor.close()
+                # The search pattern only counts when the listing starts
+                _f.cursor = DirCursor(_f, bytes(pdu.name))
+
+            # Encode the entries that fit in one pass, after room for the reply.
+            # Entries that are not cached are read on the io threads.
+            _dic = DirInfoClass(pdu.info_class)
+            _rep_size = QueryDirectory.encoded_size(Direction.REPLY,
+                                                    {'data_length': 0})
+            if _f.cursor.cached:
+                _b, _num = _f.cursor.batch(_dic, pdu.output_buffer_length, _rep_size)
+            else:
+                _b, _num = await self._offload(_f.cursor.batch, _dic,
+                                               pdu.output_buffer_length, _rep_size)
+            _done = _f.cursor.done
+        if not _num:
+            if _first and _done and pdu.name not in (b'', b'*'):
+                # Nothing matched the pattern
+                self._compound_error = Status.NO_SUCH_FILE
+            elif _done:
+                self._compound_error = Status.NO_MORE_FILES
+            else:
+                self._compound_error = Status.INFO_LENGTH_MISMATCH
             return (self._compound_error,
                     ErrorResponse.encode({'error_data' : bytes(1)}))
-            
-        _b = bytearray(0)
-        _obl = pdu['output_buffer_length']
-        _pos = 0
-        while _f.de:
-            _i = DirInfo.encode_single(
-                DirInfoClass(pdu['info_class']), _f.de[0][1])
-            if len(_i) > _obl:
-                break
-            _f.de = _f.de[1:]
-            
-            _obl = _obl - len(_i)
-            _pos = len(_b)
-            _b = _b + _i
-        struct.pack_into('<I', _b, _pos, 0)
-        return (Status.SUCCESS,
-                QueryDirectory.encode(Direction.REPLY,
-                       {'data': _b,
-                        }))
+
+        QueryDirectory.encode_into(Direction.REPLY, _b, 0,
+                                   {'data_length': len(_b) - _rep_size})
+        return (Status.SUCCESS, _b)
 
     def _query_file_info(self, f, c):
         try:
@@ -338,7 +781,7 @@ class Server(object):
                                 {'buffer': _fi,
                                  }))
 
-    def _query_fs_info(self, t, c):
+    async def _query_fs_info(self, t, c):
         try:
             _ = FSInfoClass(c)
         except:
@@ -378,7 +821,7 @@ class Server(object):
                      }))
 
         if FSInfoClass(c) == FSInfoClass.SECTOR_SIZE:
-            _stfs = os.fstatvfs(t[0])
+            _stfs = await self._offload(os.fstatvfs, t[0])
             _fi = FSInfo.encode(FSInfoClass.SECTOR_SIZE,
                     {'logical_bytes_per_sector': _stfs.f_bsize,
                      'physical_bytes_per_sector_for_atomicity': _stfs.f_bsize,
@@ -394,7 +837,7 @@ class Server(object):
                      }))
         
         if FSInfoClass(c) == FSInfoClass.FULL_SIZE:
-            _stfs = os.fstatvfs(t[0])
+            _stfs = await self._offload(os.fstatvfs, t[0])
             _fi = FSInfo.encode(FSInfoClass.FULL_SIZE,
                     {'total_allocation_units': _stfs.f_blocks,
                      'caller_available_allocation_units': _stfs.f_bavail,
@@ -411,7 +854,7 @@ class Server(object):
         return (Status.INVALID_PARAMETER,
                 ErrorResponse.encode({'error_data' : bytes(1)}))
             
-    def srv_query_info(self, hdr, pdu):
+    async def srv_query_info(self, hdr, pdu):
         #
         # Query Info
         # can only handle INFO_FILE for now
@@ -421,7 +864,7 @@ class Server(object):
             return (self._compound_error,
                     ErrorResponse.encode({'error_data' : bytes(1)}))
 
-        _fid = pdu['file_id']
+        _fid = pdu.file_id
         if _fid == (0xffffffffffffffff, 0xffffffffffffffff):
             _fid = self._last_fid
 
@@ -432,20 +875,20 @@ class Server(object):
             return (self._compound_error,
                     ErrorResponse.encode({'error_data' : bytes(1)}))
 
-        if pdu['info_type'] == SMB2_0_INFO_FILE:
-            return self._query_file_info(_f, pdu['file_info_class'])
+        if pdu.info_type == SMB2_0_INFO_FILE:
+            return self._query_file_info(_f, pdu.file_info_class)
         
-        if pdu['info_type'] == SMB2_0_INFO_FILESYSTEM:
-            return self._query_fs_info(self.trees[hdr['tree_id']], pdu['file_info_class'])
+        if pdu.info_type == SMB2_0_INFO_FILESYSTEM:
+            return await self._query_fs_info(self.trees[hdr['tree_id']], pdu.file_info_class)
         
-        print('QueryInfo: Can not handle info type', pdu['info_type'])
+        print('QueryInfo: Can not handle info type', pdu.info_type)
         self._compound_error = Status.INVALID_PARAMETER
         return (self._compound_error,
                 ErrorResponse.encode({'error_data' : bytes(1)}))
 
 
-    def _set_file_info(self, f, t, pdu):
-        c = pdu['file_info_class']
+    async def _set_file_info(self, f, t, pdu):
+        c = pdu.file_info_class
         try:
             _ = FileInfoClass(c)
         except:
@@ -453,13 +896,18 @@ class Server(object):
             return (Status.INVALID_PARAMETER,
                     ErrorResponse.encode({'error_data' : bytes(1)}))
 
-        buffer = FileInfo.decode(FileInfoClass(c), pdu['buffer'])
+        buffer = FileInfo.decode(FileInfoClass(c), pdu.buffer)
         if FileInfoClass(c) == FileInfoClass.END_OF_FILE_INFORMATION:
-            os.truncate(f.fd, buffer['end_of_file'])
+            lease_manager().modified(f)
+            await self._offload(os.truncate, f.fd, buffer['end_of_file'])
+            f.invalidate()
+            dir_cache().invalidate_parent(t[0], f.path, by=f.parent_lease)
             return (Status.SUCCESS,
                     SetInfo.encode(Direction.REPLY,
                                      {}))
         if FileInfoClass(c) == FileInfoClass.DISPOSITION_INFORMATION:
+            if buffer['delete_pending']:
+                await lease_manager().unlinking(f)
             f.delete_on_close = buffer['delete_pending']
             return (Status.SUCCESS,
                     SetInfo.encode(Direction.REPLY,
@@ -468,12 +916,24 @@ class Server(object):
             a = (buffer['last_access_time'][0], buffer['last_write_time'][0])
             if a[0] == 0:
                 a = (int(time.time()), a[1])
-            os.utime(f.fd, times=a)
+            await self._offload(lambda: os.utime(f.fd, times=a))
+            f.invalidate()
+            dir_cache().invalidate_parent(t[0], f.path, by=f.parent_lease)
             return (Status.SUCCESS,
                     SetInfo.encode(Direction.REPLY,
                                      {}))
         if FileInfoClass(c) == FileInfoClass.RENAME_INFORMATION:
-            os.rename(f.path, buffer['filename'], src_dir_fd=t[0], dst_dir_fd=t[0])
+            await lease_manager().unlinking(f)
+            with lease_manager().renaming(f.parent_lease, buffer['filename']):
+                await self._offload(lambda: os.rename(f.path, buffer['filename'],
+                                                      src_dir_fd=t[0], dst_dir_fd=t[0]))
+            f.invalidate()
+            dir_cache().invalidate_parent(t[0], f.path, buffer['filename'],
+                                          by=f.parent_lease)
+            # A later delete on close, or rename, is of the new name
+            f.path = buffer['filename']
+            if f.parent is not None:
+                f.parent = await self._offload(file_key, os.path.dirname(f.path), t[0])
             return (Status.SUCCESS,
                     SetInfo.encode(Direction.REPLY,
                                      {}))
@@ -482,7 +942,7 @@ class Server(object):
         return (Status.INVALID_PARAMETER,
                 ErrorResponse.encode({'error_data' : bytes(1)}))
     
-    def srv_set_info(self, hdr, pdu):
+    async def srv_set_info(self, hdr, pdu):
         #
         # Set Info
         #
@@ -492,7 +952,7 @@ class Server(object):
                     ErrorResponse.encode({'error_data' : bytes(1)}))
         t = self.trees[hdr['tree_id']]
 
-        _fid = pdu['file_id']
+        _fid = pdu.file_id
         if _fid == (0xffffffffffffffff, 0xffffffffffffffff):
             _fid = self._last_fid
 
@@ -503,16 +963,55 @@ class Server(object):
             return (self._compound_error,
                     ErrorResponse.encode({'error_data' : bytes(1)}))
 
-        if pdu['info_type'] == SMB2_0_INFO_FILE:
-            return self._set_file_info(_f, t, pdu)
+        if pdu.info_type == SMB2_0_INFO_FILE:
+            return await self._set_file_info(_f, t, pdu)
         
-        print('SetInfo: Can not handle info type', pdu['info_type'])
+        print('SetInfo: Can not handle info type', pdu.info_type)
         self._compound_error = Status.INVALID_PARAMETER
         return (self._compound_error,
                 ErrorResponse.encode({'error_data' : bytes(1)}))
 
         
-    def srv_create(self, hdr, pdu):
+    def srv_oplock_break(self, hdr, pdu):
+        #
+        # Oplock or Lease Break Acknowledgment
+        #
+        if 'lease_key' in pdu:
+            _status = lease_manager().ack_lease(self, pdu.lease_key,
+                                                pdu.lease_state)
+            if _status != Status.SUCCESS:
+                self._compound_error = _status
+                return (self._compound_error,
+                        ErrorResponse.encode({'error_data' : bytes(1)}))
+            return (Status.SUCCESS,
+                    OplockBreak.encode(Direction.REPLY,
+                           {'flags': 0,
+                            'lease_key': pdu.lease_key,
+                            'lease_state': pdu.lease_state,
+                            }))
+
+        if not hdr['tree_id'] in self.trees:
+            self._compound_error = Status.INVALID_PARAMETER
+            return (self._compound_error,
+                    ErrorResponse.encode({'error_data' : bytes(1)}))
+        try:
+            _f = self.files[pdu.file_id]
+        except KeyError:
+            self._compound_error = Status.INVALID_PARAMETER
+            return (self._compound_error,
+                    ErrorResponse.encode({'error_data' : bytes(1)}))
+        _status = lease_manager().ack_oplock(_f, pdu.oplock_level)
+        if _status != Status.SUCCESS:
+            self._compound_error = _status
+            return (self._compound_error,
+                    ErrorResponse.encode({'error_data' : bytes(1)}))
+        return (Status.SUCCESS,
+                OplockBreak.encode(Direction.REPLY,
+                       {'oplock_level': pdu.oplock_level,
+                        'file_id': pdu.file_id,
+                        }))
+
+    async def srv_create(self, hdr, pdu):
         #
         # Create/Open
         #
@@ -527,9 +1026,9 @@ class Server(object):
             flags |= os.O_BINARY
         _r = False
         _w = False
-        if pdu['desired_access'] & (FILE_GENERIC_WRITE | FILE_GENERIC_ALL | FILE_WRITE_ATTRIBUTES | FILE_WRITE_EA | FILE_WRITE_DATA):
+        if pdu.desired_access & (FILE_GENERIC_WRITE | FILE_GENERIC_ALL | FILE_WRITE_ATTRIBUTES | FILE_WRITE_EA | FILE_WRITE_DATA):
             _w = True
-        if pdu['desired_access'] & (FILE_GENERIC_READ | FILE_GENERIC_ALL | FILE_READ_ATTRIBUTES | FILE_READ_EA | FILE_READ_DATA):
+        if pdu.desired_access & (FILE_GENERIC_READ | FILE_GENERIC_ALL | FILE_READ_ATTRIBUTES | FILE_READ_EA | FILE_READ_DATA):
             _r = True
         if _r and not _w:
             flags = flags | os.O_RDONLY
@@ -538,38 +1037,117 @@ class Server(object):
         if not _r and _w:
             flags = flags | os.O_WRONLY
 
-        if Disposition(pdu['create_disposition']) == Disposition.OPEN:
+        if Disposition(pdu.create_disposition) == Disposition.OPEN:
             True
-        elif Disposition(pdu['create_disposition']) == Disposition.CREATE:
+        elif Disposition(pdu.create_disposition) == Disposition.CREATE:
             flags = flags | os.O_CREAT | os.O_EXCL
-        elif Disposition(pdu['create_disposition']) == Disposition.OPEN_IF:
+        elif Disposition(pdu.create_disposition) == Disposition.OPEN_IF:
             flags = flags | os.O_CREAT
-        elif Disposition(pdu['create_disposition']) == Disposition.OVERWRITE:
+        elif Disposition(pdu.create_disposition) == Disposition.OVERWRITE:
             flags = flags | os.O_TRUNC
         else:
-            print('Create disposition', pdu['create_disposition'], 'not yet supported')
+            print('Create disposition', pdu.create_disposition, 'not yet supported')
             self._compound_error = Status.INVALID_PARAMETER
             return (self._compound_error,
                     ErrorResponse.encode({'error_data' : bytes(1)}))
 
-        if pdu['create_options'] & FILE_DIRECTORY_FILE:
-            flags = flags | os.O_DIRECTORY
-            if flags & os.O_CREAT:
-                os.mkdir(pdu['path'].decode(), dir_fd=t[0])
-                flags = os.O_RDONLY
+        # The directory the file is in changes if we create or truncate it
+        _changed = flags & (os.O_CREAT | os.O_TRUNC)
+        # With leases the other clients must flush what they cache before
+        # we truncate
+        _trunc = False
+        if flags & os.O_TRUNC and flags & (os.O_WRONLY | os.O_RDWR) and \
+           lease_manager().enabled:
+            flags = flags & ~os.O_TRUNC
+            _trunc = True
+
+        # The lease the client asks for. A lease key can only be used for
+        # one file, so check that before we create or truncate anything.
+        _rqls = None
+        if pdu.requested_oplock_level == Oplock.LEVEL_LEASE.value and \
+           lease_manager().enabled:
+            _rqls = pdu.contexts.get('RqLs')
+        if _rqls:
+            _lf = lease_manager().lease_file(self, _rqls['lease_key'])
+            if _lf is not None and \
+               _lf != await self._offload(file_key, pdu.path.decode(), t[0]):
+                self._compound_error = Status.INVALID_PARAMETER
+                return (self._compound_error,
+                        ErrorResponse.encode({'error_data' : bytes(1)}))
+
+        # Made under the lease of the client on the directory, what we
+        # change there from now on does not break that lease
+        _pl = None
+        if _rqls and 'parent_lease_key' in _rqls and \
+           _rqls['lease_flags'] & SMB2_LEASE_FLAG_PARENT_LEASE_KEY_SET:
+            _pl = lease_manager().parent_lease(self, _rqls['parent_lease_key'],
+                                               pdu.path.decode())
 
         try:
-            f = File(pdu['path'].decode(), flags, t[0])
+            if pdu.create_options & FILE_DIRECTORY_FILE:
+                flags = flags | os.O_DIRECTORY
+                if flags & os.O_CREAT:
+                    await self._offload(lambda: os.mkdir(pdu.path.decode(),
+                                                         dir_fd=t[0]))
+                    flags = os.O_RDONLY | os.O_DIRECTORY
+
+            if flags & os.O_CREAT and not flags & os.O_EXCL:
+                # Opening a file that is already there does not change
+                # the directory, or break its leases
+                try:
+                    f = await self._offload(File, pdu.path.decode(),
+                                            flags & ~os.O_CREAT, t[0])
+                    _changed = flags & os.O_TRUNC or _trunc
+                except FileNotFoundError:
+                    f = await self._offload(File, pdu.path.decode(), flags, t[0])
+            else:
+                f = await self._offload(File, pdu.path.decode(), flags, t[0])
             _st = f.stat()
         except FileNotFoundError:
+            lease_manager().release(_pl)
             self._compound_error = Status.OBJECT_NAME_NOT_FOUND
             return (self._compound_error,
                     ErrorResponse.encode({'error_data' : bytes(1)}))
+        except BaseException:
+            lease_manager().release(_pl)
+            raise
+        f.parent_lease = _pl
+
+        # The lease, or oplock, the client asks for. Directories only get
+        # read and handle leases.
+        _requested = oplock_state(pdu.requested_oplock_level)
+        if pdu.requested_oplock_level == Oplock.LEVEL_LEASE.value and \
+           lease_manager().enabled:
+            _requested = _rqls['lease_state'] if _rqls else 0
+        if stat.S_ISDIR(_st.st_mode):
+            _requested = _requested & (SMB2_LEASE_READ_CACHING |
+                                       SMB2_LEASE_HANDLE_CACHING) \
+                if _rqls and self.dir_leasing else 0
 
-        if pdu['create_options'] & FILE_DELETE_ON_CLOSE:
-            f.delete_on_close = True
-        self._last_fid = (self._fileid, self._fileid)
+        _fid = (self._fileid, self._fileid)
         self._fileid = self._fileid + 1
+        # Until the File is in self.files nothing else closes it, if we are
+        # cancelled, or fail, while we wait
+        try:
+            _l = await lease_manager().open(self, _fid, f, _requested,
+                                            lease_key=_rqls['lease_key'] if _rqls else None,
+                                            v2=bool(_rqls) and 'parent_lease_key' in _rqls,
+                                            changes_data=_trunc)
+            if _trunc:
+                await self._offload(os.ftruncate, f.fd, 0)
+                f.invalidate()
+                _st = f.stat()
+        except BaseException:
+            lease_manager().close(f)
+            f.close()
+            raise
+        finally:
+            if _changed:
+                dir_cache().invalidate_parent(t[0], f.path, by=f.parent_lease)
+
+        if pdu.create_options & FILE_DELETE_ON_CLOSE:
+            f.delete_on_close = True
+        self._last_fid = _fid
         self.files.update({self._last_fid: f})
 
         _a = FILE_ATTRIBUTE_SPARSE_FILE
@@ -577,16 +1155,30 @@ class Server(object):
             _a = _a | FILE_ATTRIBUTE_DIRECTORY
 
         contexts = {}
-        for ctx in pdu['contexts']:
+        for ctx in pdu.contexts:
             if ctx == 'QFid':
                 contexts.update({'QFid': {'disk_file_id': _st.st_ino,
                                           'volume_id': _st.st_dev}})
+            elif ctx == 'RqLs':
+                # Granted, or not, with the oplock below
+                True
             else:
                 print('Can not handle Create context', ctx, 'yet')
 
+        _oplock = oplock_level(_l.state if _l else 0)
+        if _rqls:
+            _oplock = Oplock.LEVEL_LEASE.value
+            _ls = {'lease_key': _rqls['lease_key'],
+                   'lease_state': _l.state if _l else 0}
+            if 'parent_lease_key' in _rqls:
+                _ls.update({'lease_flags': _rqls['lease_flags'] & SMB2_LEASE_FLAG_PARENT_LEASE_KEY_SET,
+                            'parent_lease_key': _rqls['parent_lease_key'],
+                            'epoch': _l.epoch if _l else 0})
+            contexts.update({'RqLs': _ls})
+
         return (Status.SUCCESS,
                 Create.encode(Direction.REPLY,
-                       {'oplock_level': Oplock.LEVEL_NONE.value,
+                       {'oplock_level': _oplock,
                         'flags': 0,
                         'create_action': Action.OPENED.value,
                         'creation_time': (0, 0, 0),
@@ -618,7 +1210,7 @@ class Server(object):
         #
         # Connect to a share
         #
-        _p = pdu['path'][2:].decode().replace('\\', '/')
+        _p = pdu.path[2:].decode().replace('\\', '/')
         _p = _p[_p.find('/') + 1:]
         if not _p in Config.shares:
             print('Share not found', _p)
@@ -670,7 +1262,7 @@ class Server(object):
 
     def srv_sess_setup(self, hdr, pdu):
         try:
-            sm = self._sp.step(pdu['security_buffer'])
+            sm = self._sp.step(bytes(pdu.security_buffer))
         except Exception as e:
             if Config.guest_login:
                 if Config.signing_required:
@@ -719,31 +1311,43 @@ class Server(object):
         
     def srv_neg_prot(self, hdr, pdu):
         if Config.signing_required:
-            if pdu['security_mode'] & SMB2_NEGOTIATE_SIGNING_ENABLED == 0:
+            if pdu.security_mode & SMB2_NEGOTIATE_SIGNING_ENABLED == 0:
                 print('Signing required but client does not offer signing')
                 raise ValueError
         if Config.signing_enabled:
-            if pdu['security_mode'] & SMB2_NEGOTIATE_SIGNING_ENABLED != 0:
+            if pdu.security_mode & SMB2_NEGOTIATE_SIGNING_ENABLED != 0:
                 self._use_signing = True
         else:
-            if pdu['security_mode'] & SMB2_NEGOTIATE_SIGNING_REQUIRED != 0:
+            if pdu.security_mode & SMB2_NEGOTIATE_SIGNING_REQUIRED != 0:
                 print('Signing disabled but client requires it')
                 raise ValueError
 
         # Only allow version 3.02
-        if not VERSION_0302 in pdu['dialects']:
+        if not VERSION_0302 in pdu.dialects:
             print('No supported dialect in Negotiate Protocol')
             return (Status.INVALID_PARAMETER,
                     ErrorResponse.encode({'error_data' : bytes(1)}))
         self.dialect = VERSION_0302
+        self.client_guid = bytes(pdu.get('client_guid', bytes(16)))
+        _caps = SMB2_GLOBAL_CAP_LARGE_MTU
+        if lease_manager().enabled:
+            _caps = _caps | SMB2_GLOBAL_CAP_LEASING
+            # Directory leases need inotify, to see the changes made
+            # outside of the server
+            if Config.dir_leases and dir_cache().watching:
+                _caps = _caps | SMB2_GLOBAL_CAP_DIRECTORY_LEASING
+                self.dir_leasing = True
+        # LARGE_MTU: reads and writes of up to max_io_size, charged
+        # one credit per 64k
+        self.credits.multi_credit = True
         return (Status.SUCCESS,
                 NegotiateProtocol.encode(Direction.REPLY,
                        {'security_mode': SMB2_NEGOTIATE_SIGNING_ENABLED,
                         'dialect_revision': self.dialect,
-                        'capabilities': 0,
-                        'max_transact_size': 65536,
-                        'max_read_size': 65536,
-                        'max_write_size': 65536,
+                        'capabilities': _caps,
+                        'max_transact_size': self.max_io_size,
+                        'max_read_size': self.max_io_size,
+                        'max_write_size': self.max_io_size,
                         'system_time': (int(time.time()), 0, 0)}))
 
     def VerifySignature(self, hdr, cmd):
@@ -751,25 +1355,115 @@ class Server(object):
             print('Can not compute signature for 2.02 yet')
             raise ValueError
         else:
+            # cmd may be a view into the receive buffer, so hash the
+            # pieces instead of building a copy with the signature zeroed
             mac = cmd[48:64]
-            zsc = cmd[:48] + bytes(16) + cmd[64:]
             co = CMAC.new(self.signing_key, ciphermod=AES)
-            co.update(zsc)
+            co.update(cmd[:48])
+            co.update(bytes(16))
+            co.update(cmd[64:])
             co.verify(mac)
 
-    def ComputeSignature(self, buf):
+    def ComputeSignature(self, bufs):
         if self.dialect == VERSION_0202:
             print('Can not compute signature for 2.02 yet')
             raise ValueError
         else:
             co = CMAC.new(self.signing_key, ciphermod=AES)
-            co.update(buf)
+            for b in bufs:
+                co.update(b)
             d = co.digest()
             return d
 
-    def ProcessCommands(self, cmds):
+    def _reply_header(self, h, status, flags, credit_response, async_id=0):
+        rh = {'protocol_id': SMB2_MAGIC,
+              'credit_charge': h['credit_charge'],
+              'status': status.value,
+              'command': h['command'],
+              'credit_response': credit_response,
+              'flags': flags,
+              'message_id': h['message_id'],
+              'process_id': h['process_id'],
+              'tree_id': h['tree_id'],
+              'session_id': h['session_id']}
+        if async_id:
+            rh.update({'flags': flags | ASYNC,
+                       'async_id': async_id})
+        return Header.encode(rh)
+
+    async def _go_async(self, h, f, rep):
+        """
+        Give a slow command Config.pending_timeout seconds to complete.
+        If it has not completed by then we send an interim STATUS_PENDING
+        reply and keep waiting for it.
+        Returns the reply and the async id, which is 0 unless the command
+        went async. A command stopped by a CANCEL completes with
+        STATUS_CANCELLED.
+        """
+        task = asyncio.ensure_future(rep)
+        _mid = h['message_id']
+        _aid = 0
+        self._running.update({_mid: task})
+        try:
+            done, _ = await asyncio.wait({task}, timeout=Config.pending_timeout)
+            if done:
+                return task.result(), 0
+
+            _aid = self._async_id
+            self._async_id = self._async_id + 1
+            self._pending.update({_aid: task})
+
+            # Interim responses are not signed
+            self.SendReplies([(self._reply_header(h, Status.PENDING, f & ~SIGNED,
+                                                  self.credits.grant(h),
+                                                  async_id=_aid),
+                               ErrorResponse.encode({'error_data' : bytes(1)}))])
+            return await task, _aid
+        except asyncio.CancelledError:
+            if not task in self._cancelled:
+                raise
+            return (Status.CANCELLED,
+                    ErrorResponse.encode({'error_data' : bytes(1)})), _aid
+        finally:
+            self._running.pop(_mid, None)
+            self._pending.pop(_aid, None)
+            self._cancelled.discard(task)
+
+    def Cancel(self, h):
+        """
+        A CANCEL of the request with the async id, or the message id, of
+        h. It takes no credits and gets no reply of its own, the request
+        completes with STATUS_CANCELLED instead. Requests that are not
+        running, or that already completed, are left alone.
+        """
+        if h['flags'] & ASYNC:
+            task = self._pending.get(h['async_id'])
+        else:
+            task = self._running.get(h['message_id'])
+        if task is None or task.done():
+            return
+        self._cancelled.add(task)
+        task.cancel()
+
+    def _payload_size(self, h, req):
+        """
+        The largest of the request and the expected reply payload,
+        for charging multi-credit requests
+        """
+        if h['command'] in (Command.READ.value, Command.WRITE.value):
+            return req.length
+        if h['command'] == Command.QUERY_DIRECTORY.value:
+            return req.output_buffer_length
+        if h['command'] == Command.QUERY_INFO.value:
+            return max(req.output_buffer_length, len(req.get('buffer', b'')))
+        if h['command'] == Command.SET_INFO.value:
+            return len(req.buffer)
+        return 0
+
+    async def ProcessCommands(self, cmds):
         r = []
         self._compound_error = Status.SUCCESS
+        self._compound = len(cmds) > 1
         for cmd in cmds:
             #
             # Decode the command pdu
@@ -791,6 +1485,7 @@ class Server(object):
                 Command.QUERY_INFO: (QueryInfo, self.srv_query_info),
                 Command.QUERY_DIRECTORY: (QueryDirectory, self.srv_query_dir),
                 Command.SET_INFO: (SetInfo, self.srv_set_info),
+                Command.OPLOCK_BREAK: (OplockBreak, self.srv_oplock_break),
                 }
 
             f = RESPONSE
@@ -804,17 +1499,8 @@ class Server(object):
                 f = f | SIGNED
 
             if self._compound_error != Status.SUCCESS:
-                rh = Header.encode({'protocol_id': SMB2_MAGIC,
-                                    'credit_charge': h['credit_charge'],
-                                    'status': self._compound_error.value,
-                                    'command': h['command'],
-                                    'credit_response': h['credit_request'],
-                                    'flags': f,
-                                    'message_id': h['message_id'],
-                                    'process_id': h['process_id'],
-                                    'tree_id': h['tree_id'],
-                                    'session_id': h['session_id']})
-                r.append((rh,
+                r.append((self._reply_header(h, self._compound_error, f,
+                                             self.credits.grant(h)),
                     ErrorResponse.encode({'error_data' : bytes(1)})))
                 continue
 
@@ -823,36 +1509,37 @@ class Server(object):
                 req = c[0].decode(Direction.REQUEST, cmd[1][64:])
             except:
                 print('Can not handle command', h['command'], 'yet.')
-                rh = Header.encode({'protocol_id': SMB2_MAGIC,
-                                    'credit_charge': h['credit_charge'],
-                                    'status': Status.INVALID_PARAMETER.value,
-                                    'command': h['command'],
-                                    'credit_response': h['credit_request'],
-                                    'flags': f,
-                                    'message_id': h['message_id'],
-                                    'process_id': h['process_id'],
-                                    'tree_id': h['tree_id'],
-                                    'session_id': h['session_id']})
-                r.append((rh,
+                r.append((self._reply_header(h, Status.INVALID_PARAMETER, f,
+                                             self.credits.grant(h)),
+                          ErrorResponse.encode({'error_data' : bytes(1)})))
+                continue
+
+            if not self.credits.charge_ok(h, self._payload_size(h, req)):
+                print('Credit charge', h['credit_charge'], 'too small')
+                self._compound_error = Status.INVALID_PARAMETER
+                r.append((self._reply_header(h, self._compound_error, f,
+                                             self.credits.grant(h)),
                           ErrorResponse.encode({'error_data' : bytes(1)})))
                 continue
 
             rep = c[1](h, req)
+            _aid = 0
+            if asyncio.iscoroutine(rep):
+                # Only a command on its own may go async, inside a
+                # compound we just wait for it.
+                if len(cmds) == 1:
+                    rep, _aid = await self._go_async(h, f, rep)
+                else:
+                    rep = await rep
 
             if h['command'] == Command.SESSION_SETUP.value and self._use_signing and rep[0].value == 0:
                 f = f | SIGNED
 
-            rh = Header.encode({'protocol_id': SMB2_MAGIC,
-                                'credit_charge': h['credit_charge'],
-                                'status': rep[0].value,
-                                'command': h['command'],
-                                'credit_response': h['credit_request'],
-                                'flags': f,
-                                'message_id': h['message_id'],
-                                'process_id': h['process_id'],
-                                'tree_id': h['tree_id'],
-                                'session_id': h['session_id']})
-            r.append((rh, rep[1]))
+            # Credits for an async command were granted in the interim
+            # response
+            r.append((self._reply_header(h, rep[0], f,
+                                         0 if _aid else self.credits.grant(h),
+                                         async_id=_aid),) + tuple(rep[1:]))
 
             # next command need special handling to write straight into the
             # encoded buffer and adding padding
@@ -860,80 +1547,184 @@ class Server(object):
 
     def SplitBuffer(self, buf):
         cmds = []
-        while buf:
-            _h = Header.decode(buf[:64])
+        _pos = 0
+        while _pos < len(buf):
+            _h = Header.decode(buf, _pos)
             if _h['protocol_id'] != SMB2_MAGIC:
                 print('Not a SMB2 header')
                 raise ValueError
             if _h['next_command']:
-                cmds.append((_h, buf[:_h['next_command']]))
-                buf = buf[_h['next_command']:]
+                cmds.append((_h, buf[_pos:_pos + _h['next_command']]))
+                _pos = _pos + _h['next_command']
             else:
-                cmds.append((_h, buf[:]))
-                buf = []
+                cmds.append((_h, buf[_pos:]))
+                break
         return cmds
 
-    def Run(self):
-        while True:
-            #
-            # Read the SPL and data from the socket
-            #
-            spl = bytes(0)
-            while len(spl) < 4:
-                _b = self._s.recv(4 - len(spl))
-                if not _b:
-                    print('Socket closed by client')
-                    return
-                spl = spl + _b
-            _spl = struct.unpack_from('>I', spl, 0)[0]
-
-            buf = bytes(0)
-            while len(buf) < _spl:
-                _b = self._s.recv(_spl - len(buf))
-                if not _b:
-                    print('Socket closed by client')
-                    return
-                buf = buf + _b
-
-            #
-            # Split the buffer into a list of (header, command) tuples
-            #
-            cmds = self.SplitBuffer(buf)
+    def SendReplies(self, rep):
+        """
+        Send the replies as a single frame. A reply is a tuple of the
+        header, the body and optionally a payload such as the data of
+        a read. The frame goes out as a list of buffers and next command,
+        padding and signatures are filled in without copying any of them.
+        """
+        if not rep or self._s.is_closing():
+            return
+
+        spl = bytearray(4)
+        iov = [spl]
+        _total = 0
+        _num = len(rep)
+        for idx, r in enumerate(rep):
+            hdr = r[0]
+            _iov = [b for b in r if b]
+            _len = sum([len(b) for b in _iov])
+            if _len % 8:
+                _iov.append(bytes(8 - _len % 8))
+                _len = _len + 8 - _len % 8
+
+            if idx + 1 != _num:
+                struct.pack_into('<I', hdr, 20, _len)
+            if hdr[16] & SIGNED:
+                hdr[48:64] = self.ComputeSignature(_iov)
+
+            iov.extend(_iov)
+            _total = _total + _len
+
+        struct.pack_into('>I', spl, 0, _total)
+        self.SendBuffers(iov)
+
+    def SendBreak(self, body):
+        """
+        Send an Oplock or Lease Break notification. They are not part of
+        any session and are never signed. Returns False if the connection
+        is going away.
+        """
+        if self._s.is_closing():
+            return False
+        self.SendReplies([(Header.encode({'protocol_id': SMB2_MAGIC,
+                                          'credit_charge': 0,
+                                          'status': Status.SUCCESS.value,
+                                          'command': Command.OPLOCK_BREAK.value,
+                                          'credit_response': 0,
+                                          'flags': RESPONSE,
+                                          'message_id': 0xffffffffffffffff,
+                                          'process_id': 0,
+                                          'tree_id': 0,
+                                          'session_id': 0}),
+                           body)])
+        return True
+
+    def SendBuffers(self, iov):
+        """
+        Send a list of buffers, and file ranges, in order
+        """
+        self._s.send(iov)
+
+    def SplitChains(self, cmds):
+        """
+        Split the commands of a frame into chains. A chain is a command
+        followed by all the commands related to it.
+        """
+        chains = []
+        for cmd in cmds:
+            if chains and cmd[0]['flags'] & RELATED:
+                chains[-1].append(cmd)
+            else:
+                chains.append([cmd])
+        return chains
+
+    async def _process_chain(self, chain):
+        rep = await self.ProcessCommands(chain)
+        self.SendReplies(rep)
+
+    def _chain_done(self, mids, task):
+        for mid in mids:
+            self._requests.pop(mid, None)
+        if task.cancelled():
+            return
+        if task.exception():
+            e = task.exception()
+            print(e)
+            traceback.print_exception(e)
+            self._s.close()
+
+    def StreamWrite(self, buf, size):
+        """
+        Called by the transport with the header and the write request
+        of a large frame. If the frame is a single unsigned WRITE with its
+        data straight after the request we return a WriteStream that the
+        data is fed to as it arrives. Otherwise we return None and the
+        frame is buffered and processed as usual.
+        """
+        h = Header.decode(buf)
+        if h['protocol_id'] != SMB2_MAGIC or h['command'] != Command.WRITE.value:
+            return None
+        if h['next_command'] or h['flags'] & (SIGNED | RELATED) or self._use_signing:
+            return None
+        req = Write.decode(Direction.REQUEST, buf[64:112])
+        if struct.unpack_from('<H', buf, 66)[0] != 112 or size != 112 + req.length:
+            return None
+        if not h['tree_id'] in self.trees or not req.file_id in self.files:
+            return None
+        if req.length > self.max_io_size or not self.credits.charge_ok(h, req.length):
+            return None
+
+        self.credits.consume(h)
+        return WriteStream(self, h, req, self.files[req.file_id])
+
+    def ProcessBuffer(self, buf, release=None):
+        """
+        Process one frame from the transport.
+        The commands in a chain of related commands are processed in order
+        but every chain runs as its own task, so unrelated commands, in
+        this frame or in the frames that follow, run concurrently and
+        their replies are sent as soon as they complete.
+
+        buf may be a memoryview of a receive buffer that the transport
+        wants back. The decoded requests reference it without copying so
+        release() is called once every chain of the frame has completed.
+        """
+        #
+        # Split the buffer into a list of (header, command) tuples
+        #
+        cmds = self.SplitBuffer(buf)
 
-            #
-            # Process the commands
-            #
-            rep = self.ProcessCommands(cmds)
+        #
+        # A CANCEL is not a request of its own, it stops one in flight
+        #
+        _cmds = []
+        for cmd in cmds:
+            if cmd[0]['command'] != Command.CANCEL.value:
+                _cmds.append(cmd)
+                continue
+            if cmd[0]['flags'] & SIGNED:
+                self.VerifySignature(cmd[0], cmd[1])
+            self.Cancel(cmd[0])
+        cmds = _cmds
 
-            #
-            # Concatenate them into a single bytearray, take care of padding
-            # and next command
-            #
-            buf = bytearray(0)
-            _pos = 0
-            _last_pos = 0
-            _num = len(rep)
-            for idx, r in enumerate(rep):
-                buf = buf + r[0] + r[1]
-                _len = len(buf)
-                if _len % 8:
-                    _pad = ((_len + 7) & 0xfff8) - _len
-                    buf = buf + bytearray(_pad)
-
-                if idx + 1 != _num:
-                    struct.pack_into('<I', buf, _pos + 20, len(buf) - _pos)
-                if buf[_pos + 16] & SIGNED:
-                    buf[_pos + 48:_pos + 64] = self.ComputeSignature(buf[_pos:])
-
-                _last_pos = _pos
-                _pos = len(buf)
-
-            spl = bytearray(4)
-            struct.pack_into('>I', spl, 0, len(buf))
-            while len(spl):
-                l = self._s.send(spl)
-                spl = spl[l:]
-            while len(buf):
-                l = self._s.send(buf)
-                buf = buf[l:]
-        
+        #
+        # Consume the credits in the order the requests arrive
+        #
+        for cmd in cmds:
+            self.credits.consume(cmd[0])
+
+        tasks = []
+        for chain in self.SplitChains(cmds):
+            _mids = [cmd[0]['message_id'] for cmd in chain]
+            task = asyncio.ensure_future(self._process_chain(chain))
+            for mid in _mids:
+                self._requests.update({mid: task})
+            task.add_done_callback(lambda t, m=_mids: self._chain_done(m, t))
+            tasks.append(task)
+
+        if not release:
+            return
+        if not tasks:
+            release()
+        elif len(tasks) == 1:
+            tasks[0].add_done_callback(lambda t: release())
+        else:
+            asyncio.gather(*tasks,
+                           return_exceptions=True).add_done_callback(
+                               lambda f: release())
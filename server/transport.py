@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import asyncio
+import os
+import struct
+import traceback
+
+#
+# A Server sends its replies through a transport. A transport has
+#   send(iov)     send a list of buffers and FileRanges, in order
+#   close()       drop the connection
+#   is_closing()  True once the connection is being dropped
+#   release()     free what the transport holds once the Server has
+#                 disconnected
+#
+
+# Largest number of buffers we hand to a single sendmsg
+IOV_MAX = 1024
+
+
+class FileRange(object):
+    """
+    A class for a range of a file that is sent as part of a reply,
+    straight from the file to the socket with sendfile.
+    It holds its own fd so a concurrent close of the file is harmless.
+    """
+
+    def __init__(self, fd, offset, count, **kwargs):
+        self.fd = os.dup(fd)
+        self.offset = offset
+        self.count = count
+
+    def __del__(self):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class SocketTransport(object):
+    """
+    A class for sending replies on the socket of an asyncio transport
+    """
+
+    def __init__(self, s, **kwargs):
+        self._s = s
+        # Our own handle on the socket so we can sendmsg() directly
+        _sock = s.get_extra_info('socket')
+        self._sock = _sock.dup() if _sock is not None else None
+        self._sendq = None
+        self._sender = None
+
+    def __repr__(self):
+        return repr(self._s)
+
+    def close(self):
+        self._s.close()
+
+    def is_closing(self):
+        return self._s.is_closing()
+
+    def release(self):
+        if self._sender:
+            self._sender.cancel()
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+
+    def send(self, iov):
+        """
+        Send a list of buffers, and file ranges, in order
+        """
+        # The transport can not take writes while a sendfile is in
+        # progress so everything is queued behind it.
+        if self._sendq is not None:
+            self._sendq.append(iov)
+            return
+        if [b for b in iov if isinstance(b, FileRange)]:
+            self._sendq = [iov]
+            self._sender = asyncio.ensure_future(self._send_queue())
+            self._sender.add_done_callback(self._sender_done)
+            return
+        self._write_buffers(iov)
+
+    def _write_buffers(self, iov):
+        """
+        As long as the transport has nothing queued we sendmsg() the buffers
+        straight to the socket, whatever the socket does not take right
+        away is queued in the transport.
+        """
+        if not iov:
+            return
+        _sent = 0
+        if self._sock and len(iov) <= IOV_MAX and not self._s.get_write_buffer_size():
+            try:
+                _sent = self._sock.sendmsg(iov)
+            except (BlockingIOError, InterruptedError):
+                _sent = 0
+            except OSError as e:
+                print(e)
+                self._s.close()
+                return
+
+        _idx = 0
+        while _idx < len(iov) and _sent >= len(iov[_idx]):
+            _sent = _sent - len(iov[_idx])
+            _idx = _idx + 1
+        if _idx == len(iov):
+            return
+        iov = iov[_idx:]
+        if _sent:
+            iov[0] = memoryview(iov[0])[_sent:]
+        self._s.writelines(iov)
+
+    async def _send_queue(self):
+        """
+        Send the queued replies, using sendfile for the file ranges
+        """
+        loop = asyncio.get_running_loop()
+        while self._sendq and not self._s.is_closing():
+            iov = self._sendq.pop(0)
+            _bufs = []
+            for b in iov:
+                if not isinstance(b, FileRange):
+                    _bufs.append(b)
+                    continue
+                self._write_buffers(_bufs)
+                _bufs = []
+                try:
+                    with open(b.fd, 'rb', buffering=0, closefd=False) as _f:
+                        _sent = await loop.sendfile(self._s, _f,
+                                                    b.offset, b.count)
+                finally:
+                    b.close()
+                # The file was truncated under us, the frame we
+                # promised can no longer be completed.
+                if _sent != b.count:
+                    print('Short sendfile', _sent, 'of', b.count)
+                    self._s.close()
+                    return
+            self._write_buffers(_bufs)
+        self._sendq = None
+
+    def _sender_done(self, task):
+        self._sender = None
+        if task.cancelled():
+            return
+        if task.exception():
+            e = task.exception()
+            print(e)
+            traceback.print_exception(e)
+            self._s.close()
+
+
+class MemoryTransport(object):
+    """
+    A class for a transport that connects a Server to a client in the same
+    process, to drive the server without any socket.
+    The client writes its frames with write(), they go straight to
+    srv.ProcessBuffer(), and reads the replies from reader, an
+    asyncio.StreamReader. It must be created from a running event loop.
+    """
+
+    def __init__(self, **kwargs):
+        self.reader = asyncio.StreamReader()
+        self.srv = None
+        self._closing = False
+
+    def write(self, buf):
+        """
+        Process the frames in buf, as the server would once they have
+        arrived on a socket
+        """
+        _v = memoryview(buf)
+        _pos = 0
+        while _pos + 4 <= len(_v):
+            _len = struct.unpack_from('>I', _v, _pos)[0]
+            self.srv.ProcessBuffer(_v[_pos + 4:_pos + 4 + _len])
+            _pos = _pos + 4 + _len
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        self.reader.feed_eof()
+        if self.srv:
+            self.srv.Disconnect()
+
+    def is_closing(self):
+        return self._closing
+
+    def release(self):
+        True
+
+    def send(self, iov):
+        for b in iov:
+            if not isinstance(b, FileRange):
+                self.reader.feed_data(b)
+                continue
+            try:
+                self.reader.feed_data(os.pread(b.fd, b.count, b.offset))
+            finally:
+                b.close()
@@ -7,7 +7,8 @@ import struct
 from enum import Enum
 
 from smb2.header import Direction
-from smb2.timestamps import WinToTimeval, TimevalToWin
+from smb2.record import Record
+from smb2.schema import Codec, Field, TIME
 
 #
 # SMB2 Close
@@ -19,66 +20,40 @@ from smb2.timestamps import WinToTimeval, TimevalToWin
 SMB2_CLOSE_FLAG_POSTQUERY_ATTRIB = 0x0001
 
 
-def _decode_request(hdr):
+class CloseRequest(Record):
     """
-    Decode a Close request
+    A class for a decoded Close request
     """
-    result = {}
-    result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-    result.update({'flags': struct.unpack_from('<H', hdr, 2)[0]})
-    result.update({'file_id': (struct.unpack_from('<Q', hdr,  8)[0],
-                               struct.unpack_from('<Q', hdr, 16)[0])})
+    __slots__ = ('structure_size', 'flags', 'file_id')
 
-    return result
-
-def _encode_request(hdr):
-    """
-    Encode a Close request
-    """
-    result = bytearray(24)
-    struct.pack_into('<H', result, 0, 24)
-    struct.pack_into('<H', result, 2, hdr['flags'])
-    struct.pack_into('<Q', result, 8, hdr['file_id'][0])
-    struct.pack_into('<Q', result, 16, hdr['file_id'][1])
-
-    return result
-
-def _decode_reply(hdr):
+class CloseReply(Record):
     """
-    Decode a Close reply
+    A class for a decoded Close reply
     """
-    result = {}
-    result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-    result.update({'flags': struct.unpack_from('<H', hdr, 2)[0]})
-    if result['flags'] & SMB2_CLOSE_FLAG_POSTQUERY_ATTRIB:
-        result.update({'creation_time': WinToTimeval(struct.unpack_from('<Q', hdr, 8)[0])})
-        result.update({'last_access_time': WinToTimeval(struct.unpack_from('<Q', hdr, 16)[0])})
-        result.update({'last_write_time': WinToTimeval(struct.unpack_from('<Q', hdr, 24)[0])})
-        result.update({'change_time': WinToTimeval(struct.unpack_from('<Q', hdr, 32)[0])})
-        result.update({'allocation_size': struct.unpack_from('<Q', hdr, 40)[0]})
-        result.update({'end_of_file': struct.unpack_from('<Q', hdr, 48)[0]})
-        result.update({'file_attributes': struct.unpack_from('<I', hdr, 56)[0]})
-        
-    return result
-
-def _encode_reply(hdr):
-    """
-    Encode a Close reply
-    """
-    result = bytearray(60)
-    struct.pack_into('<H', result, 0, 60)
-    struct.pack_into('<H', result, 2, hdr['flags'])
-    if hdr['flags'] & SMB2_CLOSE_FLAG_POSTQUERY_ATTRIB:
-        struct.pack_into('<Q', result, 8, TimevalToWin(hdr['creation_time']))
-        struct.pack_into('<Q', result, 16, TimevalToWin(hdr['last_access_time']))
-        struct.pack_into('<Q', result, 24, TimevalToWin(hdr['last_write_time']))
-        struct.pack_into('<Q', result, 32, TimevalToWin(hdr['change_time']))
-        struct.pack_into('<Q', result, 40, hdr['allocation_size'])
-        struct.pack_into('<Q', result, 48, hdr['end_of_file'])
-        struct.pack_into('<I', result, 56, hdr['file_attributes'])
-
-    return result
-
+    __slots__ = ('structure_size', 'flags', 'creation_time',
+                 'last_access_time', 'last_write_time', 'change_time',
+                 'allocation_size', 'end_of_file', 'file_attributes')
+
+_request = Codec(CloseRequest, 24, [
+    Field('structure_size', 0, 'H', value=24),
+    Field('flags', 2, 'H'),
+    Field('file_id', 8, 'QQ'),
+    ])
+
+# The attributes are only there with SMB2_CLOSE_FLAG_POSTQUERY_ATTRIB
+_POSTQUERY = ('flags', lambda f: f & SMB2_CLOSE_FLAG_POSTQUERY_ATTRIB)
+
+_reply = Codec(CloseReply, 60, [
+    Field('structure_size', 0, 'H', value=60),
+    Field('flags', 2, 'H'),
+    Field('creation_time', 8, 'Q', conv=TIME, when=_POSTQUERY),
+    Field('last_access_time', 16, 'Q', conv=TIME, when=_POSTQUERY),
+    Field('last_write_time', 24, 'Q', conv=TIME, when=_POSTQUERY),
+    Field('change_time', 32, 'Q', conv=TIME, when=_POSTQUERY),
+    Field('allocation_size', 40, 'Q', when=_POSTQUERY),
+    Field('end_of_file', 48, 'Q', when=_POSTQUERY),
+    Field('file_attributes', 56, 'I', when=_POSTQUERY),
+    ])
 
 class Close(object):
     """
@@ -94,18 +69,36 @@ class Close(object):
     @staticmethod
     def decode(direction, hdr):
         """
-        Decode a Create PDU
+        Decode a Close PDU
+        """
+        if direction == Direction.REPLY:
+            return _reply.decode(hdr)
+        return _request.decode(hdr)
+
+    @staticmethod
+    def encoded_size(direction, hdr):
+        """
+        Number of bytes a Close PDU encodes to
+        """
+        if direction == Direction.REPLY:
+            return _reply.encoded_size(hdr)
+        return _request.encoded_size(hdr)
+
+    @staticmethod
+    def encode_into(direction, buf, offset, hdr):
+        """
+        Encode a Close PDU into buf at offset and return the offset
+        after it. The bytes of buf it covers must be zero.
         """
         if direction == Direction.REPLY:
-            return _decode_reply(hdr)
-        return _decode_request(hdr)
+            return _reply.encode_into(buf, offset, hdr)
+        return _request.encode_into(buf, offset, hdr)
 
     @staticmethod
     def encode(direction, hdr):
         """
-        Encode a Create PDU
+        Encode a Close PDU
         """
         if direction == Direction.REPLY:
-            return _encode_reply(hdr)
-        return _encode_request(hdr)
-    
+            return _reply.encode(hdr)
+        return _request.encode(hdr)
@@ -7,8 +7,8 @@ import struct
 from enum import Enum
 
 from smb2.header import Direction
-from smb2.timestamps import WinToTimeval, TimevalToWin
-from smb2.unicode import UCS2toUTF8, UTF8toUCS2
+from smb2.record import Record, Lazy
+from smb2.schema import Codec, Coder, Field, Buffer, PATH, TIME
 
 #
 # SMB2 Create
@@ -75,6 +75,12 @@ SMB2_LEASE_READ_CACHING   = 1
 SMB2_LEASE_HANDLE_CACHING = 2
 SMB2_LEASE_WRITE_CACHING  = 4
 
+#
+# LEASE FLAGS
+#
+SMB2_LEASE_FLAG_BREAK_IN_PROGRESS    = 0x02
+SMB2_LEASE_FLAG_PARENT_LEASE_KEY_SET = 0x04
+
 #
 # FLAGS
 #
@@ -114,6 +120,27 @@ FILE_GENERIC_WRITE          = 0x40000000
 FILE_GENERIC_READ           = 0x80000000
 
 
+class CreateRequest(Record):
+    """
+    A class for a decoded Create request
+    """
+    __slots__ = ('structure_size', 'requested_oplock_level',
+                 'impersonation_level', 'desired_access', 'file_attributes',
+                 'share_access', 'create_disposition', 'create_options',
+                 '_path', '_path_raw', '_contexts', '_contexts_raw')
+    path = Lazy(PATH.decode)
+    contexts = Lazy(lambda b: _decode_contexts(b, request_contexts))
+
+class CreateReply(Record):
+    """
+    A class for a decoded Create reply
+    """
+    __slots__ = ('structure_size', 'oplock_level', 'flags', 'create_action',
+                 'creation_time', 'last_access_time', 'last_write_time',
+                 'change_time', 'allocation_size', 'end_of_file',
+                 'file_attributes', 'file_id', '_contexts', '_contexts_raw')
+    contexts = Lazy(lambda b: _decode_contexts(b, reply_contexts))
+
 def encode_QFid_reply(context):
     _l = bytearray(32)
     struct.pack_into('<Q', _l, 0, context['disk_file_id'])
@@ -130,6 +157,7 @@ def encode_RqLs_reply(context):
     _l = bytearray(32)
     _l[:16] = context['lease_key']
     struct.pack_into('<I', _l, 16, context['lease_state'])
+    struct.pack_into('<I', _l, 20, context.get('lease_flags', 0))
     if 'parent_lease_key' in context:
         _l = _l + bytearray(20)
         _l[32:48] = context['parent_lease_key']
@@ -173,225 +201,118 @@ def _decode_context(context, data, ctx_list):
 def _decode_contexts(buf, ctx_list):
     contexts = {}
 
-    while buf:
+    _pos = 0
+    while _pos < len(buf):
         context = {}
-        _next = struct.unpack_from('<I', buf, 0)[0]
+        _next = struct.unpack_from('<I', buf, _pos)[0]
 
-        _offset = struct.unpack_from('<H', buf, 4)[0]
-        _len = struct.unpack_from('<H', buf, 6)[0]
-        _name = buf[_offset:_offset + _len].decode()
+        _offset = _pos + struct.unpack_from('<H', buf, _pos + 4)[0]
+        _len = struct.unpack_from('<H', buf, _pos + 6)[0]
+        _name = bytes(buf[_offset:_offset + _len]).decode()
         context.update({'name': _name})
 
-        _offset = struct.unpack_from('<H', buf, 10)[0]
-        _len = struct.unpack_from('<I', buf, 12)[0]
+        _offset = _pos + struct.unpack_from('<H', buf, _pos + 10)[0]
+        _len = struct.unpack_from('<I', buf, _pos + 12)[0]
         _decode_context(context, buf[_offset:_offset + _len], ctx_list)
-        
-        contexts.update({_name: context})
-        
-        if _next == 0:
-            break
-        buf = buf[_next:]
-        
-    return contexts
-
-def _decode_request(hdr):
-    """
-    Decode a Create request
-    """
-    result = {}
-    result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-    result.update({'requested_oplock_level': struct.unpack_from('<B', hdr, 3)[0]})
-    result.update({'impersonation_level': struct.unpack_from('<I', hdr, 4)[0]})
-    result.update({'desired_access': struct.unpack_from('<I', hdr, 24)[0]})
-    result.update({'file_attributes': struct.unpack_from('<I', hdr, 28)[0]})
-    result.update({'share_access': struct.unpack_from('<I', hdr, 32)[0]})
-    result.update({'create_disposition': struct.unpack_from('<I', hdr, 36)[0]})
-    result.update({'create_options': struct.unpack_from('<I', hdr, 40)[0]})
-
-    _offset = struct.unpack_from('<H', hdr, 44)[0] - 64
-    _len = struct.unpack_from('<H', hdr, 46)[0]
-    result.update({'path': UCS2toUTF8(hdr[_offset:_offset + _len]).replace(b'\\', b'/')})
-
-    _offset = struct.unpack_from('<I', hdr, 48)[0] - 64
-    _len = struct.unpack_from('<I', hdr, 52)[0]
-    result.update({'contexts': {}})
-    if _offset:
-        result.update({'contexts': _decode_contexts(hdr[_offset:_offset + _len], request_contexts)})
-
-    return result
-
-def _encode_request(hdr):
-    """
-    Encode a Create request
-    """
-    result = bytearray(56)
-    struct.pack_into('<H', result, 0, 57)
-    struct.pack_into('<B', result, 3, hdr['requested_oplock_level'])
-    struct.pack_into('<I', result, 4, hdr['impersonation_level'])
-    struct.pack_into('<I', result, 24, hdr['desired_access'])
-    struct.pack_into('<I', result, 28, hdr['file_attributes'])
-    struct.pack_into('<I', result, 32, hdr['share_access'])
-    struct.pack_into('<I', result, 36, hdr['create_disposition'])
-    struct.pack_into('<I', result, 40, hdr['create_options'])
-
-    _path = UTF8toUCS2(hdr['path'].replace(b'/', b'\\'))
-    struct.pack_into('<H', result, 44, 56 + 64)
-    if len(_path):
-        struct.pack_into('<H', result, 46, len(_path))
-        result = result + _path
-    else:
-        # Windows adds 8 bytes of pad for empty name
-        result = result + bytearray(8)
-
-    if 'contexts' in hdr:
-        # Add padding if we need to
-        _len = len(result)
-        if _len % 8:
-            _pad = ((_len + 7) & 0xfff8) - _len
-            result = result + bytearray(_pad)
-
-        _c = _encode_contexts(hdr['contexts'], request_contexts)
-        struct.pack_into('<I', result, 48, len(result) + 64)
-        struct.pack_into('<I', result, 52, len(_c))
-        result = result + _c
-        
-    return result
-
-def _decode_reply_contexts(buf, ctx_list):
-    contexts = {}
-
-    while buf:
-        context = {}
-        _next = struct.unpack_from('<I', buf, 0)[0]
 
-        _offset = struct.unpack_from('<H', buf, 4)[0]
-        _len = struct.unpack_from('<H', buf, 6)[0]
-        _name = buf[_offset:_offset + _len].decode()
-        context.update({'name': _name})
-        
-        _offset = struct.unpack_from('<H', buf, 10)[0]
-        _len = struct.unpack_from('<I', buf, 12)[0]
-        _decode_context(context, buf[_offset:_offset + _len], ctx_list)
-        
         contexts.update({_name: context})
-        
+
         if _next == 0:
             break
-        buf = buf[_next:]
-        
-    return contexts
+        _pos = _pos + _next
 
-def _decode_reply(hdr):
-    """
-    Decode a Create reply
-    """
-    result = {}
-    result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-    result.update({'oplock_level': struct.unpack_from('<B', hdr, 2)[0]})
-    result.update({'flags': struct.unpack_from('<B', hdr, 3)[0]})
-    result.update({'create_action': struct.unpack_from('<I', hdr, 4)[0]})
-    result.update({'creation_time': WinToTimeval(struct.unpack_from('<Q', hdr, 8)[0])})
-    result.update({'last_access_time': WinToTimeval(struct.unpack_from('<Q', hdr, 16)[0])})
-    result.update({'last_write_time': WinToTimeval(struct.unpack_from('<Q', hdr, 24)[0])})
-    result.update({'change_time': WinToTimeval(struct.unpack_from('<Q', hdr, 32)[0])})
-    result.update({'allocation_size': struct.unpack_from('<Q', hdr, 40)[0]})
-    result.update({'end_of_file': struct.unpack_from('<Q', hdr, 48)[0]})
-    result.update({'file_attributes': struct.unpack_from('<I', hdr, 56)[0]})
-    result.update({'file_id': (struct.unpack_from('<Q', hdr, 64)[0],
-                               struct.unpack_from('<Q', hdr, 72)[0])})
-
-    _offset = struct.unpack_from('<I', hdr, 80)[0] - 64
-    _len = struct.unpack_from('<I', hdr, 84)[0]
-    result.update({'contexts': {}})
-    if _offset:
-        result.update({'contexts': _decode_reply_contexts(hdr[_offset:_offset + _len], reply_contexts)})
-
-    return result
-
-def _encode_context(context, ctx_list):
-    _c = bytearray(16)
-    struct.pack_into('<H', _c, 4, 16)
-    struct.pack_into('<H', _c, 6, len(context['name']))
-    _c = _c + context['name'].encode()
-    
-    # Data is aligned to 8 bytes so add padding if we need to
-    _len = len(_c)
-    if _len % 8:
-        _pad = ((_len + 7) & 0xfff8) - _len
-        _c = _c + bytearray(_pad)
+    return contexts
 
+def _context_data(context, ctx_list):
     if context['name'] in ctx_list:
-        _l = ctx_list[context['name']][0](context)
+        return ctx_list[context['name']][0](context)
 
-        if _l:
-            struct.pack_into('<H', _c, 10, len(_c))
-            struct.pack_into('<I', _c, 12, len(_l))
-            _c = _c + _l
+    print('Unknown Create context', context['name'])
+    return b''
 
-        return _c
-    
-    print('Unknown Create reply context', context['name'])
-    return _c
+def _contexts_size(contexts, ctx_list):
+    _size = 0
+    for name, context in contexts.items():
+        context['name'] = name
+        # The name and the data are both padded to 8 bytes
+        _size = _size + ((16 + len(name) + 7) & 0xfff8)
+        _size = _size + ((len(_context_data(context, ctx_list)) + 7) & 0xfff8)
+    return _size
 
-def _encode_contexts(contexts, ctx_list):
-    _pos = 0
-    buf = bytearray(0)
+def _encode_contexts_into(buf, offset, contexts, ctx_list):
+    _pos = offset
+    _last = None
 
     for name, context in contexts.items():
         context['name'] = name
-        
-        _pos = len(buf)
-        buf = buf + _encode_context(context, ctx_list)
-
-        # Add padding, if we need to
-        _len = len(buf)
-        if _len % 8:
-            _pad = ((_len + 7) & 0xfff8) - _len
-            buf = buf + bytearray(_pad)
+        _name = name.encode()
+        struct.pack_into('<H', buf, _pos + 4, 16)
+        struct.pack_into('<H', buf, _pos + 6, len(_name))
+        buf[_pos + 16:_pos + 16 + len(_name)] = _name
+
+        # Data is aligned to 8 bytes
+        _len = (16 + len(_name) + 7) & 0xfff8
+        _l = _context_data(context, ctx_list)
+        if _l:
+            struct.pack_into('<H', buf, _pos + 10, _len)
+            struct.pack_into('<I', buf, _pos + 12, len(_l))
+            buf[_pos + _len:_pos + _len + len(_l)] = _l
+            _len = (_len + len(_l) + 7) & 0xfff8
 
         # assume we have another context after this so set next accordingly
-        struct.pack_into('<I', buf, _pos, len(buf) - _pos)
-
-    # Except next should be 0 for the last context, IF we have contexts
-    if len(buf) >= 16:
-        struct.pack_into('<I', buf, _pos, 0)
-
-    return buf
-
-def _encode_reply(hdr):
-    """
-    Encode a Create reply
-    """
-    result = bytearray(88)
-    struct.pack_into('<H', result, 0, 89)
-    struct.pack_into('<B', result, 2, hdr['oplock_level'])
-    struct.pack_into('<B', result, 3, hdr['flags'])
-    struct.pack_into('<I', result, 4, hdr['create_action'])
-    struct.pack_into('<Q', result, 8, TimevalToWin(hdr['creation_time']))
-    struct.pack_into('<Q', result, 16, TimevalToWin(hdr['last_access_time']))
-    struct.pack_into('<Q', result, 24, TimevalToWin(hdr['last_write_time']))
-    struct.pack_into('<Q', result, 32, TimevalToWin(hdr['change_time']))
-    struct.pack_into('<Q', result, 40, hdr['allocation_size'])
-    struct.pack_into('<Q', result, 48, hdr['end_of_file'])
-    struct.pack_into('<I', result, 56, hdr['file_attributes'])
-
-    struct.pack_into('<Q', result, 64, hdr['file_id'][0])
-    struct.pack_into('<Q', result, 72, hdr['file_id'][1])
-
-    if 'contexts' in hdr:
-        # Add padding if we need to
-        _len = len(result)
-        if _len % 8:
-            _pad = ((_len + 7) & 0xfff8) - _len
-            result = result + bytearray(_pad)
-
-        _c = _encode_contexts(hdr['contexts'], reply_contexts)
-        struct.pack_into('<I', result, 80, len(result) + 64)
-        struct.pack_into('<I', result, 84, len(_c))
-        result = result + _c
-    
-    return result
-
+        struct.pack_into('<I', buf, _pos, _len)
+        _last = _pos
+        _pos = _pos + _len
+
+    # Except next should be 0 for the last context
+    if _last is not None:
+        struct.pack_into('<I', buf, _last, 0)
+
+    return _pos
+
+# Contexts start on an 8 byte boundary
+_request = Codec(CreateRequest, 56, [
+    Field('structure_size', 0, 'H', value=57),
+    Field('requested_oplock_level', 3, 'B'),
+    Field('impersonation_level', 4, 'I'),
+    Field('desired_access', 24, 'I'),
+    Field('file_attributes', 28, 'I'),
+    Field('share_access', 32, 'I'),
+    Field('create_disposition', 36, 'I'),
+    Field('create_options', 40, 'I'),
+    ], [
+    # Windows adds 8 bytes of pad for empty name
+    Buffer('path', offset=(44, 'H'), length=(46, 'H'), codec=PATH,
+           required=True, min_size=8, missing=b''),
+    Buffer('contexts', offset=(48, 'I'), length=(52, 'I'), align=8,
+           codec=Coder(lambda b: _decode_contexts(b, request_contexts),
+                       lambda c: _contexts_size(c, request_contexts),
+                       lambda buf, o, c: _encode_contexts_into(buf, o, c,
+                                                               request_contexts)),
+           missing={}),
+    ])
+
+_reply = Codec(CreateReply, 88, [
+    Field('structure_size', 0, 'H', value=89),
+    Field('oplock_level', 2, 'B'),
+    Field('flags', 3, 'B'),
+    Field('create_action', 4, 'I'),
+    Field('creation_time', 8, 'Q', conv=TIME),
+    Field('last_access_time', 16, 'Q', conv=TIME),
+    Field('last_write_time', 24, 'Q', conv=TIME),
+    Field('change_time', 32, 'Q', conv=TIME),
+    Field('allocation_size', 40, 'Q'),
+    Field('end_of_file', 48, 'Q'),
+    Field('file_attributes', 56, 'I'),
+    Field('file_id', 64, 'QQ'),
+    ], [
+    Buffer('contexts', offset=(80, 'I'), length=(84, 'I'), align=8,
+           codec=Coder(lambda b: _decode_contexts(b, reply_contexts),
+                       lambda c: _contexts_size(c, reply_contexts),
+                       lambda buf, o, c: _encode_contexts_into(buf, o, c,
+                                                               reply_contexts)),
+           missing={}),
+    ])
 
 class Create(object):
     """
@@ -410,8 +331,27 @@ class Create(object):
         Decode a Create PDU
         """
         if direction == Direction.REPLY:
-            return _decode_reply(hdr)
-        return _decode_request(hdr)
+            return _reply.decode(hdr)
+        return _request.decode(hdr)
+
+    @staticmethod
+    def encoded_size(direction, hdr):
+        """
+        Number of bytes a Create PDU encodes to
+        """
+        if direction == Direction.REPLY:
+            return _reply.encoded_size(hdr)
+        return _request.encoded_size(hdr)
+
+    @staticmethod
+    def encode_into(direction, buf, offset, hdr):
+        """
+        Encode a Create PDU into buf at offset and return the offset
+        after it. The bytes of buf it covers must be zero.
+        """
+        if direction == Direction.REPLY:
+            return _reply.encode_into(buf, offset, hdr)
+        return _request.encode_into(buf, offset, hdr)
 
     @staticmethod
     def encode(direction, hdr):
@@ -419,6 +359,5 @@ class Create(object):
         Encode a Create PDU
         """
         if direction == Direction.REPLY:
-            return _encode_reply(hdr)
-        return _encode_request(hdr)
-    
+            return _reply.encode(hdr)
+        return _request.encode(hdr)
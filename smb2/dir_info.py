@@ -6,9 +6,15 @@
 import struct
 from enum import Enum
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from smb2.header import Direction
 from smb2.timestamps import WinToTimeval, TimevalToWin
-from smb2.unicode import UCS2toUTF8, UTF8toUCS2
+from smb2.unicode import UCS2toPath, PathtoUCS2, UTF8toUCS2Len
+from smb2.record import Record
 
 #
 # SMB2 DIR INFORMATION CLASSES
@@ -18,52 +24,186 @@ class DirInfoClass(Enum):
     FILE_ID_FULL_INFORMATION = 0x26
     
 
-def encode_file_id_full_dir_info(i):
-    _b = bytearray(80)
-    struct.pack_into('<I', _b, 4, i['file_index'])
-    struct.pack_into('<Q', _b, 8, TimevalToWin(i['creation_time']))
-    struct.pack_into('<Q', _b, 16, TimevalToWin(i['last_access_time']))
-    struct.pack_into('<Q', _b, 24, TimevalToWin(i['last_write_time']))
-    struct.pack_into('<Q', _b, 32, TimevalToWin(i['change_time']))
-    struct.pack_into('<Q', _b, 40, i['end_of_file'])
-    struct.pack_into('<Q', _b, 48, i['allocation_size'])
-    struct.pack_into('<I', _b, 56, i['file_attributes'])
-    struct.pack_into('<I', _b, 64, i['ea_size'])
-    struct.pack_into('<Q', _b, 72, i['file_id'])
-
-    _fn = UTF8toUCS2(i['file_name']).replace(b'/', b'\\')
-    struct.pack_into('<I', _b, 60, len(_fn))
-    _b = _b + _fn
-
-    _len = len(_b)
-    if _len % 8:
-        _pad = ((_len + 7) & 0xfff8) - _len
-        _b = _b + bytearray(_pad)
-
-    return _b
-
-def decode_file_id_full_dir_info(buf):
-    i = {}
-    i.update({'file_index': struct.unpack_from('<I', buf, 4)[0]})
-    i.update({'creation_time': WinToTimeval(struct.unpack_from('<Q', buf, 8)[0])})
-    i.update({'last_access_time': WinToTimeval(struct.unpack_from('<Q', buf, 16)[0])})
-    i.update({'last_write_time': WinToTimeval(struct.unpack_from('<Q', buf, 24)[0])})
-    i.update({'change_time': WinToTimeval(struct.unpack_from('<Q', buf, 32)[0])})
-    i.update({'end_of_file': struct.unpack_from('<Q', buf, 40)[0]})
-    i.update({'allocation_size': struct.unpack_from('<Q', buf, 48)[0]})
-    i.update({'file_attributes': struct.unpack_from('<I', buf, 56)[0]})
-    i.update({'ea_size': struct.unpack_from('<I', buf, 64)[0]})
-    i.update({'file_id': struct.unpack_from('<Q', buf, 72)[0]})
-
-    _fnl = struct.unpack_from('<I', buf, 60)[0]
-    i.update({'file_name': UCS2toUTF8(buf[80:80 + _fnl]).replace(b'\\', b'/')})
+class FileIdFullDirInfo(Record):
+    """
+    A class for a decoded FILE_ID_FULL_DIR_INFORMATION entry
+    """
+    __slots__ = ('file_index', 'creation_time', 'last_access_time',
+                 'last_write_time', 'change_time', 'end_of_file',
+                 'allocation_size', 'file_attributes', 'ea_size', 'file_id',
+                 'file_name')
+
+# The fixed part of a FILE_ID_FULL_DIR_INFORMATION entry after next_offset
+_FILE_ID_FULL = struct.Struct('<IQQQQQQIII4xQ')
+
+def file_id_full_dir_info_size(i):
+    # Entries are padded to 8 bytes
+    return (80 + UTF8toUCS2Len(i['file_name']) + 7) & 0xfff8
+
+def encode_file_id_full_dir_info_into(buf, offset, i):
+    _fn = PathtoUCS2(i['file_name'])
+    _FILE_ID_FULL.pack_into(buf, offset + 4, i['file_index'],
+                            TimevalToWin(i['creation_time']),
+                            TimevalToWin(i['last_access_time']),
+                            TimevalToWin(i['last_write_time']),
+                            TimevalToWin(i['change_time']),
+                            i['end_of_file'], i['allocation_size'],
+                            i['file_attributes'], len(_fn), i['ea_size'],
+                            i['file_id'])
+    buf[offset + 80:offset + 80 + len(_fn)] = _fn
+
+    return offset + ((80 + len(_fn) + 7) & 0xfff8)
+
+def decode_file_id_full_dir_info(buf, offset=0):
+    i = FileIdFullDirInfo()
+    (i.file_index, _ct, _at, _wt, _cht, i.end_of_file, i.allocation_size,
+     i.file_attributes, _fnl, i.ea_size, i.file_id) = _FILE_ID_FULL.unpack_from(buf, offset + 4)
+    i.creation_time = WinToTimeval(_ct)
+    i.last_access_time = WinToTimeval(_at)
+    i.last_write_time = WinToTimeval(_wt)
+    i.change_time = WinToTimeval(_cht)
+
+    _offset = offset + 80
+    i.file_name = UCS2toPath(buf[_offset:_offset + _fnl])
 
     return i
 
-    
+
+#
+# Batch encoding of the entries of a Query Directory reply
+#
+
+# Pack the fixed parts of the entries as a numpy structured array.
+# Getting the fields out of the entries one at a time costs more than
+# packing them with struct, so it is off unless asked for.
+USE_NUMPY = False
+
+# A whole FILE_ID_FULL_DIR_INFORMATION entry, with next_offset
+_FILE_ID_FULL_ENTRY = struct.Struct('<IIQQQQQQIII4xQ')
+
+# 100ns intervals between 1601 and 1970, see TimevalToWin()
+_WIN_EPOCH = 116444736000000000
+
+def _pack_file_id_full_dir_info(buf, offset, entries, max_len):
+    """
+    Encode the entries from the iterator that fit in max_len bytes into
+    the zero filled buf at offset, in one pass. Returns the offset after
+    the entries, that of the last one, and their number.
+    The first entry that does not fit is consumed from the iterator too.
+    """
+    _pack = _FILE_ID_FULL_ENTRY.pack_into
+    _pos = offset
+    _last = offset
+    _end = offset + max_len
+    _num = 0
+    for i in entries:
+        _fn = PathtoUCS2(i['file_name'])
+        _l = len(_fn)
+        # Entries are padded to 8 bytes
+        _len = (80 + _l + 7) & 0xfff8
+        if _pos + _len > _end:
+            break
+        _ct = i['creation_time']
+        _at = i['last_access_time']
+        _wt = i['last_write_time']
+        _cht = i['change_time']
+        _pack(buf, _pos, _len, i['file_index'],
+              _ct[0] * 10000000 + _WIN_EPOCH + _ct[1] * 10 + _ct[2] if _ct != (0, 0, 0) else 0,
+              _at[0] * 10000000 + _WIN_EPOCH + _at[1] * 10 + _at[2] if _at != (0, 0, 0) else 0,
+              _wt[0] * 10000000 + _WIN_EPOCH + _wt[1] * 10 + _wt[2] if _wt != (0, 0, 0) else 0,
+              _cht[0] * 10000000 + _WIN_EPOCH + _cht[1] * 10 + _cht[2] if _cht != (0, 0, 0) else 0,
+              i['end_of_file'], i['allocation_size'], i['file_attributes'],
+              _l, i['ea_size'], i['file_id'])
+        buf[_pos + 80:_pos + 80 + _l] = _fn
+        _last = _pos
+        _pos = _pos + _len
+        _num = _num + 1
+    return _pos, _last, _num
+
+if numpy:
+    # The fixed part of an entry as a numpy structured type
+    _FILE_ID_FULL_DTYPE = numpy.dtype([
+        ('next_offset', '<u4'), ('file_index', '<u4'),
+        ('creation_time', '<u8'), ('last_access_time', '<u8'),
+        ('last_write_time', '<u8'), ('change_time', '<u8'),
+        ('end_of_file', '<u8'), ('allocation_size', '<u8'),
+        ('file_attributes', '<u4'), ('file_name_length', '<u4'),
+        ('ea_size', '<u4'), ('reserved', '<u4'), ('file_id', '<u8')])
+
+def _numpy_times(batch, name):
+    _t = numpy.array([i[name] for i in batch], dtype=numpy.int64)
+    _w = _t[:, 0] * 10000000 + _WIN_EPOCH + _t[:, 1] * 10 + _t[:, 2]
+    return numpy.where(_t.any(axis=1), _w, 0).astype(numpy.uint64)
+
+def _numpy_pack_file_id_full_dir_info(buf, offset, entries, max_len):
+    """
+    The same as _pack_file_id_full_dir_info() but with the fixed parts of
+    the entries built as a numpy structured array, and the entries and
+    their names each scattered into buf in one go
+    """
+    _batch = []
+    _names = []
+    _offsets = []
+    _pos = offset
+    _end = offset + max_len
+    for i in entries:
+        _fn = PathtoUCS2(i['file_name'])
+        _len = (80 + len(_fn) + 7) & 0xfff8
+        if _pos + _len > _end:
+            break
+        _batch.append(i)
+        _names.append(_fn)
+        _offsets.append(_pos)
+        _pos = _pos + _len
+    if not _batch:
+        return offset, offset, 0
+
+    _lens = numpy.array([len(_fn) for _fn in _names], dtype=numpy.int64)
+    _offsets = numpy.array(_offsets, dtype=numpy.int64)
+    _r = numpy.zeros(len(_batch), dtype=_FILE_ID_FULL_DTYPE)
+    _r['next_offset'] = (80 + _lens + 7) & 0xfff8
+    _r['file_name_length'] = _lens
+    for _name in ('creation_time', 'last_access_time', 'last_write_time',
+                  'change_time'):
+        _r[_name] = _numpy_times(_batch, _name)
+    for _name in ('file_index', 'end_of_file', 'allocation_size',
+                  'file_attributes', 'ea_size', 'file_id'):
+        _r[_name] = [i[_name] for i in _batch]
+
+    _out = numpy.frombuffer(buf, dtype=numpy.uint8)
+    _out[(_offsets[:, None] + numpy.arange(80)).ravel()] = _r.view(numpy.uint8)
+    _names = numpy.frombuffer(b''.join(_names), dtype=numpy.uint8)
+    _starts = numpy.cumsum(_lens) - _lens
+    _out[numpy.repeat(_offsets + 80 - _starts, _lens) +
+         numpy.arange(len(_names))] = _names
+    return _pos, int(_offsets[-1]), len(_batch)
+
+def encode_file_id_full_dir_info_batch(entries, max_len, reserve=0):
+    """
+    Encode as many entries from the iterator as fit in max_len bytes, in
+    one pass. Returns the buffer, with reserve zero bytes in front of the
+    entries for the reply to go in, and the number of entries.
+    The first entry that does not fit is consumed from the iterator too.
+    """
+    buf = bytearray(reserve + max_len)
+    if USE_NUMPY and numpy:
+        _pos, _last, _num = _numpy_pack_file_id_full_dir_info(buf, reserve,
+                                                               entries, max_len)
+    else:
+        _pos, _last, _num = _pack_file_id_full_dir_info(buf, reserve,
+                                                         entries, max_len)
+    if _num:
+        # The last entry has a next_entry_offset of 0
+        struct.pack_into('<I', buf, _last, 0)
+    del buf[_pos:]
+    return buf, _num
+
+
 dir_coders = {
-    DirInfoClass.FILE_ID_FULL_INFORMATION: (encode_file_id_full_dir_info,
-                                            decode_file_id_full_dir_info),
+    DirInfoClass.FILE_ID_FULL_INFORMATION: (file_id_full_dir_info_size,
+                                            encode_file_id_full_dir_info_into,
+                                            decode_file_id_full_dir_info,
+                                            encode_file_id_full_dir_info_batch),
     }
 
 class DirInfo(object):
@@ -81,44 +221,92 @@ class DirInfo(object):
     def decode(dic, buf):
         if dic in dir_coders:
             info = []
-            while buf:
-                _next = struct.unpack_from('<I', buf, 0)[0]
+            _pos = 0
+            while _pos < len(buf):
+                _next = struct.unpack_from('<I', buf, _pos)[0]
 
-                i = dir_coders[dic][1](buf)
+                i = dir_coders[dic][2](buf, _pos)
                 info.append(i)
 
-                if _next:
-                    buf = buf[_next:]
-                else:
-                    buf = []
+                if not _next:
+                    break
+                _pos = _pos + _next
             return info
         
         print('Unknown DirInfoClass', dic)
         return {}
 
+    @staticmethod
+    def encoded_size_single(dic, info):
+        """
+        Number of bytes a single entry encodes to, including padding
+        """
+        return dir_coders[dic][0](info)
+
+    @staticmethod
+    def encode_single_into(dic, buf, offset, info):
+        """
+        Encode a single entry into the zero filled buf at offset with
+        next_entry_offset pointing past it. Returns the offset after it.
+        """
+        _end = dir_coders[dic][1](buf, offset, info)
+        struct.pack_into('<I', buf, offset, _end - offset)
+        return _end
+
     @staticmethod
     def encode_single(dic, info):
         if dic in dir_coders:
-            buf = dir_coders[dic][0](info)
-            struct.pack_into('<I', buf, 0, len(buf))
+            buf = bytearray(dir_coders[dic][0](info))
+            DirInfo.encode_single_into(dic, buf, 0, info)
             return buf
-    
+
     @staticmethod
-    def encode(dic, info):
+    def encoded_size(dic, info):
+        """
+        Number of bytes a list of entries encodes to
+        """
         if dic in dir_coders:
-            buf = bytearray(0)
+            _size = dir_coders[dic][0]
+            return sum([_size(i) for i in info])
+        return 0
 
-            while info:
-                _i = info[0]
-                _b = dir_coders[dic][0](_i)
-        
-                info = info[1:]
-                if info:
-                    struct.pack_into('<I', _b, 0, len(_b))
-            
-                buf = buf + _b
+    @staticmethod
+    def encode_into(dic, buf, offset, info):
+        """
+        Encode a list of entries into the zero filled buf at offset and
+        return the offset after them
+        """
+        if dic in dir_coders:
+            _encode = dir_coders[dic][1]
+            _pos = offset
+            for _i in info:
+                _end = _encode(buf, _pos, _i)
+                struct.pack_into('<I', buf, _pos, _end - _pos)
+                _last = _pos
+                _pos = _end
+            if info:
+                # The last entry has a next_entry_offset of 0
+                struct.pack_into('<I', buf, _last, 0)
+            return _pos
 
-            return buf
+        print('Unknown DirInfoClass', dic)
+        return offset
+
+    @staticmethod
+    def encode_batch(dic, entries, max_len, reserve=0):
+        """
+        Encode as many entries from the iterator as fit in max_len bytes.
+        Returns a buffer with reserve bytes in front of the entries, and
+        the number of entries in it.
+        """
+        if dic in dir_coders:
+            return dir_coders[dic][3](entries, max_len, reserve)
 
         print('Unknown DirInfoClass', dic)
-        return bytearray(0)
+        return bytearray(reserve), 0
+
+    @staticmethod
+    def encode(dic, info):
+        buf = bytearray(DirInfo.encoded_size(dic, info))
+        DirInfo.encode_into(dic, buf, 0, info)
+        return buf
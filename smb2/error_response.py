@@ -5,11 +5,28 @@
 
 import struct
 
+from smb2.record import Record
+from smb2.schema import Codec, Field, Buffer
+
 #
 # SMB2 Error Response
 #
 
 
+class ErrorResponseReply(Record):
+    """
+    A class for a decoded Error Response
+    """
+    __slots__ = ('structure_size', 'error_context_count', 'error_data')
+
+# TODO handle error_context_count for 3.1.1
+_pdu = Codec(ErrorResponseReply, 8, [
+    Field('structure_size', 0, 'H', value=9),
+    Field('error_context_count', 2, 'B', optional=True),
+    ], [
+    Buffer('error_data'),
+    ])
+
 class ErrorResponse(object):
     """
     A class for ErrorResponse
@@ -26,25 +43,28 @@ class ErrorResponse(object):
         """
         Decode an Error Response
         """
-        result = {}
-        result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-        if struct.unpack_from('<B', hdr, 2)[0]:
-            # TODO handle error_context_count for 3.1.1
+        if hdr[2]:
             print('We do not handle error_contexts yet')
-        
-        result.update({'error_data': hdr[8:]})
+        return _pdu.decode(hdr)
 
-        return result
+    @staticmethod
+    def encoded_size(hdr):
+        """
+        Number of bytes an Error Response encodes to
+        """
+        return _pdu.encoded_size(hdr)
+
+    @staticmethod
+    def encode_into(buf, offset, hdr):
+        """
+        Encode an Error Response into buf at offset and return the offset
+        after it. The bytes of buf it covers must be zero.
+        """
+        return _pdu.encode_into(buf, offset, hdr)
 
     @staticmethod
     def encode(hdr):
         """
         Encode an Error Response
         """
-        result = bytearray(8)
-        struct.pack_into('<H', result, 0, 9)
-        # TODO handle error_context_count for 3.1.1
-        if 'error_data' in hdr:
-            result = result + hdr['error_data']
-
-        return result
+        return _pdu.encode(hdr)
@@ -8,7 +8,8 @@ from enum import Enum
 
 from smb2.header import Direction
 from smb2.timestamps import WinToTimeval, TimevalToWin
-from smb2.unicode import UCS2toUTF8, UTF8toUCS2
+from smb2.unicode import UCS2toPath, PathtoUCS2
+from smb2.record import Record
 
 #
 # SMB2 FILE INFORMATION CLASSES
@@ -32,13 +33,98 @@ class FileInfoClass(Enum):
     ALL_INFORMATION               = 0x12
     END_OF_FILE_INFORMATION       = 0x14
 
-def decode_basic_info(buf):
-    info = {}
-    info.update({'creation_time': WinToTimeval(struct.unpack_from('<Q', buf, 0)[0])})
-    info.update({'last_access_time': WinToTimeval(struct.unpack_from('<Q', buf, 8)[0])})
-    info.update({'last_write_time': WinToTimeval(struct.unpack_from('<Q', buf, 16)[0])})
-    info.update({'change_time': WinToTimeval(struct.unpack_from('<Q', buf, 24)[0])})
-    info.update({'file_attributes': struct.unpack_from('<I', buf, 32)[0]})
+class FileBasicInfo(Record):
+    """
+    A class for a decoded FILE_BASIC_INFORMATION
+    """
+    __slots__ = ('creation_time', 'last_access_time', 'last_write_time',
+                 'change_time', 'file_attributes')
+
+class FileStandardInfo(Record):
+    """
+    A class for a decoded FILE_STANDARD_INFORMATION
+    """
+    __slots__ = ('allocation_size', 'end_of_file', 'number_of_links',
+                 'delete_pending', 'directory')
+
+class FileInternalInfo(Record):
+    """
+    A class for a decoded FILE_INTERNAL_INFORMATION
+    """
+    __slots__ = ('index_number',)
+
+class FileEaInfo(Record):
+    """
+    A class for a decoded FILE_EA_INFORMATION
+    """
+    __slots__ = ('ea_size',)
+
+class FileAccessInfo(Record):
+    """
+    A class for a decoded FILE_ACCESS_INFORMATION
+    """
+    __slots__ = ('access_flags',)
+
+class FileRenameInfo(Record):
+    """
+    A class for a decoded FILE_RENAME_INFORMATION
+    """
+    __slots__ = ('replace_if_exists', 'filename')
+
+class FilePositionInfo(Record):
+    """
+    A class for a decoded FILE_POSITION_INFORMATION
+    """
+    __slots__ = ('current_byte_offset',)
+
+class FileModeInfo(Record):
+    """
+    A class for a decoded FILE_MODE_INFORMATION
+    """
+    __slots__ = ('mode',)
+
+class FileAlignmentInfo(Record):
+    """
+    A class for a decoded FILE_ALIGNMENT_INFORMATION
+    """
+    __slots__ = ('alignment_requirement',)
+
+class FileNameInfo(Record):
+    """
+    A class for a decoded FILE_NAME_INFORMATION
+    """
+    __slots__ = ('name',)
+
+class FileAllInfo(Record):
+    """
+    A class for a decoded FILE_ALL_INFORMATION
+    """
+    __slots__ = (FileBasicInfo.__slots__ + FileStandardInfo.__slots__ +
+                 FileInternalInfo.__slots__ + FileEaInfo.__slots__ +
+                 FileAccessInfo.__slots__ + FilePositionInfo.__slots__ +
+                 FileModeInfo.__slots__ + FileAlignmentInfo.__slots__ +
+                 FileNameInfo.__slots__)
+
+class FileDispositionInfo(Record):
+    """
+    A class for a decoded FILE_DISPOSITION_INFORMATION
+    """
+    __slots__ = ('delete_pending',)
+
+class FileEndOfFileInfo(Record):
+    """
+    A class for a decoded FILE_END_OF_FILE_INFORMATION
+    """
+    __slots__ = ('end_of_file',)
+
+def decode_basic_info(buf, info=None):
+    if info is None:
+        info = FileBasicInfo()
+    info.creation_time = WinToTimeval(struct.unpack_from('<Q', buf, 0)[0])
+    info.last_access_time = WinToTimeval(struct.unpack_from('<Q', buf, 8)[0])
+    info.last_write_time = WinToTimeval(struct.unpack_from('<Q', buf, 16)[0])
+    info.change_time = WinToTimeval(struct.unpack_from('<Q', buf, 24)[0])
+    info.file_attributes = struct.unpack_from('<I', buf, 32)[0]
     
     return info
 
@@ -51,13 +137,14 @@ def encode_basic_info(info):
     struct.pack_into('<I', buf, 32, info['file_attributes'])
     return buf
 
-def decode_standard_info(buf):
-    info = {}
-    info.update({'allocation_size': struct.unpack_from('<Q', buf, 0)[0]})
-    info.update({'end_of_file': struct.unpack_from('<Q', buf, 8)[0]})
-    info.update({'number_of_links': struct.unpack_from('<I', buf, 16)[0]})
-    info.update({'delete_pending': struct.unpack_from('<B', buf, 20)[0]})
-    info.update({'directory': struct.unpack_from('<B', buf, 21)[0]})
+def decode_standard_info(buf, info=None):
+    if info is None:
+        info = FileStandardInfo()
+    info.allocation_size = struct.unpack_from('<Q', buf, 0)[0]
+    info.end_of_file = struct.unpack_from('<Q', buf, 8)[0]
+    info.number_of_links = struct.unpack_from('<I', buf, 16)[0]
+    info.delete_pending = struct.unpack_from('<B', buf, 20)[0]
+    info.directory = struct.unpack_from('<B', buf, 21)[0]
     return info
 
 def encode_standard_info(info):
@@ -69,9 +156,10 @@ def encode_standard_info(info):
     struct.pack_into('<B', buf, 21, info['directory'])
     return buf
 
-def decode_internal_info(buf):
-    info = {}
-    info.update({'index_number': struct.unpack_from('<Q', buf, 0)[0]})
+def decode_internal_info(buf, info=None):
+    if info is None:
+        info = FileInternalInfo()
+    info.index_number = struct.unpack_from('<Q', buf, 0)[0]
     return info
 
 def encode_internal_info(info):
@@ -79,9 +167,10 @@ def encode_internal_info(info):
     struct.pack_into('<Q', buf, 0, info['index_number'])
     return buf
 
-def decode_ea_info(buf):
-    info = {}
-    info.update({'ea_size': struct.unpack_from('<I', buf, 0)[0]})
+def decode_ea_info(buf, info=None):
+    if info is None:
+        info = FileEaInfo()
+    info.ea_size = struct.unpack_from('<I', buf, 0)[0]
     return info
 
 def encode_ea_info(info):
@@ -89,9 +178,10 @@ def encode_ea_info(info):
     struct.pack_into('<I', buf, 0, info['ea_size'])
     return buf
 
-def decode_access_info(buf):
-    info = {}
-    info.update({'access_flags': struct.unpack_from('<I', buf, 0)[0]})
+def decode_access_info(buf, info=None):
+    if info is None:
+        info = FileAccessInfo()
+    info.access_flags = struct.unpack_from('<I', buf, 0)[0]
     return info
 
 def encode_access_info(info):
@@ -100,23 +190,24 @@ def encode_access_info(info):
     return buf
 
 def decode_rename_info(buf):
-    info = {}
-    info.update({'replace_if_exists': struct.unpack_from('<B', buf, 0)[0]})
+    info = FileRenameInfo()
+    info.replace_if_exists = struct.unpack_from('<B', buf, 0)[0]
     _len = struct.unpack_from('<I', buf, 16)[0]
-    info.update({'filename': UCS2toUTF8(buf[20:20 + _len]).replace(b'\\', b'/')})
+    info.filename = UCS2toPath(buf[20:20 + _len])
     return info
 
 def encode_rename_info(info):
     buf = bytearray(20)
     struct.pack_into('<B', buf, 0, info['replace_if_exists'])
-    _fn = UTF8toUCS2(info['filename']).replace(b'/', b'\\')
+    _fn = PathtoUCS2(info['filename'])
     struct.pack_into('<I', buf, 16, len(_fn))
     buf = buf + _fn
     return buf
 
-def decode_position_info(buf):
-    info = {}
-    info.update({'current_byte_offset': struct.unpack_from('<Q', buf, 0)[0]})
+def decode_position_info(buf, info=None):
+    if info is None:
+        info = FilePositionInfo()
+    info.current_byte_offset = struct.unpack_from('<Q', buf, 0)[0]
     return info
 
 def encode_position_info(info):
@@ -124,9 +215,10 @@ def encode_position_info(info):
     struct.pack_into('<Q', buf, 0, info['current_byte_offset'])
     return buf
 
-def decode_mode_info(buf):
-    info = {}
-    info.update({'mode': struct.unpack_from('<I', buf, 0)[0]})
+def decode_mode_info(buf, info=None):
+    if info is None:
+        info = FileModeInfo()
+    info.mode = struct.unpack_from('<I', buf, 0)[0]
     return info
 
 def encode_mode_info(info):
@@ -134,9 +226,10 @@ def encode_mode_info(info):
     struct.pack_into('<I', buf, 0, info['mode'])
     return buf
 
-def decode_alignment_info(buf):
-    info = {}
-    info.update({'alignment_requirement': struct.unpack_from('<I', buf, 0)[0]})
+def decode_alignment_info(buf, info=None):
+    if info is None:
+        info = FileAlignmentInfo()
+    info.alignment_requirement = struct.unpack_from('<I', buf, 0)[0]
     return info
 
 def encode_alignment_info(info):
@@ -144,32 +237,34 @@ def encode_alignment_info(info):
     struct.pack_into('<I', buf, 0, info['alignment_requirement'])
     return buf
 
-def decode_name_info(buf):
-    info = {}
+def decode_name_info(buf, info=None):
+    if info is None:
+        info = FileNameInfo()
     _len = struct.unpack_from('<I', buf, 0)[0]
     if _len:
-        info.update({'name': UCS2toUTF8(buf[4:4 + _len]).replace(b'\\', b'/')})
+        info.name = UCS2toPath(buf[4:4 + _len])
     return info
 
 def encode_name_info(info):
     buf = bytearray(4)
     if 'name' in info:
-        _c = UTF8toUCS2(hdr['name']).replace(b'/', b'\\')
+        _c = PathtoUCS2(info['name'])
         struct.pack_into('<I', buf, 0, len(_c))
         buf = buf + _c
     return buf
 
 def decode_all_info(buf):
-    info = {}
-    info.update(decode_basic_info(buf[:40]))
-    info.update(decode_standard_info(buf[40:64]))
-    info.update(decode_internal_info(buf[64:72]))
-    info.update(decode_ea_info(buf[72:76]))
-    info.update(decode_access_info(buf[76:80]))
-    info.update(decode_position_info(buf[80:88]))
-    info.update(decode_mode_info(buf[88:92]))
-    info.update(decode_alignment_info(buf[92:96]))
-    info.update(decode_name_info(buf[96:]))
+    # The parts decode straight into the one record
+    info = FileAllInfo()
+    decode_basic_info(buf[:40], info)
+    decode_standard_info(buf[40:64], info)
+    decode_internal_info(buf[64:72], info)
+    decode_ea_info(buf[72:76], info)
+    decode_access_info(buf[76:80], info)
+    decode_position_info(buf[80:88], info)
+    decode_mode_info(buf[88:92], info)
+    decode_alignment_info(buf[92:96], info)
+    decode_name_info(buf[96:], info)
     return info
 
 def encode_all_info(info):
@@ -186,8 +281,8 @@ def encode_all_info(info):
     return buf
 
 def decode_disposition_info(buf):
-    info = {}
-    info.update({'delete_pending': struct.unpack_from('<B', buf, 0)[0]})
+    info = FileDispositionInfo()
+    info.delete_pending = struct.unpack_from('<B', buf, 0)[0]
     
     return info
 
@@ -197,8 +292,8 @@ def encode_disposition_info(info):
     return buf
 
 def decode_end_of_file_info(buf):
-    info = {}
-    info.update({'end_of_file': struct.unpack_from('<Q', buf, 0)[0]})
+    info = FileEndOfFileInfo()
+    info.end_of_file = struct.unpack_from('<Q', buf, 0)[0]
     
     return info
 
@@ -8,7 +8,8 @@ from enum import Enum
 
 from smb2.header import Direction
 from smb2.timestamps import WinToTimeval, TimevalToWin
-from smb2.unicode import UCS2toUTF8, UTF8toUCS2
+from smb2.unicode import UCS2toPath, PathtoUCS2
+from smb2.record import Record
 
 #
 # SMB2 FILESYSTEM INFORMATION CLASSES
@@ -79,13 +80,52 @@ SSINFO_FLAGS_NO_SEEK_PENALTY             = 0x00000004
 SSINFO_FLAGS_TRIM_ENABLED                = 0x00000008
 
 
+class FSAttributeInfo(Record):
+    """
+    A class for a decoded FILE_FS_ATTRIBUTE_INFORMATION
+    """
+    __slots__ = ('attributes', 'maximum_component_name_length',
+                 'file_system_name')
+
+class FSDeviceInfo(Record):
+    """
+    A class for a decoded FILE_FS_DEVICE_INFORMATION
+    """
+    __slots__ = ('device_type', 'characteristics')
+
+class FSVolumeInfo(Record):
+    """
+    A class for a decoded FILE_FS_VOLUME_INFORMATION
+    """
+    __slots__ = ('creation_time', 'serial_number', 'supports_objects', 'label')
+
+class FSSectorSizeInfo(Record):
+    """
+    A class for a decoded FILE_FS_SECTOR_SIZE_INFORMATION
+    """
+    __slots__ = ('logical_bytes_per_sector',
+                 'physical_bytes_per_sector_for_atomicity',
+                 'physical_bytes_per_sector_for_performance',
+                 'effective_physical_bytes_per_sector_for_atomicity', 'flags',
+                 'byte_offset_for_sector_alignment',
+                 'byte_offset_for_partition_alignment')
+
+class FSFullSizeInfo(Record):
+    """
+    A class for a decoded FILE_FS_FULL_SIZE_INFORMATION
+    """
+    __slots__ = ('total_allocation_units',
+                 'caller_available_allocation_units',
+                 'actual_available_allocation_units',
+                 'sectors_per_allocation_unit', 'bytes_per_sector')
+
 def decode_attribute_info(buf):
-    i = {}
-    i.update({'attributes': struct.unpack_from('<I', buf, 0)[0]})
-    i.update({'maximum_component_name_length': struct.unpack_from('<I', buf, 4)[0]})
+    i = FSAttributeInfo()
+    i.attributes = struct.unpack_from('<I', buf, 0)[0]
+    i.maximum_component_name_length = struct.unpack_from('<I', buf, 4)[0]
     _len = struct.unpack_from('<I', buf, 8)[0]
     if _len:
-        i.update({'file_system_name': UCS2toUTF8(buf[12:12 + _len]).replace(b'\\', b'/')})
+        i.file_system_name = UCS2toPath(buf[12:12 + _len])
 
     return i
 
@@ -93,16 +133,16 @@ def encode_attribute_info(i):
     _b = bytearray(12)
     struct.pack_into('<I', _b,  0, i['attributes'])
     struct.pack_into('<I', _b,  4, i['maximum_component_name_length'])
-    _n = UTF8toUCS2(i['file_system_name']).replace(b'/', b'\\')
+    _n = PathtoUCS2(i['file_system_name'])
     struct.pack_into('<I', _b, 8, len(_n))
     _b = _b + _n
 
     return _b
 
 def decode_device_info(buf):
-    i = {}
-    i.update({'device_type': struct.unpack_from('<I', buf, 0)[0]})
-    i.update({'characteristics': struct.unpack_from('<I', buf, 4)[0]})
+    i = FSDeviceInfo()
+    i.device_type = struct.unpack_from('<I', buf, 0)[0]
+    i.characteristics = struct.unpack_from('<I', buf, 4)[0]
 
     return i
 
@@ -114,12 +154,12 @@ def encode_device_info(i):
     return _b
 
 def decode_volume_info(buf):
-    i = {}
-    i.update({'creation_time': WinToTimeval(struct.unpack_from('<Q', buf, 0)[0])})
-    i.update({'serial_number': struct.unpack_from('<I', buf, 8)[0]})
-    i.update({'supports_objects': struct.unpack_from('<B', buf, 16)[0]})
+    i = FSVolumeInfo()
+    i.creation_time = WinToTimeval(struct.unpack_from('<Q', buf, 0)[0])
+    i.serial_number = struct.unpack_from('<I', buf, 8)[0]
+    i.supports_objects = struct.unpack_from('<B', buf, 16)[0]
     _len = struct.unpack_from('<I', buf, 12)[0]
-    i.update({'label': UCS2toUTF8(buf[18:18 + _len]).replace(b'\\', b'/')})
+    i.label = UCS2toPath(buf[18:18 + _len])
 
     return i
 
@@ -128,7 +168,7 @@ def encode_volume_info(i):
     struct.pack_into('<Q', _b,  0, TimevalToWin(i['creation_time']))
     struct.pack_into('<I', _b,  8, i['serial_number'])
     struct.pack_into('<B', _b,  16, i['supports_objects'])
-    _lab = UTF8toUCS2(i['label']).replace(b'/', b'\\')
+    _lab = PathtoUCS2(i['label'])
     struct.pack_into('<I', _b,  12, len(_lab))
     _b = _b + _lab
     
@@ -147,14 +187,14 @@ def encode_sector_size_info(i):
     return _b
 
 def decode_sector_size_info(buf):
-    i = {}
-    i.update({'logical_bytes_per_sector': struct.unpack_from('<I', buf, 0)[0]})
-    i.update({'physical_bytes_per_sector_for_atomicity': struct.unpack_from('<I', buf, 4)[0]})
-    i.update({'physical_bytes_per_sector_for_performance': struct.unpack_from('<I', buf, 8)[0]})
-    i.update({'effective_physical_bytes_per_sector_for_atomicity': struct.unpack_from('<I', buf, 12)[0]})
-    i.update({'flags': struct.unpack_from('<I', buf, 16)[0]})
-    i.update({'byte_offset_for_sector_alignment': struct.unpack_from('<I', buf, 20)[0]})
-    i.update({'byte_offset_for_partition_alignment': struct.unpack_from('<I', buf, 24)[0]})
+    i = FSSectorSizeInfo()
+    i.logical_bytes_per_sector = struct.unpack_from('<I', buf, 0)[0]
+    i.physical_bytes_per_sector_for_atomicity = struct.unpack_from('<I', buf, 4)[0]
+    i.physical_bytes_per_sector_for_performance = struct.unpack_from('<I', buf, 8)[0]
+    i.effective_physical_bytes_per_sector_for_atomicity = struct.unpack_from('<I', buf, 12)[0]
+    i.flags = struct.unpack_from('<I', buf, 16)[0]
+    i.byte_offset_for_sector_alignment = struct.unpack_from('<I', buf, 20)[0]
+    i.byte_offset_for_partition_alignment = struct.unpack_from('<I', buf, 24)[0]
 
     return i
 
@@ -169,12 +209,12 @@ def encode_full_size_info(i):
     return _b
 
 def decode_full_size_info(buf):
-    i = {}
-    i.update({'total_allocation_units': struct.unpack_from('<Q', buf, 0)[0]})
-    i.update({'caller_available_allocation_units': struct.unpack_from('<Q', buf, 8)[0]})
-    i.update({'actual_available_allocation_units': struct.unpack_from('<Q', buf, 16)[0]})
-    i.update({'sectors_per_allocation_unit': struct.unpack_from('<I', buf, 24)[0]})
-    i.update({'bytes_per_sector': struct.unpack_from('<I', buf, 28)[0]})
+    i = FSFullSizeInfo()
+    i.total_allocation_units = struct.unpack_from('<Q', buf, 0)[0]
+    i.caller_available_allocation_units = struct.unpack_from('<Q', buf, 8)[0]
+    i.actual_available_allocation_units = struct.unpack_from('<Q', buf, 16)[0]
+    i.sectors_per_allocation_unit = struct.unpack_from('<I', buf, 24)[0]
+    i.bytes_per_sector = struct.unpack_from('<I', buf, 28)[0]
 
     return i
 
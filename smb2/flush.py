@@ -7,52 +7,33 @@ import struct
 from enum import Enum
 
 from smb2.header import Direction
-from smb2.timestamps import WinToTimeval, TimevalToWin
+from smb2.record import Record
+from smb2.schema import Codec, Field
 
 #
 # SMB2 Flush
 #
 
-def _decode_request(hdr):
+class FlushRequest(Record):
     """
-    Decode a Flush request
+    A class for a decoded Flush request
     """
-    result = {}
-    result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-    result.update({'file_id': (struct.unpack_from('<Q', hdr,  8)[0],
-                               struct.unpack_from('<Q', hdr, 16)[0])})
+    __slots__ = ('structure_size', 'file_id')
 
-    return result
-
-def _encode_request(hdr):
+class FlushReply(Record):
     """
-    Encode a Flush request
+    A class for a decoded Flush reply
     """
-    result = bytearray(24)
-    struct.pack_into('<H', result, 0, 24)
-    struct.pack_into('<Q', result, 8, hdr['file_id'][0])
-    struct.pack_into('<Q', result, 16, hdr['file_id'][1])
+    __slots__ = ('structure_size',)
 
-    return result
-
-def _decode_reply(hdr):
-    """
-    Decode a Flush reply
-    """
-    result = {}
-    result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-        
-    return result
-
-def _encode_reply(hdr):
-    """
-    Encode a Flush reply
-    """
-    result = bytearray(4)
-    struct.pack_into('<H', result, 0, 4)
-
-    return result
+_request = Codec(FlushRequest, 24, [
+    Field('structure_size', 0, 'H', value=24),
+    Field('file_id', 8, 'QQ'),
+    ])
 
+_reply = Codec(FlushReply, 4, [
+    Field('structure_size', 0, 'H', value=4),
+    ])
 
 class Flush(object):
     """
@@ -71,8 +52,27 @@ class Flush(object):
         Decode a Flush PDU
         """
         if direction == Direction.REPLY:
-            return _decode_reply(hdr)
-        return _decode_request(hdr)
+            return _reply.decode(hdr)
+        return _request.decode(hdr)
+
+    @staticmethod
+    def encoded_size(direction, hdr):
+        """
+        Number of bytes a Flush PDU encodes to
+        """
+        if direction == Direction.REPLY:
+            return _reply.encoded_size(hdr)
+        return _request.encoded_size(hdr)
+
+    @staticmethod
+    def encode_into(direction, buf, offset, hdr):
+        """
+        Encode a Flush PDU into buf at offset and return the offset
+        after it. The bytes of buf it covers must be zero.
+        """
+        if direction == Direction.REPLY:
+            return _reply.encode_into(buf, offset, hdr)
+        return _request.encode_into(buf, offset, hdr)
 
     @staticmethod
     def encode(direction, hdr):
@@ -80,6 +80,5 @@ class Flush(object):
         Encode a Flush PDU
         """
         if direction == Direction.REPLY:
-            return _encode_reply(hdr)
-        return _encode_request(hdr)
-    
+            return _reply.encode(hdr)
+        return _request.encode(hdr)
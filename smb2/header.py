@@ -15,13 +15,19 @@ SMB2_MAGIC = 0x424d53fe
 
 class Status(Enum):
     SUCCESS                  = 0x00000000
+    PENDING                  = 0x00000103
     NO_MORE_FILES            = 0x80000006
+    INFO_LENGTH_MISMATCH     = 0xc0000004
     INVALID_PARAMETER        = 0xc000000d
+    NO_SUCH_FILE             = 0xc000000f
     END_OF_FILE              = 0xc0000011
     MORE_PROCESSING_REQUIRED = 0xc0000016
     OBJECT_NAME_NOT_FOUND    = 0xc0000034
     BAD_NETWORK_NAME         = 0xc00000cc
+    REQUEST_NOT_ACCEPTED     = 0xc00000d0
+    INVALID_OPLOCK_PROTOCOL  = 0xc00000e3
     DIRECTORY_NOT_EMPTY      = 0xc0000101
+    CANCELLED                = 0xc0000120
     USER_SESSION_DELETED     = 0xc0000203
     
 class Direction(Enum):
@@ -39,9 +45,11 @@ class Command(Enum):
     FLUSH              = 7
     READ               = 8
     WRITE              = 9
+    CANCEL             = 12
     QUERY_DIRECTORY    = 14
     QUERY_INFO         = 16
     SET_INFO           = 17
+    OPLOCK_BREAK       = 18
 
 
 # Flags
@@ -73,6 +81,40 @@ FILE_ATTRIBUTE_INTEGRITY_STREAM    = 0x00008000
 FILE_ATTRIBUTE_NO_SCRUB_DATA       = 0x00020000
 
 
+#
+# Header layouts. Sync and async headers only differ in bytes 32-39, which
+# hold either the process and tree ids or the async id. Requests and
+# replies share the layouts but name the fields at offset 8 and 14
+# differently.
+#
+_FLAGS = struct.Struct('<I')
+_SYNC = struct.Struct('<IHHIHHIIQIIQ16s')
+_ASYNC = struct.Struct('<IHHIHHIIQQQ16s')
+
+_SYNC_REQUEST = ('protocol_id', 'structure_size', 'credit_charge',
+                 'channel_sequence', 'command', 'credit_request', 'flags',
+                 'next_command', 'message_id', 'process_id', 'tree_id',
+                 'session_id', 'signature')
+_SYNC_REPLY = ('protocol_id', 'structure_size', 'credit_charge',
+               'status', 'command', 'credit_response', 'flags',
+               'next_command', 'message_id', 'process_id', 'tree_id',
+               'session_id', 'signature')
+_ASYNC_REQUEST = ('protocol_id', 'structure_size', 'credit_charge',
+                  'channel_sequence', 'command', 'credit_request', 'flags',
+                  'next_command', 'message_id', 'async_id',
+                  'session_id', 'signature')
+_ASYNC_REPLY = ('protocol_id', 'structure_size', 'credit_charge',
+                'status', 'command', 'credit_response', 'flags',
+                'next_command', 'message_id', 'async_id',
+                'session_id', 'signature')
+
+# Indexed by flags & (RESPONSE | ASYNC)
+_LAYOUTS = ((_SYNC, _SYNC_REQUEST),
+            (_SYNC, _SYNC_REPLY),
+            (_ASYNC, _ASYNC_REQUEST),
+            (_ASYNC, _ASYNC_REPLY))
+
+
 class Header(object):
     """
     A class for SMB2 Header and definitions
@@ -85,33 +127,49 @@ class Header(object):
         True
 
     @staticmethod
-    def decode(hdr):
+    def decode(hdr, offset=0):
+        """
+        Decode an SMB2 Header, starting at offset in hdr
+        """
+        _s, _names = _LAYOUTS[_FLAGS.unpack_from(hdr, offset + 16)[0] & (RESPONSE | ASYNC)]
+        return dict(zip(_names, _s.unpack_from(hdr, offset)))
+
+    @staticmethod
+    def encoded_size(hdr):
         """
-        Decode an SMB2 Header
+        Number of bytes an SMB2 Header encodes to
         """
-        result = {}
-        result.update({'protocol_id': struct.unpack_from('<I', hdr, 0)[0]})
-        result.update({'structure_size': struct.unpack_from('<H', hdr, 4)[0]})
-        result.update({'credit_charge': struct.unpack_from('<H', hdr, 6)[0]})
-        result.update({'command': struct.unpack_from('<H', hdr, 12)[0]})
-        result.update({'flags': struct.unpack_from('<I', hdr, 16)[0]})
-        result.update({'next_command': struct.unpack_from('<I', hdr, 20)[0]})
-        result.update({'message_id': struct.unpack_from('<Q', hdr, 24)[0]})
-        result.update({'session_id': struct.unpack_from('<Q', hdr, 40)[0]})
-        result.update({'signature': hdr[48:48 + 16]})
-        if result['flags'] & RESPONSE:
-            result.update({'status': struct.unpack_from('<I', hdr, 8)[0]})
-            result.update({'credit_response': struct.unpack_from('<H', hdr, 14)[0]})
+        return 64
+
+    @staticmethod
+    def encode_into(buf, offset, hdr):
+        """
+        Encode an SMB2 Header into buf at offset and return the offset
+        after it
+        """
+        _flags = hdr['flags']
+        if _flags & RESPONSE:
+            _x8 = hdr['status']
+            _x14 = hdr['credit_response']
         else:
-            result.update({'channel_sequence': struct.unpack_from('<I', hdr, 8)[0]})
-            result.update({'credit_request': struct.unpack_from('<H', hdr, 14)[0]})
-        if result['flags'] & ASYNC:
-            result.update({'async_id': struct.unpack_from('<Q', hdr, 32)[0]})
+            _x8 = hdr['channel_sequence']
+            _x14 = hdr['credit_request']
+        if _flags & ASYNC:
+            _ASYNC.pack_into(buf, offset, hdr['protocol_id'], 64,
+                             hdr['credit_charge'], _x8, hdr['command'], _x14,
+                             _flags, hdr.get('next_command', 0),
+                             hdr['message_id'], hdr['async_id'],
+                             hdr['session_id'],
+                             hdr.get('signature', b''))
         else:
-            result.update({'process_id': struct.unpack_from('<I', hdr, 32)[0]})
-            result.update({'tree_id': struct.unpack_from('<I', hdr, 36)[0]})
+            _SYNC.pack_into(buf, offset, hdr['protocol_id'], 64,
+                            hdr['credit_charge'], _x8, hdr['command'], _x14,
+                            _flags, hdr.get('next_command', 0),
+                            hdr['message_id'], hdr['process_id'],
+                            hdr['tree_id'], hdr['session_id'],
+                            hdr.get('signature', b''))
 
-        return result
+        return offset + 64
 
     @staticmethod
     def encode(hdr):
@@ -119,27 +177,5 @@ class Header(object):
         Encode an SMB2 Header
         """
         result = bytearray(64)
-        struct.pack_into('<I', result, 0, hdr['protocol_id'])
-        struct.pack_into('<H', result, 4, 64)
-        struct.pack_into('<H', result, 6, hdr['credit_charge'])
-        struct.pack_into('<H', result, 12, hdr['command'])
-        struct.pack_into('<I', result, 16, hdr['flags'])
-        if 'next_command' in hdr:
-            struct.pack_into('<I', result, 20, hdr['next_command'])
-        struct.pack_into('<Q', result, 24, hdr['message_id'])
-        struct.pack_into('<Q', result, 40, hdr['session_id'])
-        if 'signature' in hdr:
-            result[48:48 + 16] = hdr['signature']
-        if hdr['flags'] & RESPONSE:
-            struct.pack_into('<I', result, 8, hdr['status'])
-            struct.pack_into('<H', result, 14, hdr['credit_response'])
-        else:
-            struct.pack_into('<I', result, 8, hdr['channel_sequence'])
-            struct.pack_into('<H', result, 14, hdr['credit_request'])
-        if hdr['flags'] & ASYNC:
-            struct.pack_into('<Q', result, 32, hdr['async_id'])
-        else:
-            struct.pack_into('<I', result, 32, hdr['process_id'])
-            struct.pack_into('<I', result, 36, hdr['tree_id'])
-
+        Header.encode_into(result, 0, hdr)
         return result
@@ -7,7 +7,8 @@ import struct
 from enum import Enum
 
 from smb2.header import Direction
-from smb2.timestamps import WinToTimeval, TimevalToWin
+from smb2.record import Record, Lazy
+from smb2.schema import Codec, Coder, Field, Buffer, Array, TIME
 
 #
 # SMB2 Negotiate_Protocol
@@ -60,6 +61,26 @@ SMB2_GLOBAL_CAP_DIRECTORY_LEASING  = 0x00000020
 SMB2_GLOBAL_CAP_ENCRYPTION         = 0x00000040
 
 
+class NegotiateProtocolRequest(Record):
+    """
+    A class for a decoded Negotiate Protocol request
+    """
+    __slots__ = ('structure_size', 'security_mode', 'capabilities',
+                 'client_guid', 'dialects', '_contexts', '_contexts_raw')
+    contexts = Lazy(lambda r: _decode_contexts(*r))
+
+class NegotiateProtocolReply(Record):
+    """
+    A class for a decoded Negotiate Protocol reply
+    """
+    __slots__ = ('structure_size', 'security_mode', 'dialect_revision',
+                 'server_guid', 'capabilities',
+                 'max_transact_size', 'max_read_size', 'max_write_size',
+                 'system_time', 'server_start_time', '_security_buffer',
+                 '_security_buffer_raw', '_contexts', '_contexts_raw')
+    security_buffer = Lazy(bytes)
+    contexts = Lazy(lambda r: _decode_contexts(*r))
+
 def _decode_context(context):
     if context['context_type'] == SMB2_PREAUTH_INTEGRITY_CAPABILITIES:
         _count = struct.unpack_from('<H', context['data'], 0)[0]
@@ -90,209 +111,112 @@ def _decode_context(context):
 
 def _decode_contexts(buf, count):
     contexts = {}
+    _pos = 0
     for _ in range(count):
-        _type = struct.unpack_from('<H', buf, 0)[0]
-        _len = struct.unpack_from('<H', buf, 2)[0]
+        _type = struct.unpack_from('<H', buf, _pos)[0]
+        _len = struct.unpack_from('<H', buf, _pos + 2)[0]
 
         context = {}
         context.update({'context_type': _type})
-        context.update({'data': buf[8:_len + 8]})
+        context.update({'data': buf[_pos + 8:_pos + 8 + _len]})
         _decode_context(context)
         contexts.update({_type: context})
 
-        buf = buf[((_len + 7) & 0xfff8) + 8:]
+        _pos = _pos + ((_len + 7) & 0xfff8) + 8
     return contexts
 
-def _encode_context(context):
+def _context_size(context):
     if context['context_type'] == SMB2_PREAUTH_INTEGRITY_CAPABILITIES:
-        buf = bytearray(8 + 4)
-        struct.pack_into('<H', buf, 8, len(context['hash_algorithms']))
-        struct.pack_into('<H', buf, 10, len(context['salt']))
-        for _a in context['hash_algorithms']:
-            _tmp = bytearray(2)
-            struct.pack_into('<H', _tmp, 0, _a)
-            buf = buf + _tmp
+        return 8 + 4 + len(context['hash_algorithms']) * 2 + len(context['salt'])
+    if context['context_type'] == SMB2_ENCRYPTION_CAPABILITIES:
+        return 8 + 2 + len(context['ciphers']) * 2
+    if context['context_type'] == SMB2_COMPRESSION_CAPABILITIES:
+        return 8 + 8 + len(context['compression_algorithms']) * 2
+    return 8 + len(context['data'])
 
-        buf = buf + context['salt']
+def _encode_context_into(buf, offset, context):
+    _end = offset + _context_size(context)
+    struct.pack_into('<H', buf, offset, context['context_type'])
+    struct.pack_into('<H', buf, offset + 2, _end - offset - 8)
 
-        struct.pack_into('<H', buf, 0, context['context_type'])
-        struct.pack_into('<H', buf, 2, len(buf) - 8)
-        return buf
+    if context['context_type'] == SMB2_PREAUTH_INTEGRITY_CAPABILITIES:
+        struct.pack_into('<H', buf, offset + 8, len(context['hash_algorithms']))
+        struct.pack_into('<H', buf, offset + 10, len(context['salt']))
+        _pos = offset + 12
+        for _a in context['hash_algorithms']:
+            struct.pack_into('<H', buf, _pos, _a)
+            _pos = _pos + 2
+        buf[_pos:_end] = context['salt']
+        return _end
 
     if context['context_type'] == SMB2_ENCRYPTION_CAPABILITIES:
-        buf = bytearray(8 + 2)
-        struct.pack_into('<H', buf, 8, len(context['ciphers']))
+        struct.pack_into('<H', buf, offset + 8, len(context['ciphers']))
+        _pos = offset + 10
         for _a in context['ciphers']:
-            _tmp = bytearray(2)
-            struct.pack_into('<H', _tmp, 0, _a)
-            buf = buf + _tmp
-        
-        struct.pack_into('<H', buf, 0, context['context_type'])
-        struct.pack_into('<H', buf, 2, len(buf) - 8)
-        return buf
+            struct.pack_into('<H', buf, _pos, _a)
+            _pos = _pos + 2
+        return _end
 
     if context['context_type'] == SMB2_COMPRESSION_CAPABILITIES:
-        buf = bytearray(8 + 8)
-        struct.pack_into('<H', buf, 8, len(context['compression_algorithms']))
-        struct.pack_into('<I', buf, 12, context['flags'])
-        
+        struct.pack_into('<H', buf, offset + 8, len(context['compression_algorithms']))
+        struct.pack_into('<I', buf, offset + 12, context['flags'])
+        _pos = offset + 16
         for _a in context['compression_algorithms']:
-            _tmp = bytearray(2)
-            struct.pack_into('<H', _tmp, 0, _a)
-            buf = buf + _tmp
-        
-        struct.pack_into('<H', buf, 0, context['context_type'])
-        struct.pack_into('<H', buf, 2, len(buf) - 8)
-        return buf
+            struct.pack_into('<H', buf, _pos, _a)
+            _pos = _pos + 2
+        return _end
 
     # unknown, just send the 'data' blob as is
-    buf = bytearray(8)
-    buf = buf + context['data']
-    struct.pack_into('<H', buf, 0, context['context_type'])
-    struct.pack_into('<H', buf, 2, len(buf) - 8)
-    return buf
-    
-def _encode_contexts(contexts):
-    buf = bytearray(0)
-    for context in contexts.values():
-        # Add padding if we need to
-        _len = len(buf)
-        if _len % 8:
-            _pad = ((_len + 7) & 0xfff8) - _len
-            buf = buf + bytearray(_pad)
+    buf[offset + 8:_end] = context['data']
+    return _end
 
-        buf = buf + _encode_context(context)
-
-    return buf
+def _contexts_size(contexts):
+    _size = 0
+    for context in contexts.values():
+        # Each context starts on an 8 byte boundary
+        _size = ((_size + 7) & 0xfff8) + _context_size(context)
+    return _size
 
-def _decode_request(hdr):
-    """
-    Decode a Negotiate_Protocol request
-    """
-    result = {}
-    result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-    result.update({'security_mode': struct.unpack_from('<I', hdr, 4)[0]})
-    result.update({'capabilities': struct.unpack_from('<I', hdr, 8)[0]})
-    result.update({'client_guid': hdr[12:12 + 16]})
-
-    # Dialects
-    _num = struct.unpack_from('<H', hdr, 2)[0]
-    result.update({'dialects': []})
-    for i in range(_num):
-        result['dialects'].append(struct.unpack_from('<H', hdr, 36 + i *2)[0])
-    if (VERSION_0311 in result['dialects']):
-        # Negotiate Context Offset and Count
-        _offset = struct.unpack_from('<I', hdr, 28)[0] - 64
-        _num = struct.unpack_from('<H', hdr, 32)[0]
-
-        if _num:
-            result.update({'contexts': _decode_contexts(hdr[_offset:], _num)})
-
-    return result
-
-def _encode_request(hdr):
-    """
-    Encode a Negotiate_Protocol request
-    """
-    result = bytearray(36)
-    struct.pack_into('<H', result, 0, 36)
-    struct.pack_into('<I', result, 4, hdr['security_mode'])
-    struct.pack_into('<I', result, 8, hdr['capabilities'])
-    if 'client_guid' in hdr:
-        result[12:12 + 16] = hdr['client_guid']
-
-    # Dialects
-    _num = len(hdr['dialects'])
-    struct.pack_into('<H', result, 2, _num)
-    result.extend(bytearray(_num * 2))
-    for i in range(_num):
-        struct.pack_into('<H', result, 36 + i *2, hdr['dialects'][i])
-    
-    if 'contexts' in hdr:
-        # The contexts are padded to start on 8 byte boundary
-        _len = len(result)
-        if _len % 8:
-            _pad = ((_len + 7) & 0xfff8) - _len
-            result.extend(bytearray(_pad))
-
-        # Negotiate Context Offset and Count
-        struct.pack_into('<I', result, 28, len(result) + 64)
-        struct.pack_into('<H', result, 32, len(hdr['contexts']))
-
-        # Encode the actual contexts
-        result = result + _encode_contexts(hdr['contexts'])
-
-    return result
-
-def _decode_reply(hdr):
-    """
-    Decode a Negotiate_Protocol reply
-    """
-    result = {}
-    result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-    result.update({'security_mode': struct.unpack_from('<H', hdr, 2)[0]})
-    result.update({'dialect_revision': struct.unpack_from('<H', hdr, 4)[0]})
-    result.update({'server_guid': hdr[8:8 + 16]})
-    result.update({'capabilities': struct.unpack_from('<I', hdr, 24)[0]})
-    result.update({'max_transact_size': struct.unpack_from('<I', hdr, 28)[0]})
-    result.update({'max_read_size': struct.unpack_from('<I', hdr, 32)[0]})
-    result.update({'max_write_size': struct.unpack_from('<I', hdr, 36)[0]})
-    result.update({'system_time': WinToTimeval(struct.unpack_from('<Q', hdr, 40)[0])})
-    result.update({'server_start_time': WinToTimeval(struct.unpack_from('<Q', hdr, 48)[0])})
-
-    _sec_offset = struct.unpack_from('<H', hdr, 56)[0]
-    _sec_len = struct.unpack_from('<H', hdr, 58)[0]
-    if _sec_len:
-        result.update({'security_buffer': hdr[_sec_offset - 64:_sec_offset - 64 + _sec_len]})
-        
-    _context_count = 0
-    if result['dialect_revision'] == VERSION_0311:
-        _context_count = struct.unpack_from('<H', hdr, 6)[0]
-        _context_offset = struct.unpack_from('<I', hdr, 60)[0]
-        if _context_count:
-            result.update({'contexts': _decode_contexts(hdr[_context_offset - 64:], _context_count)})
-    
-    return result
-
-def _encode_reply(hdr):
-    """
-    Encode a Negotiate_Protocol reply
-    """
-    result = bytearray(64)
-    struct.pack_into('<H', result, 0, 65)
-    struct.pack_into('<H', result, 2, hdr['security_mode'])
-    struct.pack_into('<H', result, 4, hdr['dialect_revision'])
-    if 'server_guid' in hdr:
-        result[8:8 + 16] = hdr['server_guid']
-    struct.pack_into('<I', result, 24, hdr['capabilities'])
-    struct.pack_into('<I', result, 28, hdr['max_transact_size'])
-    struct.pack_into('<I', result, 32, hdr['max_read_size'])
-    struct.pack_into('<I', result, 36, hdr['max_write_size'])
-    struct.pack_into('<Q', result, 40, TimevalToWin(hdr['system_time']))
-    if 'server_start_time' in hdr:
-        struct.pack_into('<Q', result, 48, TimevalToWin(hdr['server_start_time']))
-    if 'security_buffer' in hdr:
-        # Security buffer is at offset 64(smb2 hdr) + 64(negotiate reply)
-        struct.pack_into('<H', result, 56, 64 + 64)
-        struct.pack_into('<H', result, 58, len(hdr['security_buffer']))
-        result = result + hdr['security_buffer']
-
-    # Encode the actual contexts
-    if hdr['dialect_revision'] == VERSION_0311:
-        if 'contexts' in hdr:
-            # The contexts are padded to start on 8 byte boundary
-            _len = len(result)
-            if _len % 8:
-                _pad = ((_len + 7) & 0xfff8) - _len
-                result.extend(bytearray(_pad))
-
-            # Negotiate Context Offset and Count
-            struct.pack_into('<I', result, 60, len(result) + 64)
-            struct.pack_into('<H', result, 6, len(hdr['contexts']))
-                
-            result = result + _encode_contexts(hdr['contexts'])
-            
-    return result
+def _encode_contexts_into(buf, offset, contexts):
+    _pos = offset
+    for context in contexts.values():
+        _pos = offset + ((_pos - offset + 7) & 0xfff8)
+        _pos = _encode_context_into(buf, _pos, context)
+    return _pos
+
+# Negotiate contexts, each starting on an 8 byte boundary
+_CONTEXTS = Coder(_decode_contexts, _contexts_size, _encode_contexts_into)
+
+_request = Codec(NegotiateProtocolRequest, 36, [
+    Field('structure_size', 0, 'H', value=36),
+    Field('security_mode', 4, 'I'),
+    Field('capabilities', 8, 'I'),
+    Field('client_guid', 12, '16s', optional=True),
+    ], [
+    Buffer('dialects', length=(2, 'H'), count=True, codec=Array('H'),
+           required=True, missing=[]),
+    Buffer('contexts', offset=(28, 'I'), length=(32, 'H'), count=True,
+           codec=_CONTEXTS, align=8,
+           when=('dialects', lambda d: VERSION_0311 in d)),
+    ])
+
+_reply = Codec(NegotiateProtocolReply, 64, [
+    Field('structure_size', 0, 'H', value=65),
+    Field('security_mode', 2, 'H'),
+    Field('dialect_revision', 4, 'H'),
+    Field('server_guid', 8, '16s', optional=True),
+    Field('capabilities', 24, 'I'),
+    Field('max_transact_size', 28, 'I'),
+    Field('max_read_size', 32, 'I'),
+    Field('max_write_size', 36, 'I'),
+    Field('system_time', 40, 'Q', conv=TIME),
+    Field('server_start_time', 48, 'Q', conv=TIME, optional=True),
+    ], [
+    Buffer('security_buffer', offset=(56, 'H'), length=(58, 'H')),
+    Buffer('contexts', offset=(60, 'I'), length=(6, 'H'), count=True,
+           codec=_CONTEXTS, align=8,
+           when=('dialect_revision', lambda d: d == VERSION_0311)),
+    ])
 
 
 class NegotiateProtocol(object):
@@ -312,8 +236,27 @@ class NegotiateProtocol(object):
         Decode a Negotiate_Protocol PDU
         """
         if direction == Direction.REPLY:
-            return _decode_reply(hdr)
-        return _decode_request(hdr)
+            return _reply.decode(hdr)
+        return _request.decode(hdr)
+
+    @staticmethod
+    def encoded_size(direction, hdr):
+        """
+        Number of bytes a Negotiate_Protocol PDU encodes to
+        """
+        if direction == Direction.REPLY:
+            return _reply.encoded_size(hdr)
+        return _request.encoded_size(hdr)
+
+    @staticmethod
+    def encode_into(direction, buf, offset, hdr):
+        """
+        Encode a Negotiate_Protocol PDU into buf at offset and return the offset
+        after it. The bytes of buf it covers must be zero.
+        """
+        if direction == Direction.REPLY:
+            return _reply.encode_into(buf, offset, hdr)
+        return _request.encode_into(buf, offset, hdr)
 
     @staticmethod
     def encode(direction, hdr):
@@ -321,6 +264,5 @@ class NegotiateProtocol(object):
         Encode a Negotiate_Protocol PDU
         """
         if direction == Direction.REPLY:
-            return _encode_reply(hdr)
-        return _encode_request(hdr)
-    
+            return _reply.encode(hdr)
+        return _request.encode(hdr)
@@ -0,0 +1,129 @@
+# coding: utf-8
+
+# Copyright (C) 2020 by Ronnie Sahlberg<ronniesahlberg@gmail.com>
+#
+
+import struct
+from enum import Enum
+
+from smb2.header import Direction
+from smb2.record import Record
+from smb2.schema import Codec, Field
+
+#
+# SMB2 Oplock Break
+#
+# The command carries three different PDUs, told apart by their
+# structure size:
+#   24  Oplock Break notification, acknowledgment and response
+#   44  Lease Break notification, sent by the server
+#   36  Lease Break acknowledgment and response
+#
+
+#
+# LEASE BREAK NOTIFICATION FLAGS
+#
+SMB2_NOTIFY_BREAK_LEASE_FLAG_ACK_REQUIRED = 0x01
+
+
+class OplockBreakPdu(Record):
+    """
+    A class for a decoded Oplock Break notification, acknowledgment
+    or response
+    """
+    __slots__ = ('structure_size', 'oplock_level', 'file_id')
+
+class LeaseBreakNotification(Record):
+    """
+    A class for a decoded Lease Break notification
+    """
+    __slots__ = ('structure_size', 'new_epoch', 'flags', 'lease_key',
+                 'current_lease_state', 'new_lease_state', 'break_reason',
+                 'access_mask_hint', 'share_mask_hint')
+
+class LeaseBreakAck(Record):
+    """
+    A class for a decoded Lease Break acknowledgment or response
+    """
+    __slots__ = ('structure_size', 'flags', 'lease_key', 'lease_state',
+                 'lease_duration')
+
+_oplock = Codec(OplockBreakPdu, 24, [
+    Field('structure_size', 0, 'H', value=24),
+    Field('oplock_level', 2, 'B'),
+    Field('file_id', 8, 'QQ'),
+    ])
+
+_notification = Codec(LeaseBreakNotification, 44, [
+    Field('structure_size', 0, 'H', value=44),
+    Field('new_epoch', 2, 'H'),
+    Field('flags', 4, 'I'),
+    Field('lease_key', 8, '16s'),
+    Field('current_lease_state', 24, 'I'),
+    Field('new_lease_state', 28, 'I'),
+    Field('break_reason', 32, 'I', optional=True),
+    Field('access_mask_hint', 36, 'I', optional=True),
+    Field('share_mask_hint', 40, 'I', optional=True),
+    ])
+
+_ack = Codec(LeaseBreakAck, 36, [
+    Field('structure_size', 0, 'H', value=36),
+    Field('flags', 4, 'I', optional=True),
+    Field('lease_key', 8, '16s'),
+    Field('lease_state', 24, 'I'),
+    Field('lease_duration', 28, 'Q', optional=True),
+    ])
+
+_codecs = {24: _oplock, 44: _notification, 36: _ack}
+
+def _codec(hdr):
+    if 'file_id' in hdr:
+        return _oplock
+    if 'new_lease_state' in hdr:
+        return _notification
+    return _ack
+
+class OplockBreak(object):
+    """
+    A class for Oplock Break
+    """
+
+    def __init__(self, **kwargs):
+        True
+
+    def __del__(self):
+        True
+
+    @staticmethod
+    def decode(direction, hdr):
+        """
+        Decode an Oplock Break PDU
+        """
+        try:
+            _c = _codecs[struct.unpack_from('<H', hdr, 0)[0]]
+        except KeyError:
+            print('Unknown Oplock Break structure size')
+            raise ValueError
+        return _c.decode(hdr)
+
+    @staticmethod
+    def encoded_size(direction, hdr):
+        """
+        Number of bytes an Oplock Break PDU encodes to
+        """
+        return _codec(hdr).encoded_size(hdr)
+
+    @staticmethod
+    def encode_into(direction, buf, offset, hdr):
+        """
+        Encode an Oplock Break PDU into buf at offset and return the offset
+        after it. The bytes of buf it covers must be zero.
+        """
+        return _codec(hdr).encode_into(buf, offset, hdr)
+
+    @staticmethod
+    def encode(direction, hdr):
+        """
+        Encode an Oplock Break PDU
+        """
+        return _codec(hdr).encode(hdr)
@@ -7,8 +7,8 @@ import struct
 from enum import Enum
 
 from smb2.header import Direction
-from smb2.timestamps import WinToTimeval, TimevalToWin
-from smb2.unicode import UCS2toUTF8, UTF8toUCS2
+from smb2.record import Record, Lazy
+from smb2.schema import Codec, Field, Buffer, PATH
 
 #
 # SMB2 Query Directory
@@ -23,6 +23,41 @@ SMB2_INDEX_SPECIFIED     = 0x04
 SMB2_REOPEN              = 0x10
 
 
+class QueryDirectoryRequest(Record):
+    """
+    A class for a decoded Query Directory request
+    """
+    __slots__ = ('structure_size', 'info_class', 'flags', 'file_index',
+                 'file_id', 'output_buffer_length', '_name', '_name_raw')
+    name = Lazy(PATH.decode)
+
+class QueryDirectoryReply(Record):
+    """
+    A class for a decoded Query Directory reply
+    """
+    __slots__ = ('structure_size', 'data')
+
+_request = Codec(QueryDirectoryRequest, 32, [
+    Field('structure_size', 0, 'H', value=33),
+    Field('info_class', 2, 'B'),
+    Field('flags', 3, 'B'),
+    Field('file_index', 4, 'I'),
+    Field('file_id', 8, 'QQ'),
+    Field('output_buffer_length', 28, 'I'),
+    ], [
+    Buffer('name', offset=(24, 'H'), length=(26, 'H'), codec=PATH,
+           missing=b''),
+    ])
+
+# With 'data_length' instead of 'data' the caller encodes the entries
+# itself, straight after the reply
+_reply = Codec(QueryDirectoryReply, 8, [
+    Field('structure_size', 0, 'H', value=9),
+    ], [
+    Buffer('data', offset=(2, 'H'), length=(4, 'I'), always=True,
+           length_name='data_length'),
+    ])
+
 class QueryDirectory(object):
     def __init__(self, **kwargs):
         True
@@ -31,73 +66,38 @@ class QueryDirectory(object):
         True
 
     @staticmethod
-    def _decode_request(hdr):
-        result = {}
-        result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-        result.update({'info_class': struct.unpack_from('<B', hdr, 2)[0]})
-        result.update({'flags': struct.unpack_from('<B', hdr, 3)[0]})
-        result.update({'file_index': struct.unpack_from('<I', hdr, 4)[0]})
-        result.update({'file_id': (struct.unpack_from('<Q', hdr,  8)[0],
-                                   struct.unpack_from('<Q', hdr, 16)[0])})
-        result.update({'output_buffer_length': struct.unpack_from('<I', hdr, 28)[0]})
-
-        _offset = struct.unpack_from('<H', hdr, 24)[0] - 64
-        _len = struct.unpack_from('<H', hdr, 26)[0]
-        if _len:
-            result.update({'name': UCS2toUTF8(hdr[_offset:_offset + _len]).replace(b'\\', b'/')})
-
-        return result
-
-    @staticmethod
-    def _decode_reply(hdr):
-        result = {}
-        result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-
-        _offset = struct.unpack_from('<H', hdr, 2)[0] - 64
-        _len = struct.unpack_from('<I', hdr, 4)[0]
-        if _len:
-            result.update({'data': hdr[_offset:_offset + _len]})
-
-        return result
+    def decode(direction, hdr):
+        """
+        Decode a Query Directory PDU
+        """
+        if direction == Direction.REPLY:
+            return _reply.decode(hdr)
+        return _request.decode(hdr)
 
     @staticmethod
-    def _encode_request(hdr):
-        result = bytearray(32)
-        struct.pack_into('<H', result, 0, 33)
-        struct.pack_into('<B', result, 2, hdr['info_class'])
-        struct.pack_into('<B', result, 3, hdr['flags'])
-        struct.pack_into('<I', result, 4, hdr['file_index'])
-        struct.pack_into('<Q', result,  8, hdr['file_id'][0])
-        struct.pack_into('<Q', result, 16, hdr['file_id'][1])
-        struct.pack_into('<I', result, 28, hdr['output_buffer_length'])
-
-        if 'name' in hdr:
-            _c = UTF8toUCS2(hdr['name']).replace(b'/', b'\\')
-            struct.pack_into('<H', result, 24, 32 + 64)
-            struct.pack_into('<H', result, 26, len(_c))
-            result = result + _c
-
-        return result
-    
-    @staticmethod
-    def _encode_reply(hdr):
-        result = bytearray(8)
-        struct.pack_into('<H', result, 0, 9)
-        struct.pack_into('<H', result, 2, 8 + 64)
-        struct.pack_into('<I', result, 4, len(hdr['data']))
-        result = result + hdr['data']
-            
-        return result
+    def encoded_size(direction, hdr):
+        """
+        Number of bytes a Query Directory PDU encodes to
+        """
+        if direction == Direction.REPLY:
+            return _reply.encoded_size(hdr)
+        return _request.encoded_size(hdr)
 
     @staticmethod
-    def decode(direction, hdr):
+    def encode_into(direction, buf, offset, hdr):
+        """
+        Encode a Query Directory PDU into buf at offset and return the offset
+        after it. The bytes of buf it covers must be zero.
+        """
         if direction == Direction.REPLY:
-            return QueryDirectory._decode_reply(hdr)
-        return QueryDirectory._decode_request(hdr)
+            return _reply.encode_into(buf, offset, hdr)
+        return _request.encode_into(buf, offset, hdr)
 
     @staticmethod
     def encode(direction, hdr):
+        """
+        Encode a Query Directory PDU
+        """
         if direction == Direction.REPLY:
-            return QueryDirectory._encode_reply(hdr)
-        return QueryDirectory._encode_request(hdr)
-    
+            return _reply.encode(hdr)
+        return _request.encode(hdr)
@@ -7,7 +7,8 @@ import struct
 from enum import Enum
 
 from smb2.header import Direction
-from smb2.timestamps import WinToTimeval, TimevalToWin
+from smb2.record import Record
+from smb2.schema import Codec, Field, Buffer
 
 #
 # INFO TYPE
@@ -20,6 +21,38 @@ SMB2_0_INFO_QUOTA      = 0x04
 #
 # SMB2 Query Info
 #
+class QueryInfoRequest(Record):
+    """
+    A class for a decoded Query Info request
+    """
+    __slots__ = ('structure_size', 'info_type', 'file_info_class',
+                 'output_buffer_length', 'additional_information', 'flags',
+                 'file_id', 'buffer')
+
+class QueryInfoReply(Record):
+    """
+    A class for a decoded Query Info reply
+    """
+    __slots__ = ('structure_size', 'buffer')
+
+_request = Codec(QueryInfoRequest, 40, [
+    Field('structure_size', 0, 'H', value=41),
+    Field('info_type', 2, 'B'),
+    Field('file_info_class', 3, 'B'),
+    Field('output_buffer_length', 4, 'I'),
+    Field('additional_information', 16, 'I', optional=True),
+    Field('flags', 20, 'I'),
+    Field('file_id', 24, 'QQ'),
+    ], [
+    Buffer('buffer', offset=(8, 'H'), length=(12, 'I')),
+    ])
+
+_reply = Codec(QueryInfoReply, 8, [
+    Field('structure_size', 0, 'H', value=9),
+    ], [
+    Buffer('buffer', offset=(2, 'H'), length=(4, 'I')),
+    ])
+
 class QueryInfo(object):
     def __init__(self, **kwargs):
         True
@@ -28,75 +61,38 @@ class QueryInfo(object):
         True
 
     @staticmethod
-    def _decode_reply(hdr):
-        result = {}
-        result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-        _offset = struct.unpack_from('<H', hdr, 2)[0] - 64
-        _len = struct.unpack_from('<I', hdr, 4)[0]
-        if _len:
-            result.update({'buffer': hdr[_offset:_offset + _len]})
-
-        return result
-
-    @staticmethod
-    def _encode_reply(hdr):
-        result = bytearray(8)
-        struct.pack_into('<H', result, 0, 9)
-        if 'buffer' in hdr:
-            struct.pack_into('<H', result, 2, 8 + 64)
-            struct.pack_into('<I', result, 4, len(hdr['buffer']))
-            result = result + hdr['buffer']
-        
-        return result
-
-    @staticmethod
-    def _decode_request(hdr):
-        result = {}
-        result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-        result.update({'info_type': struct.unpack_from('<B', hdr, 2)[0]})
-        result.update({'file_info_class': struct.unpack_from('<B', hdr, 3)[0]})
-        result.update({'output_buffer_length': struct.unpack_from('<I', hdr, 4)[0]})
-        result.update({'additional_information': struct.unpack_from('<I', hdr, 16)[0]})
-        result.update({'flags': struct.unpack_from('<I', hdr, 20)[0]})
-        result.update({'file_id': (struct.unpack_from('<Q', hdr, 24)[0],
-                                   struct.unpack_from('<Q', hdr, 32)[0])})
-
-        _offset = struct.unpack_from('<H', hdr, 8)[0] - 64
-        _len = struct.unpack_from('<I', hdr, 12)[0]
-        if _len:
-            result.update({'buffer': hdr[_offset:_offset + _len]})
+    def decode(direction, hdr):
+        """
+        Decode a Query Info PDU
+        """
+        if direction == Direction.REPLY:
+            return _reply.decode(hdr)
+        return _request.decode(hdr)
 
-        return result
-        
     @staticmethod
-    def _encode_request(hdr):
-        result = bytearray(40)
-        struct.pack_into('<H', result, 0, 41)
-        struct.pack_into('<B', result, 2, hdr['info_type'])
-        struct.pack_into('<B', result, 3, hdr['file_info_class'])
-        struct.pack_into('<I', result, 4, hdr['output_buffer_length'])
-        if 'additional_information' in hdr:
-            struct.pack_into('<I', result, 16, hdr['additional_information'])
-        struct.pack_into('<I', result, 20, hdr['flags'])
-        struct.pack_into('<Q', result, 24, hdr['file_id'][0])
-        struct.pack_into('<Q', result, 32, hdr['file_id'][1])
-
-        if 'buffer' in hdr:
-            struct.pack_into('<H', result, 8, 40 + 64)
-            struct.pack_into('<I', result, 12, len(buffer))
-            result = result + buffer
-        
-        return result
+    def encoded_size(direction, hdr):
+        """
+        Number of bytes a Query Info PDU encodes to
+        """
+        if direction == Direction.REPLY:
+            return _reply.encoded_size(hdr)
+        return _request.encoded_size(hdr)
 
     @staticmethod
-    def decode(direction, hdr):
+    def encode_into(direction, buf, offset, hdr):
+        """
+        Encode a Query Info PDU into buf at offset and return the offset
+        after it. The bytes of buf it covers must be zero.
+        """
         if direction == Direction.REPLY:
-            return QueryInfo._decode_reply(hdr)
-        return QueryInfo._decode_request(hdr)
+            return _reply.encode_into(buf, offset, hdr)
+        return _request.encode_into(buf, offset, hdr)
 
     @staticmethod
     def encode(direction, hdr):
+        """
+        Encode a Query Info PDU
+        """
         if direction == Direction.REPLY:
-            return QueryInfo._encode_reply(hdr)
-        return QueryInfo._encode_request(hdr)
-    
+            return _reply.encode(hdr)
+        return _request.encode(hdr)
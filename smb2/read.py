@@ -7,6 +7,8 @@ import struct
 from enum import Enum
 
 from smb2.header import Direction
+from smb2.record import Record
+from smb2.schema import Codec, Field, Buffer
 
 #
 # SMB2 Read
@@ -19,82 +21,41 @@ SMB2_READFLAG_READ_UNBUFFERED    = 0x01
 SMB2_READFLAG_REQUEST_COMPRESSED = 0x02
 
 
-def _decode_request(hdr):
+class ReadRequest(Record):
     """
-    Decode a Read request
+    A class for a decoded Read request
     """
-    result = {}
-    result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-    result.update({'flags': struct.unpack_from('<B', hdr, 3)[0]})
-    result.update({'length': struct.unpack_from('<I', hdr, 4)[0]})
-    result.update({'offset': struct.unpack_from('<Q', hdr, 8)[0]})
-    result.update({'file_id': (struct.unpack_from('<Q', hdr, 16)[0],
-                               struct.unpack_from('<Q', hdr, 24)[0])})
-    result.update({'minimum_count': struct.unpack_from('<I', hdr, 32)[0]})
-    result.update({'channel': struct.unpack_from('<I', hdr, 36)[0]})
-    result.update({'remaining_bytes': struct.unpack_from('<I', hdr, 40)[0]})
-    
-    _offset = struct.unpack_from('<H', hdr, 44)[0] - 64
-    _len = struct.unpack_from('<H', hdr, 46)[0]
-    if _len:
-        result.update({'read_channel': hdr[_offset:_offset + _len]})
-
-    return result
-
-def _encode_request(hdr):
-    """
-    Encode a Read request
-    """
-    result = bytearray(48)
-    struct.pack_into('<H', result, 0, 49)
-    struct.pack_into('<B', result, 3, hdr['flags'])
-    struct.pack_into('<I', result, 4, hdr['length'])
-    struct.pack_into('<Q', result, 8, hdr['offset'])
-    struct.pack_into('<Q', result, 16, hdr['file_id'][0])
-    struct.pack_into('<Q', result, 24, hdr['file_id'][1])
-    struct.pack_into('<I', result, 32, hdr['minimum_count'])
-    struct.pack_into('<I', result, 36, hdr['channel'])
-    struct.pack_into('<I', result, 40, hdr['remaining_bytes'])
-
-    if 'read_channel' in hdr:
-        struct.pack_into('<H', result, 44, len(result) + 64)
-        struct.pack_into('<H', result, 46, len(hdr['read_channel']))
-        result = result + hdr['read_channel']
-        
-    return result
-
-def _encode_reply(hdr):
-    """
-    Encode a Read reply
-    """
-    result = bytearray(16)
-    struct.pack_into('<H', result, 0, 17)
-    struct.pack_into('<I', result, 8, hdr['data_remaining'])
-    if 'flags' in hdr:
-        struct.pack_into('<I', result, 12, hdr['flags'])
-    if 'data' in hdr:
-        struct.pack_into('<B', result, 2, 16 + 64)
-        struct.pack_into('<I', result, 4, len(hdr['data']))
-        result = result + hdr['data']
-        
-    return result
-
-def _decode_reply(hdr):
+    __slots__ = ('structure_size', 'flags', 'length', 'offset', 'file_id',
+                 'minimum_count', 'channel', 'remaining_bytes', 'read_channel')
+
+class ReadReply(Record):
     """
-    Decode a Read reply
+    A class for a decoded Read reply
     """
-    result = {}
-    result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-    result.update({'data_remaining': struct.unpack_from('<I', hdr, 8)[0]})
-    result.update({'flags': struct.unpack_from('<I', hdr, 12)[0]})
-
-    _offset = struct.unpack_from('<B', hdr, 2)[0] - 64
-    _len = struct.unpack_from('<I', hdr, 4)[0]
-    if _len:
-        result.update({'data': hdr[_offset:_offset + _len]})
-
-    return result
-
+    __slots__ = ('structure_size', 'data_remaining', 'flags', 'data')
+
+_request = Codec(ReadRequest, 48, [
+    Field('structure_size', 0, 'H', value=49),
+    Field('flags', 3, 'B'),
+    Field('length', 4, 'I'),
+    Field('offset', 8, 'Q'),
+    Field('file_id', 16, 'QQ'),
+    Field('minimum_count', 32, 'I'),
+    Field('channel', 36, 'I'),
+    Field('remaining_bytes', 40, 'I'),
+    ], [
+    Buffer('read_channel', offset=(44, 'H'), length=(46, 'H')),
+    ])
+
+# With 'data_length' instead of 'data' the caller sends the data itself,
+# straight after the reply
+_reply = Codec(ReadReply, 16, [
+    Field('structure_size', 0, 'H', value=17),
+    Field('data_remaining', 8, 'I'),
+    Field('flags', 12, 'I', optional=True),
+    ], [
+    Buffer('data', offset=(2, 'B'), length=(4, 'I'), length_name='data_length'),
+    ])
 
 class Read(object):
     """
@@ -113,8 +74,27 @@ class Read(object):
         Decode a Read PDU
         """
         if direction == Direction.REPLY:
-            return _decode_reply(hdr)
-        return _decode_request(hdr)
+            return _reply.decode(hdr)
+        return _request.decode(hdr)
+
+    @staticmethod
+    def encoded_size(direction, hdr):
+        """
+        Number of bytes a Read PDU encodes to
+        """
+        if direction == Direction.REPLY:
+            return _reply.encoded_size(hdr)
+        return _request.encoded_size(hdr)
+
+    @staticmethod
+    def encode_into(direction, buf, offset, hdr):
+        """
+        Encode a Read PDU into buf at offset and return the offset
+        after it. The bytes of buf it covers must be zero.
+        """
+        if direction == Direction.REPLY:
+            return _reply.encode_into(buf, offset, hdr)
+        return _request.encode_into(buf, offset, hdr)
 
     @staticmethod
     def encode(direction, hdr):
@@ -122,6 +102,5 @@ class Read(object):
         Encode a Read PDU
         """
         if direction == Direction.REPLY:
-            return _encode_reply(hdr)
-        return _encode_request(hdr)
-    
+            return _reply.encode(hdr)
+        return _request.encode(hdr)
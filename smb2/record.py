@@ -0,0 +1,142 @@
+# coding: utf-8
+
+# Copyright (C) 2020 by Ronnie Sahlberg<ronniesahlberg@gmail.com>
+#
+
+#
+# Base class for decoded PDUs
+#
+
+class Lazy(object):
+    """
+    A class for a variable length field of a Record, such as a path, that
+    is only decoded when it is first read.
+
+    The decoder stores the raw bytes, a view into the received frame, in
+    the '_<name>_raw' slot and the field is decoded from them, and kept in
+    the '_<name>' slot, on first access. Both slots go in __slots__.
+    """
+
+    def __init__(self, decode, **kwargs):
+        self.decode = decode
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        self._value = owner.__dict__['_' + name]
+        self._raw = owner.__dict__['_' + name + '_raw']
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        try:
+            return self._value.__get__(obj, owner)
+        except AttributeError:
+            True
+        # AttributeError here means the field is not set
+        _v = self.decode(self._raw.__get__(obj, owner))
+        self._value.__set__(obj, _v)
+        self._raw.__delete__(obj)
+        return _v
+
+    def __set__(self, obj, value):
+        self._value.__set__(obj, value)
+        try:
+            self._raw.__delete__(obj)
+        except AttributeError:
+            True
+
+    def __delete__(self, obj):
+        _found = False
+        for m in (self._value, self._raw):
+            try:
+                m.__delete__(obj)
+                _found = True
+            except AttributeError:
+                True
+        if not _found:
+            raise AttributeError(self.name)
+
+
+class Record(object):
+    """
+    A class for a decoded PDU.
+
+    Subclasses list their fields in __slots__ and the decoders set them
+    as plain attributes, pdu.length. A record still behaves like the dict
+    the decoders used to return: pdu['length'], 'data' in pdu, pdu.get(),
+    keys(), items(), update() and comparing against a dict all work.
+    A field that has not been set is not in the record.
+    The encoders accept either a record or a dict.
+
+    Slots starting with '_' are not fields, except those backing a Lazy
+    field. _fields lists the fields in order.
+    """
+    __slots__ = ()
+    _fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        _fields = []
+        for n in cls.__slots__:
+            if not n.startswith('_'):
+                _fields.append(n)
+            elif isinstance(cls.__dict__.get(n[1:]), Lazy):
+                _fields.append(n[1:])
+        cls._fields = tuple(_fields)
+
+    def __init__(self, *args, **kwargs):
+        if args or kwargs:
+            self.update(*args, **kwargs)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if not key in self._fields:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        try:
+            delattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self._fields and hasattr(self, key)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if not hasattr(other, 'keys'):
+            return NotImplemented
+        return dict(self.items()) == dict(other.items())
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, dict(self.items()))
+
+    def get(self, key, default=None):
+        if not key in self._fields:
+            return default
+        return getattr(self, key, default)
+
+    def keys(self):
+        return [k for k in self._fields if hasattr(self, k)]
+
+    def values(self):
+        return [getattr(self, k) for k in self.keys()]
+
+    def items(self):
+        return [(k, getattr(self, k)) for k in self.keys()]
+
+    def update(self, *args, **kwargs):
+        for other in args + (kwargs,):
+            for k in other.keys():
+                self[k] = other[k]
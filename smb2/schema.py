@@ -0,0 +1,420 @@
+# coding: utf-8
+
+# Copyright (C) 2020 by Ronnie Sahlberg<ronniesahlberg@gmail.com>
+#
+
+import struct
+
+from smb2.record import Lazy
+from smb2.timestamps import WinToTimeval, TimevalToWin
+from smb2.unicode import UCS2toPath, PathtoUCS2, UTF8toUCS2Len
+
+#
+# Declarative PDU layouts
+#
+# A PDU body is a fixed part, described by a list of Fields, followed by
+# the variable length Buffers the fixed part points to. Codec() turns a
+# layout into decode(), encoded_size(), encode_into() and encode()
+# functions. They are generated as python source when the module that
+# declares the layout is imported, with all of the fixed part, including
+# the offsets and lengths of the buffers, packed and unpacked by a
+# single struct.Struct.
+#
+
+# Conversions between the wire value of a Field and its value in a record
+TIME = (WinToTimeval, TimevalToWin)
+
+
+class Field(object):
+    """
+    A class for a field in the fixed part of a PDU
+
+    code is a struct format code. A code with more than one item, like
+    the 'QQ' of a file_id, is a tuple. value is written instead of the
+    field on encode, as for structure_size. An optional field is encoded
+    as 0 when it is missing. A field with when=(name, predicate) is only
+    decoded, and encoded, if predicate(the named field) is true.
+    """
+
+    def __init__(self, name, offset, code, value=None, conv=None,
+                 optional=False, when=None, **kwargs):
+        self.name = name
+        self.offset = offset
+        self.code = code
+        self.value = value
+        self.conv = conv
+        self.optional = optional
+        self.when = when
+
+
+class Buffer(object):
+    """
+    A class for a variable length field of a PDU
+
+    Buffers follow the fixed part, in the order they are listed.
+    offset and length are (offset, code) of the fields that hold them in
+    the fixed part. The offset is relative to the SMB2 header. A buffer
+    without an offset field follows the one before it, and one without
+    a length field runs to the end of the PDU.
+
+    Without a codec the buffer is bytes and decodes to a view into the
+    PDU. If the record has a Lazy field of the same name the view is
+    only decoded when it is read. With count=True the length field
+    holds the number of elements and the codec decodes (view, count),
+    the view running to the end of the PDU.
+
+    align is the alignment of the start, pad the number of zero bytes
+    after it and min_size the least number of bytes it takes up.
+    A buffer that is not required is encoded only if it is in the PDU,
+    but always=True writes its offset anyway. length_name is a field
+    holding the length of data the caller sends itself, after the PDU,
+    and is set to the length on decode if the record has it.
+    missing is the value, a literal such as b'' or {}, decoded for an
+    empty buffer. By default the field is not set.
+    """
+
+    def __init__(self, name, offset=None, length=None, codec=None,
+                 count=False, align=1, pad=0, min_size=0, required=False,
+                 always=False, length_name=None, missing=None, when=None,
+                 **kwargs):
+        self.name = name
+        self.offset = offset
+        self.length = length
+        self.codec = codec
+        self.count = count
+        self.align = align
+        self.pad = pad
+        self.min_size = min_size
+        self.required = required
+        self.always = always
+        self.length_name = length_name
+        self.missing = missing
+        self.when = when
+
+
+class Coder(object):
+    """
+    A class for how to decode and encode the value of a Buffer
+
+    decode(view) returns the value, or decode(view, count) for a counted
+    buffer. size(value) is the number of bytes it encodes to and
+    encode_into(buf, offset, value) writes it and returns the offset
+    after it.
+    """
+
+    def __init__(self, decode, size, encode_into, **kwargs):
+        self.decode = decode
+        self.size = size
+        self.encode_into = encode_into
+
+
+def _encode_path_into(buf, offset, path):
+    _u = PathtoUCS2(path)
+    buf[offset:offset + len(_u)] = _u
+    return offset + len(_u)
+
+# A path, UCS2 with '\' on the wire and UTF8 with '/' in the record
+PATH = Coder(UCS2toPath, UTF8toUCS2Len, _encode_path_into)
+
+def Array(code):
+    """
+    A Coder for a counted buffer of code sized integers
+    """
+    _size = struct.calcsize('<' + code)
+
+    def decode(buf, count):
+        return list(struct.unpack_from('<%d%s' % (count, code), buf, 0))
+
+    def size(value):
+        return len(value) * _size
+
+    def encode_into(buf, offset, value):
+        struct.pack_into('<%d%s' % (len(value), code), buf, offset, *value)
+        return offset + len(value) * _size
+
+    return Coder(decode, size, encode_into)
+
+
+class Codec(object):
+    """
+    A class for the decoder and encoder of a PDU, generated from its layout
+
+    record is the class decode() returns and size the size of the fixed
+    part.
+    """
+
+    def __init__(self, record, size, fields, buffers=(), **kwargs):
+        self.record = record
+        self.size = size
+        self.fields = fields
+        self.buffers = buffers
+
+        # The fixed part: (offset, code, local variable) in offset order
+        self._items = []
+        self._ns = {'_Record': record}
+        _names = {}
+        _idx = 0
+        for f in fields:
+            _n = len(struct.unpack('<' + f.code, bytes(struct.calcsize('<' + f.code))))
+            _names[f.name] = ['_v%d' % (_idx + i) for i in range(_n)]
+            self._items.append((f.offset, f.code, _names[f.name]))
+            _idx = _idx + _n
+        for i, b in enumerate(buffers):
+            if b.offset:
+                self._items.append((b.offset[0], b.offset[1], ['_o%d' % i]))
+            if b.length:
+                self._items.append((b.length[0], b.length[1], ['_l%d' % i]))
+        self._items.sort(key=lambda x: x[0])
+        self._field_names = _names
+
+        _fmt = '<'
+        _pos = 0
+        for _offset, _code, _ in self._items:
+            if _offset < _pos:
+                print('Overlapping fields at offset', _offset, 'in', record.__name__)
+                raise ValueError
+            if _offset > _pos:
+                _fmt = _fmt + '%dx' % (_offset - _pos)
+            _fmt = _fmt + _code
+            _pos = _offset + struct.calcsize('<' + _code)
+        if size > _pos:
+            _fmt = _fmt + '%dx' % (size - _pos)
+        self._ns['_S'] = struct.Struct(_fmt)
+        if self._ns['_S'].size != size:
+            print('Fields of', record.__name__, 'do not add up to', size)
+            raise ValueError
+
+        _size = self._gen_size()
+        _into = self._gen_encode_into()
+        self._src = '\n'.join([
+            self._gen_decode(),
+            'def encoded_size(hdr):\n' + '\n'.join(_size) + '\n    return _n\n',
+            'def encode_into(buf, offset, hdr):\n' + '\n'.join(_into) + '\n    return _pos\n',
+            # encode() is the two of them inlined, to save the calls
+            'def encode(hdr):\n' + '\n'.join(_size) +
+            '\n    buf = bytearray(_n)\n    offset = 0\n' + '\n'.join(_into) +
+            '\n    return buf\n'])
+        exec(compile(self._src, '<codec %s>' % record.__name__, 'exec'),
+             self._ns)
+        self.decode = self._ns['decode']
+        self.encoded_size = self._ns['encoded_size']
+        self.encode_into = self._ns['encode_into']
+        self.encode = self._ns['encode']
+
+    def _ref(self, prefix, obj):
+        """
+        Make obj available to the generated code and return its name
+        """
+        for _name, _obj in self._ns.items():
+            if _obj is obj and _name.startswith(prefix):
+                return _name
+        _name = '%s%d' % (prefix, len(self._ns))
+        self._ns[_name] = obj
+        return _name
+
+    def _locals(self):
+        return ', '.join([v for _, _, n in self._items for v in n]) + ','
+
+    def _gen_decode(self):
+        _l = ['def decode(buf):',
+              '    (%s) = _S.unpack_from(buf, 0)' % self._locals(),
+              '    result = _Record()']
+        _whens = {}
+        for f in self.fields:
+            if f.when and not id(f.when) in _whens:
+                _whens[id(f.when)] = '_w%d' % len(_whens)
+                _l.append('    %s = %s(%s)' % (_whens[id(f.when)],
+                                               self._ref('_when', f.when[1]),
+                                               self._value(f.when[0])))
+        for f in self.fields:
+            _v = self._field_names[f.name]
+            _e = _v[0] if len(_v) == 1 else '(%s)' % ', '.join(_v)
+            if f.conv:
+                _e = '%s(%s)' % (self._ref('_dec', f.conv[0]), _e)
+            if f.when:
+                _l.append('    if %s:' % _whens[id(f.when)])
+                _l.append('        result.%s = %s' % (f.name, _e))
+            else:
+                _l.append('    result.%s = %s' % (f.name, _e))
+
+        for i, b in enumerate(self.buffers):
+            _lazy = isinstance(self.record.__dict__.get(b.name), Lazy)
+            # Does the next buffer start where this one ends?
+            _track = (i + 1 < len(self.buffers) and
+                      not self.buffers[i + 1].offset)
+            if _track and b.count and (_lazy or not b.codec):
+                print('Can not find the end of', b.name, 'in', self.record.__name__)
+                raise ValueError
+            if i == 0 and [x for x in self.buffers if not x.offset]:
+                _l.append('    _p = %d' % self.size)
+
+            _ind = '    '
+            if b.when:
+                _l.append('    if %s(%s):' % (self._ref('_when', b.when[1]),
+                                              self._value(b.when[0])))
+                _ind = '        '
+            if b.offset:
+                _start = '_o%d - 64' % i
+            elif b.align > 1:
+                _l.append(_ind + '_p = (_p + %d) & ~%d' % (b.align - 1, b.align - 1))
+                _start = '_p'
+            else:
+                _start = '_p'
+
+            if not b.length:
+                _raw = 'buf[%s:]' % _start
+            elif b.count:
+                _raw = '(buf[%s:], _l%d)' % (_start, i)
+            else:
+                _raw = 'buf[%s:%s + _l%d]' % (_start, _start, i)
+
+            if _lazy:
+                _set = 'result._%s_raw = %s' % (b.name, _raw)
+            elif b.codec and b.count:
+                _set = 'result.%s = %s.decode(*%s)' % (b.name, self._ref('_codec', b.codec), _raw)
+            elif b.codec:
+                _set = 'result.%s = %s.decode(%s)' % (b.name, self._ref('_codec', b.codec), _raw)
+            else:
+                _set = 'result.%s = %s' % (b.name, _raw)
+
+            if b.length_name and b.length_name in self.record._fields:
+                _l.append(_ind + 'result.%s = _l%d' % (b.length_name, i))
+            if not b.length:
+                _l.append(_ind + _set)
+                continue
+            _l.append(_ind + 'if _l%d:' % i)
+            _l.append(_ind + '    ' + _set)
+            if _track and b.count:
+                _l.append(_ind + '    _p = %s + %s.size(result.%s)' % (_start, self._ref('_codec', b.codec), b.name))
+            elif _track:
+                _l.append(_ind + '    _p = %s + _l%d' % (_start, i))
+            if b.missing is not None:
+                _l.append(_ind + 'else:')
+                # A literal, so that each record gets its own {}
+                _l.append(_ind + '    result.%s%s = %r' % ('_' if _lazy else '', b.name,
+                                                   b.missing))
+        _l.append('    return result')
+        return '\n'.join(_l) + '\n'
+
+    def _value(self, name):
+        """
+        How decode() gets at the value of a field
+        """
+        if name in self._field_names:
+            _v = self._field_names[name]
+            return _v[0] if len(_v) == 1 else '(%s)' % ', '.join(_v)
+        return 'result.%s' % name
+
+    def _present(self, b):
+        """
+        The condition for a Buffer to be encoded
+        """
+        _c = []
+        if not b.required:
+            _c.append("'%s' in hdr" % b.name)
+        if b.when:
+            _c.append("%s(hdr['%s'])" % (self._ref('_when', b.when[1]), b.when[0]))
+        return ' and '.join(_c)
+
+    def _buffer_size(self, b, v):
+        if b.codec:
+            return '%s.size(%s)' % (self._ref('_codec', b.codec), v)
+        return 'len(%s)' % v
+
+    def _gen_size(self):
+        _l = ['    _n = %d' % self.size]
+        for b in self.buffers:
+            _ind = '    '
+            _c = self._present(b)
+            if _c:
+                _l.append('    if %s:' % _c)
+                _ind = '        '
+            if b.align > 1:
+                _l.append(_ind + '_n = (_n + %d) & ~%d' % (b.align - 1, b.align - 1))
+            _e = self._buffer_size(b, "hdr['%s']" % b.name)
+            if b.pad:
+                _e = '%s + %d' % (_e, b.pad)
+            if b.min_size:
+                _e = 'max(%s, %d)' % (_e, b.min_size)
+            _l.append(_ind + '_n = _n + %s' % _e)
+        return _l
+
+    def _gen_encode_into(self):
+        _l = ['    _pos = offset + %d' % self.size]
+        _values = {}
+        _whens = {}
+        for f in self.fields:
+            if f.when and not id(f.when) in _whens:
+                _whens[id(f.when)] = '_w%d' % len(_whens)
+                _l.append("    %s = %s(hdr['%s'])" % (_whens[id(f.when)],
+                                                     self._ref('_when', f.when[1]),
+                                                     f.when[0]))
+        for f in self.fields:
+            _v = self._field_names[f.name]
+            if f.value is not None:
+                _values[_v[0]] = '%d' % f.value
+                continue
+
+            _default = "b''" if f.code.endswith('s') else '0'
+            if f.optional and not f.when and not f.conv and len(_v) == 1:
+                _values[_v[0]] = "hdr.get('%s', %s)" % (f.name, _default)
+                continue
+
+            # Look the field up once and convert each of its items
+            _x = '_%s' % f.name
+            _c = []
+            if f.when:
+                _c.append(_whens[id(f.when)])
+            if f.optional:
+                _c.append("'%s' in hdr" % f.name)
+            if _c:
+                _l.append("    %s = hdr['%s'] if %s else None" % (_x, f.name, ' and '.join(_c)))
+            else:
+                _l.append("    %s = hdr['%s']" % (_x, f.name))
+            for j, n in enumerate(_v):
+                _e = _x if len(_v) == 1 else '%s[%d]' % (_x, j)
+                if f.conv:
+                    _e = '%s(%s)' % (self._ref('_enc', f.conv[1]), _e)
+                if _c:
+                    _e = '(%s if %s is not None else %s)' % (_e, _x, _default)
+                _values[n] = _e
+
+        for i, b in enumerate(self.buffers):
+            _o = '_o%d' % i
+            _n = '_l%d' % i
+            _values[_o] = _o
+            _values[_n] = _n
+            _l.append('    %s = 0' % _o)
+            _l.append('    %s = 0' % _n)
+            _ind = '    '
+            _c = self._present(b)
+            if _c:
+                _l.append('    if %s:' % _c)
+                _ind = '        '
+            _l.append(_ind + "_v = hdr['%s']" % b.name)
+            if b.align > 1:
+                _l.append(_ind + '_pos = offset + ((_pos - offset + %d) & ~%d)' % (b.align - 1, b.align - 1))
+            _l.append(_ind + '%s = _pos - offset + 64' % _o)
+            if b.codec:
+                _l.append(_ind + '_end = %s.encode_into(buf, _pos, _v)' % self._ref('_codec', b.codec))
+            else:
+                _l.append(_ind + '_end = _pos + len(_v)')
+                _l.append(_ind + 'buf[_pos:_end] = _v')
+            if b.count:
+                _l.append(_ind + '%s = len(_v)' % _n)
+            else:
+                _l.append(_ind + '%s = _end - _pos' % _n)
+            _end = '_end + %d' % b.pad if b.pad else '_end'
+            if b.min_size:
+                _end = 'max(%s, _pos + %d)' % (_end, b.min_size)
+            _l.append(_ind + '_pos = %s' % _end)
+            if b.length_name:
+                _l.append("    elif '%s' in hdr:" % b.length_name)
+                _l.append('        %s = _pos - offset + 64' % _o)
+                _l.append("        %s = hdr['%s']" % (_n, b.length_name))
+            if b.always and _c:
+                _l.append('    else:')
+                _l.append('        %s = _pos - offset + 64' % _o)
+        _args = ', '.join([_values[v] for _, _, n in self._items for v in n])
+        _l.append('    _S.pack_into(buf, offset, %s)' % _args)
+        return _l
@@ -7,6 +7,8 @@ import struct
 from enum import Enum
 
 from smb2.header import Direction
+from smb2.record import Record, Lazy
+from smb2.schema import Codec, Field, Buffer
 
 #
 # SMB2 Session Setup
@@ -36,72 +38,39 @@ SMB2_SESSION_FLAG_IS_NULL      = 0x0002
 SMB2_SESSION_FLAG_ENCRYPT_DATA = 0x0004
 
 
-def _decode_request(hdr):
+class SessionSetupRequest(Record):
     """
-    Decode a Session Setup request
+    A class for a decoded Session Setup request
     """
-    result = {}
-    result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-    result.update({'flags': struct.unpack_from('<B', hdr, 2)[0]})
-    result.update({'security_mode': struct.unpack_from('<B', hdr, 3)[0]})
-    result.update({'capabilities': struct.unpack_from('<I', hdr, 4)[0]})
-    result.update({'previous_session_id': hdr[16:16 + 8]})
+    __slots__ = ('structure_size', 'flags', 'security_mode', 'capabilities',
+                 'previous_session_id', '_security_buffer',
+                 '_security_buffer_raw')
+    security_buffer = Lazy(bytes)
 
-    _offset = struct.unpack_from('<H', hdr, 12)[0] - 64
-    _len = struct.unpack_from('<H', hdr, 14)[0]
-    if _len:
-        result.update({'security_buffer': hdr[_offset:_offset + _len]})
-
-    return result
-
-def _encode_request(hdr):
+class SessionSetupReply(Record):
     """
-    Encode a Session Setup request
+    A class for a decoded Session Setup reply
     """
-    result = bytearray(24)
-    struct.pack_into('<H', result, 0, 25)
-    struct.pack_into('<B', result, 2, hdr['flags'])
-    struct.pack_into('<B', result, 3, hdr['security_mode'])    
-    struct.pack_into('<I', result, 4, hdr['capabilities'])
-    if 'previous_session_id' in hdr:
-        result[16:16 + 8] = hdr['previous_session_id']
-
-    if 'security_buffer' in hdr:
-        struct.pack_into('<H', result, 12, 24 + 64)
-        struct.pack_into('<H', result, 14, len(hdr['security_buffer']))
-
-        result = result + hdr['security_buffer']
-
-    return result
-
-def _decode_reply(hdr):
-    """
-    Decode a Session Setup reply
-    """
-    result = {}
-    result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-    result.update({'session_flags': struct.unpack_from('<H', hdr, 2)[0]})
-    _offset = struct.unpack_from('<H', hdr, 4)[0] - 64
-    _len = struct.unpack_from('<H', hdr, 6)[0]
-    if _len:
-        result.update({'security_buffer': hdr[_offset:_offset + _len]})
-    
-    return result
-
-def _encode_reply(hdr):
-    """
-    Encode a Session Setup reply
-    """
-    result = bytearray(8)
-    struct.pack_into('<H', result, 0, 9)
-    struct.pack_into('<H', result, 2, hdr['session_flags'])
-    struct.pack_into('<H', result, 4, 8 + 64)
-    if 'security_buffer' in hdr:
-        struct.pack_into('<H', result, 6, len(hdr['security_buffer']))
-        result = result + hdr['security_buffer']
-
-    return result
-
+    __slots__ = ('structure_size', 'session_flags', '_security_buffer',
+                 '_security_buffer_raw')
+    security_buffer = Lazy(bytes)
+
+_request = Codec(SessionSetupRequest, 24, [
+    Field('structure_size', 0, 'H', value=25),
+    Field('flags', 2, 'B'),
+    Field('security_mode', 3, 'B'),
+    Field('capabilities', 4, 'I'),
+    Field('previous_session_id', 16, '8s', optional=True),
+    ], [
+    Buffer('security_buffer', offset=(12, 'H'), length=(14, 'H')),
+    ])
+
+_reply = Codec(SessionSetupReply, 8, [
+    Field('structure_size', 0, 'H', value=9),
+    Field('session_flags', 2, 'H'),
+    ], [
+    Buffer('security_buffer', offset=(4, 'H'), length=(6, 'H'), always=True),
+    ])
 
 class SessionSetup(object):
     """
@@ -120,8 +89,27 @@ class SessionSetup(object):
         Decode a Session Setup PDU
         """
         if direction == Direction.REPLY:
-            return _decode_reply(hdr)
-        return _decode_request(hdr)
+            return _reply.decode(hdr)
+        return _request.decode(hdr)
+
+    @staticmethod
+    def encoded_size(direction, hdr):
+        """
+        Number of bytes a Session Setup PDU encodes to
+        """
+        if direction == Direction.REPLY:
+            return _reply.encoded_size(hdr)
+        return _request.encoded_size(hdr)
+
+    @staticmethod
+    def encode_into(direction, buf, offset, hdr):
+        """
+        Encode a Session Setup PDU into buf at offset and return the offset
+        after it. The bytes of buf it covers must be zero.
+        """
+        if direction == Direction.REPLY:
+            return _reply.encode_into(buf, offset, hdr)
+        return _request.encode_into(buf, offset, hdr)
 
     @staticmethod
     def encode(direction, hdr):
@@ -129,6 +117,5 @@ class SessionSetup(object):
         Encode a Session Setup PDU
         """
         if direction == Direction.REPLY:
-            return _encode_reply(hdr)
-        return _encode_request(hdr)
-    
+            return _reply.encode(hdr)
+        return _request.encode(hdr)
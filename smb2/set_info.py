@@ -7,7 +7,8 @@ import struct
 from enum import Enum
 
 from smb2.header import Direction
-from smb2.timestamps import WinToTimeval, TimevalToWin
+from smb2.record import Record
+from smb2.schema import Codec, Field, Buffer
 
 #
 # INFO TYPE
@@ -20,6 +21,34 @@ SMB2_0_INFO_QUOTA      = 0x04
 #
 # SMB2 Set Info
 #
+class SetInfoRequest(Record):
+    """
+    A class for a decoded Set Info request
+    """
+    __slots__ = ('structure_size', 'info_type', 'file_info_class',
+                 'additional_information', 'file_id', 'buffer')
+
+class SetInfoReply(Record):
+    """
+    A class for a decoded Set Info reply
+    """
+    __slots__ = ('structure_size',)
+
+_request = Codec(SetInfoRequest, 32, [
+    Field('structure_size', 0, 'H', value=33),
+    Field('info_type', 2, 'B'),
+    Field('file_info_class', 3, 'B'),
+    Field('additional_information', 12, 'I', optional=True),
+    Field('file_id', 16, 'QQ'),
+    ], [
+    Buffer('buffer', offset=(8, 'H'), length=(4, 'I'), required=True,
+           missing=b''),
+    ])
+
+_reply = Codec(SetInfoReply, 2, [
+    Field('structure_size', 0, 'H', value=2),
+    ])
+
 class SetInfo(object):
     def __init__(self, **kwargs):
         True
@@ -28,60 +57,38 @@ class SetInfo(object):
         True
 
     @staticmethod
-    def _decode_reply(hdr):
-        result = {}
-        result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-
-        return result
-
-    @staticmethod
-    def _encode_reply(hdr):
-        result = bytearray(2)
-        struct.pack_into('<H', result, 0, 2)
-
-        return result
-
-    @staticmethod
-    def _decode_request(hdr):
-        result = {}
-        result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-        result.update({'info_type': struct.unpack_from('<B', hdr, 2)[0]})
-        result.update({'file_info_class': struct.unpack_from('<B', hdr, 3)[0]})
-        result.update({'additional_information': struct.unpack_from('<I', hdr, 12)[0]})
-        result.update({'file_id': (struct.unpack_from('<Q', hdr, 16)[0],
-                                   struct.unpack_from('<Q', hdr, 24)[0])})
-
-        _len = struct.unpack_from('<I', hdr, 4)[0]
-        _offset = struct.unpack_from('<H', hdr, 8)[0] - 64
-        result.update({'buffer': hdr[_offset:_offset + _len]})
+    def decode(direction, hdr):
+        """
+        Decode a Set Info PDU
+        """
+        if direction == Direction.REPLY:
+            return _reply.decode(hdr)
+        return _request.decode(hdr)
 
-        return result
-        
     @staticmethod
-    def _encode_request(hdr):
-        result = bytearray(33)
-        struct.pack_into('<H', result, 0, 33)
-        struct.pack_into('<B', result, 2, hdr['info_type'])
-        struct.pack_into('<B', result, 3, hdr['file_info_class'])
-        struct.pack_into('<I', result, 4, len(buffer))
-        struct.pack_into('<H', result, 8, 32 + 64)
-        result = result + buffer
-        if 'additional_information' in hdr:
-            struct.pack_into('<I', result, 12, hdr['additional_information'])
-        struct.pack_into('<Q', result, 16, hdr['file_id'][0])
-        struct.pack_into('<Q', result, 24, hdr['file_id'][1])
-        
-        return result
+    def encoded_size(direction, hdr):
+        """
+        Number of bytes a Set Info PDU encodes to
+        """
+        if direction == Direction.REPLY:
+            return _reply.encoded_size(hdr)
+        return _request.encoded_size(hdr)
 
     @staticmethod
-    def decode(direction, hdr):
+    def encode_into(direction, buf, offset, hdr):
+        """
+        Encode a Set Info PDU into buf at offset and return the offset
+        after it. The bytes of buf it covers must be zero.
+        """
         if direction == Direction.REPLY:
-            return SetInfo._decode_reply(hdr)
-        return SetInfo._decode_request(hdr)
+            return _reply.encode_into(buf, offset, hdr)
+        return _request.encode_into(buf, offset, hdr)
 
     @staticmethod
     def encode(direction, hdr):
+        """
+        Encode a Set Info PDU
+        """
         if direction == Direction.REPLY:
-            return SetInfo._encode_reply(hdr)
-        return SetInfo._encode_request(hdr)
-    
+            return _reply.encode(hdr)
+        return _request.encode(hdr)
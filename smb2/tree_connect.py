@@ -7,7 +7,8 @@ import struct
 from enum import Enum
 
 from smb2.header import Direction
-from smb2.unicode import UCS2toUTF8, UTF8toUCS2
+from smb2.record import Record, Lazy
+from smb2.schema import Codec, Field, Buffer, PATH
 
 #
 # SMB2 Tree Connect
@@ -28,65 +29,46 @@ SMB2_SHARE_TYPE_PIPE  = 0x02
 SMB2_SHARE_TYPE_PRINT = 0x03
 
 
-def _decode_request(hdr):
-    """
-    Decode a Tree Connect request
-    """
-    result = {}
-    result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-    result.update({'flags': struct.unpack_from('<H', hdr, 2)[0]})
-    if result['flags'] & SMB2_TREE_CONNECT_FLAG_EXTENSION_PRESENT:
-        print('Can not decode TreeConnect extensions')
-
-    _offset = struct.unpack_from('<H', hdr, 4)[0] - 64
-    _len = struct.unpack_from('<H', hdr, 6)[0]
-    result.update({'path': UCS2toUTF8(hdr[_offset:_offset + _len]).replace(b'\\', b'/')})
-    
-    return result
-
-def _encode_request(hdr):
+class TreeConnectRequest(Record):
     """
-    Encode a Tree Connect request
+    A class for a decoded Tree Connect request
     """
-    result = bytearray(8)
-    struct.pack_into('<H', result, 0, 9)
-    if 'flags' in hdr:
-        struct.pack_into('<H', result, 2, hdr['flags'])
-
-    _u = UTF8toUCS2(hdr['path']).replace(b'/', b'\\')
-    struct.pack_into('<H', result, 4, 8 + 64)
-    struct.pack_into('<H', result, 6, len(_u))
-    result = result + _u + bytearray(2)
-
-    return result
+    __slots__ = ('structure_size', 'flags', '_path', '_path_raw')
+    path = Lazy(PATH.decode)
 
-def _decode_reply(hdr):
+class TreeConnectReply(Record):
     """
-    Decode a Tree Connect reply
+    A class for a decoded Tree Connect reply
     """
-    result = {}
-    result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-    result.update({'share_type': struct.unpack_from('<B', hdr, 2)[0]})
-    result.update({'share_flags': struct.unpack_from('<I', hdr, 4)[0]})
-    result.update({'capabilities': struct.unpack_from('<I', hdr, 8)[0]})
-    result.update({'maximal_access': struct.unpack_from('<I', hdr, 12)[0]})
-    
-    return result
+    __slots__ = ('structure_size', 'share_type', 'share_flags',
+                 'capabilities', 'maximal_access')
+
+# The path is followed by a 16 bit nul
+_request = Codec(TreeConnectRequest, 8, [
+    Field('structure_size', 0, 'H', value=9),
+    Field('flags', 2, 'H', optional=True),
+    ], [
+    Buffer('path', offset=(4, 'H'), length=(6, 'H'), codec=PATH, pad=2,
+           required=True, missing=b''),
+    ])
+
+_reply = Codec(TreeConnectReply, 16, [
+    Field('structure_size', 0, 'H', value=16),
+    Field('share_type', 2, 'B'),
+    Field('share_flags', 4, 'I'),
+    Field('capabilities', 8, 'I'),
+    Field('maximal_access', 12, 'I'),
+    ])
 
-def _encode_reply(hdr):
+def _decode_request(hdr):
     """
-    Encode a Tree Connect reply
+    Decode a Tree Connect request
     """
-    result = bytearray(16)
-    struct.pack_into('<H', result, 0, 16)
-    struct.pack_into('<B', result, 2, hdr['share_type'])
-    struct.pack_into('<I', result, 4, hdr['share_flags'])
-    struct.pack_into('<I', result, 8, hdr['capabilities'])
-    struct.pack_into('<I', result, 12, hdr['maximal_access'])
-
+    result = _request.decode(hdr)
+    if result.flags & SMB2_TREE_CONNECT_FLAG_EXTENSION_PRESENT:
+        print('Can not decode TreeConnect extensions')
     return result
 
-
 class TreeConnect(object):
     """
     A class for Tree Connect
@@ -104,15 +86,33 @@ class TreeConnect(object):
         Decode a Tree Connect PDU
         """
         if direction == Direction.REPLY:
-            return _decode_reply(hdr)
+            return _reply.decode(hdr)
         return _decode_request(hdr)
 
+    @staticmethod
+    def encoded_size(direction, hdr):
+        """
+        Number of bytes a Tree Connect PDU encodes to
+        """
+        if direction == Direction.REPLY:
+            return _reply.encoded_size(hdr)
+        return _request.encoded_size(hdr)
+
+    @staticmethod
+    def encode_into(direction, buf, offset, hdr):
+        """
+        Encode a Tree Connect PDU into buf at offset and return the offset
+        after it. The bytes of buf it covers must be zero.
+        """
+        if direction == Direction.REPLY:
+            return _reply.encode_into(buf, offset, hdr)
+        return _request.encode_into(buf, offset, hdr)
+
     @staticmethod
     def encode(direction, hdr):
         """
         Encode a Tree Connect PDU
         """
         if direction == Direction.REPLY:
-            return _encode_reply(hdr)
-        return _encode_request(hdr)
-    
+            return _reply.encode(hdr)
+        return _request.encode(hdr)
@@ -7,11 +7,24 @@ import struct
 from enum import Enum
 
 from smb2.header import Direction
+from smb2.record import Record
+from smb2.schema import Codec, Field
 
 #
 # SMB2 Tree Disconnect
 #
 
+class TreeDisconnectPdu(Record):
+    """
+    A class for a decoded Tree Disconnect
+    """
+    __slots__ = ('structure_size',)
+
+# The same for requests and replies
+_pdu = Codec(TreeDisconnectPdu, 4, [
+    Field('structure_size', 0, 'H', value=4),
+    ])
+
 class TreeDisconnect(object):
     """
     A class for Tree Disconnect
@@ -28,16 +41,26 @@ class TreeDisconnect(object):
         """
         Decode a Tree Disconnect PDU
         """
-        result = {}
-        result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-        return result
-    
+        return _pdu.decode(hdr)
+
+    @staticmethod
+    def encoded_size(direction, hdr):
+        """
+        Number of bytes a Tree Disconnect PDU encodes to
+        """
+        return _pdu.encoded_size(hdr)
+
+    @staticmethod
+    def encode_into(direction, buf, offset, hdr):
+        """
+        Encode a Tree Disconnect PDU into buf at offset and return the offset
+        after it. The bytes of buf it covers must be zero.
+        """
+        return _pdu.encode_into(buf, offset, hdr)
+
     @staticmethod
     def encode(direction, hdr):
         """
         Encode a Tree Disconnect PDU
         """
-        result = bytearray(4)
-        struct.pack_into('<H', result, 0, 4)
-        return result
-    
+        return _pdu.encode(hdr)
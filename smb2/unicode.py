@@ -3,86 +3,100 @@
 # Copyright (C) 2020 by Ronnie Sahlberg<ronniesahlberg@gmail.com>
 #
 
-import struct
+import codecs
 
 #
-# UCS2toUTF8
+# Conversion between the UTF16-LE strings on the wire and the UTF8 bytes
+# of names in the file system.
+#
+# The work is done by the C codecs. Characters outside the BMP become
+# surrogate pairs, and lone surrogates, which Windows allows in names,
+# survive a round trip through 'surrogatepass'. A trailing odd byte is
+# ignored.
+# Names that are not UTF8, made by other programs, have their stray bytes
+# sent as U+DC80..U+DCFF, like os.fsdecode() does, and those become the
+# same bytes again on the way back.
 #
 
-def _ucs2_cp_size(cp):
-    if cp > 0x07ff:
-        return 3
-    if cp > 0x007f:
-        return 2
-    return 1
+_decode_utf16 = codecs.utf_16_le_decode
+_encode_utf16 = codecs.utf_16_le_encode
+_decode_utf8 = codecs.utf_8_decode
+_encode_utf8 = codecs.utf_8_encode
 
+# Encoded names, for the directory entries we send over and over.
+# Dropped when it is full, which is cheaper than keeping it LRU.
+_CACHE_SIZE = 16384
+_path_cache = {}
 
-def UCS2toUTF8(ucs2):
-    def ucs2_to_utf8(cp):
-        _len = _ucs2_cp_size(cp)
-        utf8 = bytearray(_len)
-        if _len == 3:
-            struct.pack_into('<BBB', utf8, 0,
-                             0xe0 |  (cp >> 12),
-                             0x80 | ((cp >>  6) & 0xbf),
-                             0x80 | ((cp      ) & 0xbf) )
-        if _len == 2:
-            struct.pack_into('<BB', utf8, 0,
-                             0xc0 |  (cp >> 6),
-                             0x80 | ((cp     ) & 0xbf) )
-        if _len == 1:
-            struct.pack_into('<B', utf8, 0, cp)
-            
-        return utf8
+# '/' and '\' are single code units, so they can be swapped in the UTF8
+# before encoding instead of in the UTF16 after it, where the bytes of
+# other characters could match them
+_TO_WIRE = bytes.maketrans(b'/', b'\\')
 
-    _len = len(ucs2) >> 1
-    u = struct.unpack_from('<' + 'H' * _len, ucs2, 0)
-    
-    utf8 = bytearray(0)
-    for cp in u:
-        utf8 = utf8 + ucs2_to_utf8(cp)
 
-    return utf8
+def _from_utf8(utf8):
+    try:
+        return _decode_utf8(utf8, 'surrogatepass', True)[0]
+    except UnicodeDecodeError:
+        return _decode_utf8(utf8, 'surrogateescape', True)[0]
 
-def UTF8toUCS2(utf8):
-    def l1(u):
-        l = 0
-        while u & 0x80:
-            l = l + 1
-            u = u >> 1
+def _to_utf8(s):
+    try:
+        return _encode_utf8(s, 'surrogateescape')[0]
+    except UnicodeEncodeError:
+        return _encode_utf8(s, 'surrogatepass')[0]
 
-        return l
+def UCS2toUTF8(ucs2):
+    """
+    Convert a UTF16-LE string, bytes or a view into a frame, to UTF8 bytes
+    """
+    return _to_utf8(_decode_utf16(ucs2, 'surrogatepass')[0])
 
-    def decode_utf8(utf8):
-        u = bytearray(2)
-        l = l1(utf8[0])
-        if l == 0:
-            struct.pack_into('<H', u, 0, utf8[0])
-            return utf8[1:], u
-        if l == 1:
-            print('UTF8 cp can not start with a 0x80 byte')
-            raise ValueError
-        if l == 2:
-            v = utf8[0] & 0x1f
-            v = (v << 6) | (utf8[1] & 0x3f)
-            struct.pack_into('<H', u, 0, v)
-            return utf8[2:], u
-        if l == 3:
-            v = utf8[0] & 0x1f
-            v = (v << 6) | (utf8[1] & 0x3f)
-            v = (v << 6) | (utf8[2] & 0x3f)
-            struct.pack_into('<H', u, 0, v)
-            return utf8[3:], u
+def UTF8toUCS2(utf8):
+    """
+    Convert UTF8 bytes, or a str, to UTF16-LE bytes
+    """
+    if not isinstance(utf8, str):
+        utf8 = _from_utf8(utf8)
+    return _encode_utf16(utf8, 'surrogatepass')[0]
 
-        return utf8[1:], u
-    
-    ucs2 = bytearray(0)
+def UTF8toUCS2Len(utf8):
+    """
+    Number of bytes UTF8toUCS2() returns for utf8, bytes, a str or a view
+    """
+    if isinstance(utf8, memoryview):
+        # Unlike bytes and str a view has no isascii()
+        utf8 = bytes(utf8)
+    if utf8.isascii():
+        return len(utf8) * 2
+    return len(PathtoUCS2(utf8))
 
-    if isinstance(utf8, str):
-        utf8 = bytes(utf8, encoding='utf-8')
+def UCS2toPath(ucs2):
+    """
+    Convert a UTF16-LE path with '\\' separators to UTF8 with '/'
+    """
+    return _to_utf8(_decode_utf16(ucs2, 'surrogatepass')[0].replace('\\', '/'))
 
-    while len(utf8):
-        utf8, u = decode_utf8(utf8)
-        ucs2 = ucs2 + u
+def PathtoUCS2(path):
+    """
+    Convert a UTF8 path with '/' separators to UTF16-LE with '\\'.
+    The results are cached.
+    """
+    try:
+        _u = _path_cache.get(path)
+    except TypeError:
+        # bytearray and memoryview can not be keys
+        path = bytes(path)
+        _u = None
+    if _u is not None:
+        return _u
 
-    return ucs2
+    if isinstance(path, str):
+        _u = _encode_utf16(path.replace('/', '\\'), 'surrogatepass')[0]
+    else:
+        _u = _encode_utf16(_from_utf8(path.translate(_TO_WIRE)),
+                           'surrogatepass')[0]
+    if len(_path_cache) >= _CACHE_SIZE:
+        _path_cache.clear()
+    _path_cache[path] = _u
+    return _u
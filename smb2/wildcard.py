@@ -0,0 +1,83 @@
+# coding: utf-8
+
+# Copyright (C) 2020 by Ronnie Sahlberg<ronniesahlberg@gmail.com>
+#
+
+import re
+
+#
+# Matching of names against the search pattern of a QUERY_DIRECTORY,
+# with the wildcards of MS-FSA 2.1.4.4:
+#   *  zero or more characters
+#   ?  exactly one character
+#   <  (DOS_STAR) zero or more characters, but not the last '.' of the name
+#   >  (DOS_QM) one character, or none at a '.' or at the end of the name
+#   "  (DOS_DOT) a '.', or nothing at the end of the name
+#
+# Names and patterns are UTF8 bytes. Matching is case sensitive, the
+# server tells clients it is with CASE_SENSITIVE_SEARCH.
+#
+
+WILDCARDS = b'*?<>"'
+
+# One UTF8 encoded character, and one that is not a '.'
+_CHAR = rb'(?:[\x00-\x7f]|[\xc0-\xff][\x80-\xbf]*)'
+_NOT_DOT = rb'(?:[\x00-\x2d\x2f-\x7f]|[\xc0-\xff][\x80-\xbf]*)'
+
+_TRANSLATE = {
+    ord('*'): rb'.*',
+    ord('?'): _CHAR,
+    # Anything up to, but not across, the last '.'
+    ord('<'): rb'(?:(?!\.[^.]*\Z).)*',
+    ord('"'): rb'(?:\.|\Z)',
+    }
+
+_CACHE_SIZE = 256
+_pattern_cache = {}
+
+
+def is_wildcard(pattern):
+    """
+    True if the pattern has any wildcards in it
+    """
+    for _c in WILDCARDS:
+        if _c in pattern:
+            return True
+    return False
+
+def _translate(pattern):
+    _r = []
+    _pos = 0
+    while _pos < len(pattern):
+        _c = pattern[_pos]
+        if _c == ord('>'):
+            # A run of DOS_QMs matches all of them, or fewer if the name
+            # has a '.' or ends first
+            _n = 1
+            while _pos + _n < len(pattern) and pattern[_pos + _n] == ord('>'):
+                _n = _n + 1
+            _r.append(rb'(?:%s{%d}|%s{0,%d}(?=\.|\Z))' % (_NOT_DOT, _n,
+                                                          _NOT_DOT, _n - 1))
+            _pos = _pos + _n
+            continue
+        _r.append(_TRANSLATE.get(_c) or re.escape(pattern[_pos:_pos + 1]))
+        _pos = _pos + 1
+    return b''.join(_r)
+
+def compile_pattern(pattern):
+    """
+    Returns a function that returns a true value for the names that match
+    the pattern, or None if every name does
+    """
+    pattern = bytes(pattern)
+    if pattern in (b'', b'*'):
+        return None
+    try:
+        return _pattern_cache[pattern]
+    except KeyError:
+        True
+    _match = re.compile(_translate(pattern), re.DOTALL).fullmatch
+    if len(_pattern_cache) >= _CACHE_SIZE:
+        _pattern_cache.clear()
+    _pattern_cache[pattern] = _match
+    return _match
@@ -7,6 +7,8 @@ import struct
 from enum import Enum
 
 from smb2.header import Direction
+from smb2.record import Record
+from smb2.schema import Codec, Field, Buffer
 
 #
 # SMB2 Write
@@ -19,60 +21,32 @@ SMB2_WRITEFLAG_WRITE_THROUGH    = 0x01
 SMB2_WRITEFLAG_WRITE_UNBUFFERED = 0x02
 
 
-def _decode_request(hdr):
+class WriteRequest(Record):
     """
-    Decode a Write request
+    A class for a decoded Write request
     """
-    result = {}
-    result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-    result.update({'length': struct.unpack_from('<I', hdr, 4)[0]})
-    result.update({'offset': struct.unpack_from('<Q', hdr, 8)[0]})
-    result.update({'file_id': (struct.unpack_from('<Q', hdr, 16)[0],
-                               struct.unpack_from('<Q', hdr, 24)[0])})
-    result.update({'flags': struct.unpack_from('<I', hdr, 44)[0]})
-    
-    if result['length']:
-        _o = struct.unpack_from('<H', hdr, 2)[0] - 64
-        result.update({'data': hdr[_o:_o + result['length']]})
-
-    return result
-
-def _encode_request(hdr):
-    """
-    Encode a Write request
-    """
-    result = bytearray(48)
-    struct.pack_into('<H', result, 0, 49)
-    struct.pack_into('<H', result, 2, 48)
-    struct.pack_into('<I', result, 4, len(buffer))
-    struct.pack_into('<Q', result, 8, hdr['offset'])
-    struct.pack_into('<Q', result, 16, hdr['file_id'][0])
-    struct.pack_into('<Q', result, 24, hdr['file_id'][1])
-    struct.pack_into('<I', result, 44, hdr['flags'])
-    result = result + hdr['data']
-        
-    return result
-
-def _encode_reply(hdr):
-    """
-    Encode a Write reply
-    """
-    result = bytearray(16)
-    struct.pack_into('<H', result, 0, 17)
-    struct.pack_into('<I', result, 4, hdr['count'])
-        
-    return result
+    __slots__ = ('structure_size', 'length', 'offset', 'file_id', 'flags',
+                 'data')
 
-def _decode_reply(hdr):
+class WriteReply(Record):
     """
-    Decode a Write reply
+    A class for a decoded Write reply
     """
-    result = {}
-    result.update({'structure_size': struct.unpack_from('<H', hdr, 0)[0]})
-    result.update({'count': struct.unpack_from('<I', hdr, 4)[0]})
-
-    return result
-
+    __slots__ = ('structure_size', 'count')
+
+_request = Codec(WriteRequest, 48, [
+    Field('structure_size', 0, 'H', value=49),
+    Field('offset', 8, 'Q'),
+    Field('file_id', 16, 'QQ'),
+    Field('flags', 44, 'I'),
+    ], [
+    Buffer('data', offset=(2, 'H'), length=(4, 'I'), length_name='length'),
+    ])
+
+_reply = Codec(WriteReply, 16, [
+    Field('structure_size', 0, 'H', value=17),
+    Field('count', 4, 'I'),
+    ])
 
 class Write(object):
     """
@@ -91,8 +65,27 @@ class Write(object):
         Decode a Write PDU
         """
         if direction == Direction.REPLY:
-            return _decode_reply(hdr)
-        return _decode_request(hdr)
+            return _reply.decode(hdr)
+        return _request.decode(hdr)
+
+    @staticmethod
+    def encoded_size(direction, hdr):
+        """
+        Number of bytes a Write PDU encodes to
+        """
+        if direction == Direction.REPLY:
+            return _reply.encoded_size(hdr)
+        return _request.encoded_size(hdr)
+
+    @staticmethod
+    def encode_into(direction, buf, offset, hdr):
+        """
+        Encode a Write PDU into buf at offset and return the offset
+        after it. The bytes of buf it covers must be zero.
+        """
+        if direction == Direction.REPLY:
+            return _reply.encode_into(buf, offset, hdr)
+        return _request.encode_into(buf, offset, hdr)
 
     @staticmethod
     def encode(direction, hdr):
@@ -100,6 +93,5 @@ class Write(object):
         Encode a Write PDU
         """
         if direction == Direction.REPLY:
-            return _encode_reply(hdr)
-        return _encode_request(hdr)
-    
+            return _reply.encode(hdr)
+        return _request.encode(hdr)
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+#
+# Loopback benchmark: aggregate READ ops/s as the number of concurrently
+# connected clients grows.
+#
+# Run from the tests directory with a server/config.py in place:
+#   PYTHONPATH=.. python bench_server_connections.py
+#
+
+import os
+import tempfile
+import time
+
+from loopback import start_server, run_clients, raise_fd_limit
+
+CLIENT_COUNTS = [1, 10, 50, 100, 200, 500]
+DURATION = 3.0
+
+
+async def read_loop(c, deadline):
+    fid = await c.create('bench.dat')
+    ops = 0
+    while time.monotonic() < deadline:
+        await c.read(fid, 0, 4096)
+        ops = ops + 1
+    await c.close(fid)
+    return ops
+
+def main():
+    raise_fd_limit()
+    with tempfile.TemporaryDirectory() as share:
+        with open(os.path.join(share, 'bench.dat'), 'wb') as f:
+            f.write(os.urandom(4096))
+
+        server, port = start_server(share)
+        print('%8s %12s %14s' % ('clients', 'ops/s', 'ops/s/client'))
+        for n in CLIENT_COUNTS:
+            ops = run_clients(port, n, DURATION, read_loop)
+            print('%8d %12.0f %14.1f' % (n, ops, ops / n))
+        server.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+#
+# Handler benchmark: scripted request sequences replayed against a Server
+# running in this process over a MemoryTransport, so no socket or other
+# process is involved. For each scenario we report the requests per second
+# and, for every command, the latency percentiles of its requests.
+#
+#   open/read/close  open a small file, read it and close it
+#   directory walk   list every directory of a two level tree
+#   metadata         open a file, query its metadata twice and close it
+#
+# Run from the tests directory with a server/config.py in place:
+#   PYTHONPATH=.. python bench_server_handlers.py [--iterations N]
+#       [--clients N] [scenario ...]
+#
+
+import argparse
+import asyncio
+import contextlib
+import os
+import tempfile
+import time
+
+from loopback import memory_client
+from smb2.header import FILE_ATTRIBUTE_DIRECTORY
+from smb2.create import FILE_DIRECTORY_FILE
+from smb2.file_info import FileInfoClass
+
+FILES = 100
+FILE_SIZE = 4096
+DIRS = 10
+DIR_ENTRIES = 100
+ITERATIONS = 2000
+PERCENTILES = [50, 90, 99]
+
+
+class Latencies(object):
+    """
+    A class for the latencies of the requests, per command
+    """
+
+    def __init__(self, **kwargs):
+        self.ns = {}
+
+    async def __call__(self, name, coro):
+        _t = time.perf_counter_ns()
+        _r = await coro
+        self.ns.setdefault(name, []).append(time.perf_counter_ns() - _t)
+        return _r
+
+    def requests(self):
+        return sum([len(l) for l in self.ns.values()])
+
+
+async def open_read_close(c, lat, i):
+    fid = await lat('create', c.create('file-%04d.dat' % (i % FILES)))
+    await lat('read', c.read(fid, 0, FILE_SIZE))
+    await lat('close', c.close(fid))
+
+async def directory_walk(c, lat, i):
+    dirs = ['']
+    while dirs:
+        _d = dirs.pop()
+        fid = await lat('create', c.create(_d, create_options=FILE_DIRECTORY_FILE))
+        while True:
+            entries = await lat('query_directory', c.query_directory(fid))
+            if entries is None:
+                break
+            for e in entries:
+                if e['file_attributes'] & FILE_ATTRIBUTE_DIRECTORY:
+                    dirs.append(os.path.join(_d, e['file_name'].decode()))
+        await lat('close', c.close(fid))
+
+async def metadata(c, lat, i):
+    fid = await lat('create', c.create('file-%04d.dat' % (i % FILES)))
+    await lat('query_info', c.query_info(fid, FileInfoClass.ALL_INFORMATION))
+    await lat('query_info', c.query_info(fid, FileInfoClass.STANDARD_INFORMATION))
+    await lat('close', c.close(fid))
+
+SCENARIOS = {
+    'open/read/close': open_read_close,
+    'directory walk': directory_walk,
+    'metadata': metadata,
+    }
+
+
+def make_share(share):
+    for i in range(FILES):
+        with open(os.path.join(share, 'file-%04d.dat' % i), 'wb') as f:
+            f.write(os.urandom(FILE_SIZE))
+    for i in range(DIRS):
+        _d = os.path.join(share, 'dir-%02d' % i)
+        os.mkdir(_d)
+        for j in range(DIR_ENTRIES):
+            open(os.path.join(_d, 'entry-%04d' % j), 'wb').close()
+
+async def run(share, scenario, iterations, clients):
+    # The server logs every connection and login
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        _clients = [await memory_client(share) for _ in range(clients)]
+    lat = Latencies()
+
+    async def _drive(c):
+        for i in range(iterations):
+            await scenario(c, lat, i)
+
+    _t = time.perf_counter()
+    await asyncio.gather(*[_drive(c) for c in _clients])
+    _t = time.perf_counter() - _t
+    for c in _clients:
+        c.close_connection()
+    return lat, _t
+
+def percentile(ns, p):
+    return ns[min(len(ns) * p // 100, len(ns) - 1)]
+
+def report(name, lat, t):
+    print('%s: %d requests in %.2fs, %.0f requests/s' % (name, lat.requests(),
+                                                         t, lat.requests() / t))
+    print('  %-16s %8s %10s' % ('command', 'count', 'ops/s') +
+          ''.join(['%10s' % ('p%d us' % p) for p in PERCENTILES]) +
+          '%10s' % 'max us')
+    for cmd, ns in lat.ns.items():
+        ns.sort()
+        print('  %-16s %8d %10.0f' % (cmd, len(ns), len(ns) / t) +
+              ''.join(['%10.1f' % (percentile(ns, p) / 1000) for p in PERCENTILES]) +
+              '%10.1f' % (ns[-1] / 1000))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the server handlers')
+    parser.add_argument('--iterations', type=int, default=ITERATIONS,
+                        help='times every client runs a scenario (default %d)' % ITERATIONS)
+    parser.add_argument('--clients', type=int, default=1,
+                        help='concurrent connections (default 1)')
+    parser.add_argument('scenarios', nargs='*',
+                        help='scenarios to run: %s (default all)' %
+                        ', '.join(SCENARIOS))
+    args = parser.parse_args()
+    for name in args.scenarios:
+        if not name in SCENARIOS:
+            parser.error('unknown scenario %s' % name)
+
+    with tempfile.TemporaryDirectory() as share:
+        make_share(share)
+        for name in args.scenarios or SCENARIOS:
+            lat, t = asyncio.run(run(share, SCENARIOS[name], args.iterations,
+                                     args.clients))
+            report(name, lat, t)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+#
+# Loopback benchmark: sequential READ and WRITE throughput for different
+# I/O sizes, one request in flight at a time.
+#
+# Run from the tests directory with a server/config.py in place:
+#   PYTHONPATH=.. python bench_server_io.py
+#
+
+import asyncio
+import os
+import tempfile
+import time
+
+from loopback import start_server
+from smb2_client import Client
+from smb2.create import Disposition
+
+IO_SIZES = [65536, 1048576, 8388608]
+FILE_SIZE = 256 * 1048576
+
+
+async def run(port, io_size):
+    c = await Client.connect('127.0.0.1', port)
+    fid = await c.create('bench_%d.dat' % io_size,
+                         disposition=Disposition.OPEN_IF)
+    data = os.urandom(io_size)
+
+    t = time.monotonic()
+    for offset in range(0, FILE_SIZE, io_size):
+        if await c.write(fid, offset, data) != io_size:
+            raise IOError('Short write')
+    _write = FILE_SIZE / (time.monotonic() - t)
+
+    t = time.monotonic()
+    for offset in range(0, FILE_SIZE, io_size):
+        if len(await c.read(fid, offset, io_size)) != io_size:
+            raise IOError('Short read')
+    _read = FILE_SIZE / (time.monotonic() - t)
+
+    await c.close(fid)
+    c.close_connection()
+    return _write, _read
+
+def main():
+    with tempfile.TemporaryDirectory() as share:
+        server, port = start_server(share)
+        print('%10s %12s %12s' % ('io size', 'write MB/s', 'read MB/s'))
+        for io_size in IO_SIZES:
+            _w, _r = asyncio.run(run(port, io_size))
+            os.unlink(os.path.join(share, 'bench_%d.dat' % io_size))
+            print('%10d %12.1f %12.1f' % (io_size, _w / 1000000, _r / 1000000))
+        server.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+#
+# Large directory benchmark: listing a directory with many entries over
+# QUERY_DIRECTORY from a Server running in this process, streamed from the
+# directory and served from the directory cache. For each we report the
+# time to the first reply, the entries per second and the peak memory
+# the listing took.
+# Then it looks names up in the directory, an exact name and wildcard
+# patterns, and reports how long each search takes next to the listing.
+#
+# Run from the tests directory with a server/config.py in place:
+#   PYTHONPATH=.. python bench_server_large_dir.py [entries]
+#
+
+import asyncio
+import contextlib
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from loopback import memory_client
+from config import Config
+from smb2.create import FILE_DIRECTORY_FILE
+import dircache
+
+ENTRIES = 100000
+RUNS = 3
+LOOKUPS = 20
+# What Windows clients ask for
+OUTPUT_BUFFER_LENGTH = 65536
+
+
+def make_dir(path, entries):
+    os.mkdir(path)
+    for i in range(entries):
+        os.close(os.open(os.path.join(path, 'file-%07d.dat' % i),
+                         os.O_CREAT | os.O_WRONLY))
+
+async def open_close(c, path):
+    for i in range(1000):
+        if i == 100:
+            _t = time.perf_counter()
+        fid = await c.create(path, create_options=FILE_DIRECTORY_FILE)
+        await c.close(fid)
+    return (time.perf_counter() - _t) / 900
+
+async def listing(c, path, pattern='*'):
+    """
+    Returns the time to the first reply, the total time and the number
+    of entries
+    """
+    _t = time.perf_counter()
+    _first = 0
+    _num = 0
+    fid = await c.create(path, create_options=FILE_DIRECTORY_FILE)
+    while True:
+        entries = await c.query_directory(fid, pattern=pattern,
+                                          output_buffer_length=OUTPUT_BUFFER_LENGTH)
+        if entries is None:
+            break
+        if not _first:
+            _first = time.perf_counter() - _t
+        _num = _num + len(entries)
+    await c.close(fid)
+    return _first, time.perf_counter() - _t, _num
+
+async def run(share, entries):
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        c = await memory_client(share)
+
+    print('open and close without listing: %.1f us' %
+          (await open_close(c, 'big') * 1000000))
+    print('%-10s %12s %12s %12s %12s' % ('listing', 'first reply', 'total s',
+                                         'entries/s', 'peak MB'))
+    for name, cache in [('streamed', 0), ('cold', entries), ('cached', entries)]:
+        Config.dir_cache_entries = cache
+        _first = _t = float('inf')
+        for _ in range(RUNS):
+            if name != 'cached':
+                dircache.dir_cache().clear()
+            _f, _l, _num = await listing(c, 'big')
+            if _num != entries:
+                raise IOError('Listed %d of %d entries' % (_num, entries))
+            _first = min(_first, _f)
+            _t = min(_t, _l)
+
+        # Once more with tracemalloc, which is slow
+        if name != 'cached':
+            dircache.dir_cache().clear()
+        tracemalloc.start()
+        await listing(c, 'big')
+        _peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('%-10s %10.1fms %12.2f %12.0f %12.1f' % (name, _first * 1000, _t,
+                                                       _num / _t, _peak / 1000000))
+
+    # The last file, so a search that reads the directory has to read
+    # all of it
+    _last = 'file-%07d.dat' % (entries - 1)
+    print()
+    print('%-22s %8s %12s %12s' % ('search', 'entries', 'streamed ms',
+                                   'cached ms'))
+    for pattern in ['*', _last, _last[:-5] + '?.dat', _last[:-6] + '*',
+                    '*' + _last[-9:]]:
+        _ms = []
+        for cache in [0, entries]:
+            Config.dir_cache_entries = cache
+            dircache.dir_cache().clear()
+            # Once to fill the cache
+            await listing(c, 'big', pattern)
+            _t = float('inf')
+            for _ in range(LOOKUPS if pattern != '*' else RUNS):
+                _, _l, _num = await listing(c, 'big', pattern)
+                _t = min(_t, _l)
+            _ms.append(_t * 1000)
+        print('%-22s %8d %12.3f %12.3f' % (pattern, _num, _ms[0], _ms[1]))
+    c.close_connection()
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else ENTRIES
+    with tempfile.TemporaryDirectory() as share:
+        make_dir(os.path.join(share, 'big'), entries)
+        print('%d entries, %d byte replies' % (entries, OUTPUT_BUFFER_LENGTH))
+        asyncio.run(run(share, entries))
+
+if __name__ == "__main__":
+    main()
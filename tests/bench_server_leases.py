@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+#
+# Lease benchmark: a client that caches the way SMB clients do, reusing
+# handles while it holds handle caching and file data, or directory
+# entries, while it holds read caching, repeatedly reads a set of small
+# files or lists a set of directories on a Server running in this
+# process. It runs with leases on and off and we report the application
+# operations per second and the requests that went to the server.
+#
+#   read only     one client reads the files over and over
+#   with writer   a second client rewrites one of the files every
+#                 WRITE_EVERY reads, which breaks the lease of the reader
+#   browse        one client lists the directories over and over, like
+#                 a file manager or an ls -l loop
+#   with creates  a second client creates a file in one of the
+#                 directories every WRITE_EVERY listings
+#
+# Run from the tests directory with a server/config.py in place:
+#   PYTHONPATH=.. python bench_server_leases.py [--iterations N]
+#
+
+import argparse
+import asyncio
+import contextlib
+import itertools
+import os
+import tempfile
+import time
+
+from loopback import memory_client
+from smb2.create import SMB2_LEASE_READ_CACHING, SMB2_LEASE_HANDLE_CACHING
+from smb2.create import FILE_DIRECTORY_FILE, Disposition
+
+FILES = 20
+FILE_SIZE = 4096
+DIRS = 10
+DIR_ENTRIES = 100
+ITERATIONS = 5000
+WRITE_EVERY = 100
+
+R = SMB2_LEASE_READ_CACHING
+H = SMB2_LEASE_HANDLE_CACHING
+
+
+class CachingClient(object):
+    """
+    A class for a client that caches handles and data under its leases
+    """
+
+    def __init__(self, c, **kwargs):
+        self.c = c
+        self.requests = 0
+        # name -> [lease key, file id or None, data or None]
+        self._files = {}
+        c.on_break = self._on_break
+
+        _request = c.request
+
+        async def _count(*args, **kw):
+            self.requests = self.requests + 1
+            return await _request(*args, **kw)
+        c.request = _count
+
+    async def read_file(self, name):
+        """
+        Open, read and close name, from the cache when we can
+        """
+        return await self._cached(name, 0, lambda fid: self.c.read(fid, 0, FILE_SIZE))
+
+    async def list_dir(self, name):
+        """
+        Open, list and close the directory name, from the cache when we can
+        """
+        return await self._cached(name, FILE_DIRECTORY_FILE, self._list)
+
+    async def _list(self, fid):
+        _entries = []
+        while True:
+            _e = await self.c.query_directory(fid)
+            if _e is None:
+                return _entries
+            _entries.extend(_e)
+
+    async def _cached(self, name, create_options, func):
+        _e = self._files.setdefault(name, [os.urandom(16), None, None])
+        _state = self.c.leases.get(_e[0], 0)
+        if _e[2] is not None and _state & R:
+            return _e[2]
+        _fid = _e[1]
+        if _fid is None:
+            _fid = await self.c.create(name, create_options=create_options,
+                                       lease_key=_e[0], lease_state=R | H)
+        elif create_options & FILE_DIRECTORY_FILE:
+            # Start the listing over on the handle we kept
+            await self.c.close(_fid)
+            _fid = await self.c.create(name, create_options=create_options,
+                                       lease_key=_e[0], lease_state=R | H)
+        _data = await func(_fid)
+        _state = self.c.leases.get(_e[0], 0)
+        if _state & H:
+            _e[1] = _fid
+        else:
+            _e[1] = None
+            await self.c.close(_fid)
+        if _state & R:
+            _e[2] = _data
+        return _data
+
+    async def _on_break(self, b):
+        for name, _e in self._files.items():
+            if _e[0] != bytes(b.lease_key):
+                continue
+            if not b.new_lease_state & R:
+                _e[2] = None
+            if not b.new_lease_state & H and _e[1] is not None:
+                _fid = _e[1]
+                _e[1] = None
+                await self.c.close(_fid)
+
+
+async def read_only(reader, writer, iterations):
+    for i in range(iterations):
+        await reader.read_file('file-%04d.dat' % (i % FILES))
+
+async def with_writer(reader, writer, iterations):
+    for i in range(iterations):
+        await reader.read_file('file-%04d.dat' % (i % FILES))
+        if i % WRITE_EVERY == WRITE_EVERY - 1:
+            fid = await writer.c.create('file-%04d.dat' % (i % FILES))
+            await writer.c.write(fid, 0, os.urandom(FILE_SIZE))
+            await writer.c.close(fid)
+
+async def browse(reader, writer, iterations):
+    for i in range(iterations):
+        await reader.list_dir('dir-%02d' % (i % DIRS))
+
+# Names for the new files, that are left in place between the runs
+_created = itertools.count()
+
+async def with_creates(reader, writer, iterations):
+    for i in range(iterations):
+        await reader.list_dir('dir-%02d' % (i % DIRS))
+        if i % WRITE_EVERY == WRITE_EVERY - 1:
+            fid = await writer.c.create('dir-%02d/new-%06d' % (i % DIRS, next(_created)),
+                                        disposition=Disposition.CREATE)
+            await writer.c.close(fid)
+
+SCENARIOS = {
+    'read only': read_only,
+    'with writer': with_writer,
+    'browse': browse,
+    'with creates': with_creates,
+    }
+
+
+def make_share(share):
+    for i in range(FILES):
+        with open(os.path.join(share, 'file-%04d.dat' % i), 'wb') as f:
+            f.write(os.urandom(FILE_SIZE))
+    for i in range(DIRS):
+        _d = os.path.join(share, 'dir-%02d' % i)
+        os.mkdir(_d)
+        for j in range(DIR_ENTRIES):
+            open(os.path.join(_d, 'entry-%04d' % j), 'wb').close()
+
+async def run(share, scenario, iterations, leases):
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        reader = CachingClient(await memory_client(share, leases=leases))
+        writer = CachingClient(await memory_client(share, leases=leases))
+    _t = time.perf_counter()
+    await scenario(reader, writer, iterations)
+    _t = time.perf_counter() - _t
+    reader.c.close_connection()
+    writer.c.close_connection()
+    return _t, reader.requests + writer.requests
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark leases')
+    parser.add_argument('--iterations', type=int, default=ITERATIONS,
+                        help='files, or directories, the reader opens, reads and closes (default %d)' % ITERATIONS)
+    args = parser.parse_args()
+
+    print('%-12s %-7s %12s %10s %14s' % ('scenario', 'leases', 'reads/s',
+                                         'requests', 'requests/read'))
+    with tempfile.TemporaryDirectory() as share:
+        make_share(share)
+        for name, scenario in SCENARIOS.items():
+            for leases in [False, True]:
+                _t, _requests = asyncio.run(run(share, scenario,
+                                                args.iterations, leases))
+                print('%-12s %-7s %12.0f %10d %14.2f' % (name,
+                                                         'on' if leases else 'off',
+                                                         args.iterations / _t,
+                                                         _requests,
+                                                         _requests / args.iterations))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+#
+# Loopback benchmark: sequential READ throughput, and the server CPU time it
+# costs, with and without sendfile for the read replies.
+#
+# Run from the tests directory with a server/config.py in place:
+#   PYTHONPATH=.. python bench_server_sendfile.py
+#
+
+import asyncio
+import os
+import tempfile
+import time
+
+from loopback import start_server
+from smb2_client import Client
+
+IO_SIZES = [65536, 1048576, 8388608]
+FILE_SIZE = 256 * 1048576
+PASSES = 2
+
+
+def cpu_time(pid):
+    """
+    User plus system time of a process, from /proc
+    """
+    with open('/proc/%d/stat' % pid) as f:
+        _f = f.read().rsplit(')', 1)[1].split()
+    return (int(_f[11]) + int(_f[12])) / os.sysconf('SC_CLK_TCK')
+
+async def run(port, io_size):
+    c = await Client.connect('127.0.0.1', port)
+    fid = await c.create('bench.dat')
+    for _ in range(PASSES):
+        for offset in range(0, FILE_SIZE, io_size):
+            if len(await c.read(fid, offset, io_size)) != io_size:
+                raise IOError('Short read')
+    await c.close(fid)
+    c.close_connection()
+
+def main():
+    with tempfile.TemporaryDirectory() as share:
+        with open(os.path.join(share, 'bench.dat'), 'wb') as f:
+            for _ in range(FILE_SIZE // 1048576):
+                f.write(os.urandom(1048576))
+
+        print('%10s %9s %10s %12s' % ('io size', 'sendfile', 'MB/s',
+                                      'cpu s/GB'))
+        for io_size in IO_SIZES:
+            for sendfile in (False, True):
+                _min = 65536 if sendfile else 1 << 62
+                server, port = start_server(share, sendfile_min_size=_min)
+                _cpu = cpu_time(server.pid)
+                t = time.monotonic()
+                asyncio.run(run(port, io_size))
+                _t = time.monotonic() - t
+                _cpu = cpu_time(server.pid) - _cpu
+                _bytes = PASSES * FILE_SIZE
+                print('%10d %9s %10.1f %12.2f' % (io_size, sendfile,
+                                                  _bytes / _t / 1000000,
+                                                  _cpu / (_bytes / 1000000000)))
+                server.terminate()
+
+if __name__ == "__main__":
+    main()
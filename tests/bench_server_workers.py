@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+#
+# Loopback benchmark: aggregate throughput as the number of pre-forked
+# worker processes grows. Each worker runs its own event loop on a
+# SO_REUSEPORT listener.
+#
+# Run from the tests directory with a server/config.py in place:
+#   PYTHONPATH=.. python bench_server_workers.py
+#
+
+import os
+import tempfile
+import time
+
+from loopback import start_server, run_clients, raise_fd_limit
+
+CLIENTS = 128
+DURATION = 3.0
+READ_SIZE = 65536
+
+
+async def read_loop(c, deadline):
+    fid = await c.create('bench.dat')
+    ops = 0
+    while time.monotonic() < deadline:
+        await c.read(fid, 0, READ_SIZE)
+        ops = ops + 1
+    await c.close(fid)
+    return ops
+
+def main():
+    raise_fd_limit()
+    _cpus = os.cpu_count()
+    workers = sorted(set([1, 2, 4, 8, 16, _cpus]))
+    workers = [w for w in workers if w <= _cpus]
+    with tempfile.TemporaryDirectory() as share:
+        with open(os.path.join(share, 'bench.dat'), 'wb') as f:
+            f.write(os.urandom(READ_SIZE))
+
+        print('%8s %12s %10s %10s' % ('workers', 'ops/s', 'MB/s', 'speedup'))
+        _base = None
+        for w in workers:
+            server, port = start_server(share, workers=w)
+            # Leave at least half of the cores to the clients
+            ops = run_clients(port, CLIENTS, DURATION, read_loop,
+                              processes=max(_cpus // 2, 1))
+            server.terminate()
+            server.join()
+            if _base is None:
+                _base = ops
+            print('%8d %12.0f %10.1f %9.2fx' % (w, ops,
+                                                 ops * READ_SIZE / 1000000,
+                                                 ops / _base))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+#
+# Microbenchmark suite for the codecs in smb2/: the ops/s and the peak
+# number of bytes allocated by one call of every encoder and decoder,
+# compared with the baselines in bench_smb2_codecs.json.
+# The speed of a codec is its ops/s relative to a calibration loop that is
+# timed in the same run, so the baselines hold on any machine.
+# The run fails if a codec got slower, or allocates more, by more than the
+# threshold.
+#
+# Run from the tests directory:
+#   PYTHONPATH=.. python bench_smb2_codecs.py [--threshold 25] [name ...]
+# and to record new baselines:
+#   PYTHONPATH=.. python bench_smb2_codecs.py --save
+#
+
+import argparse
+import json
+import os
+import statistics
+import struct
+import sys
+import timeit
+import tracemalloc
+
+from smb2.header import Header, Direction
+from smb2.error_response import ErrorResponse
+from smb2.negotiate_protocol import *
+from smb2.session_setup import SessionSetup
+from smb2.tree_connect import TreeConnect
+from smb2.tree_disconnect import TreeDisconnect
+from smb2.create import Create
+from smb2.close import Close
+from smb2.read import Read
+from smb2.write import Write
+from smb2.query_info import QueryInfo
+from smb2.query_directory import QueryDirectory
+from smb2.file_info import FileInfo, FileInfoClass
+from smb2.filesystem_info import FSInfo, FSInfoClass
+from smb2.dir_info import DirInfo, DirInfoClass
+
+from test_smb2_header import create_req_buf
+from test_smb2_error_response import error_response_buf_1
+from test_smb2_negotiate_protocol import negotiate_protocol_req_buf_2, negotiate_protocol_rep_buf_1
+from test_smb2_session_setup import session_setup_req_buf_1, session_setup_rep_buf_1
+from test_smb2_tree_connect import tree_connect_req_buf_1, tree_connect_rep_buf_1
+from test_smb2_tree_disconnect import tree_disconnect_req_buf_1
+from test_smb2_create import create_req_buf_1, create_rep_buf_1
+from test_smb2_close import close_req_buf_1, close_rep_buf_1
+from test_smb2_read import read_req_buf_1
+from test_smb2_write import write_req_buf_1, write_rep_buf_1
+from test_smb2_query_info import query_info_req_buf_1, query_info_rep_buf_1
+from test_smb2_query_directory import query_directory_req_buf_1, query_directory_rep_buf_1
+from test_smb2_file_info import *
+from test_smb2_filesystem_info import *
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'bench_smb2_codecs.json')
+# Default for how much worse than the baseline a codec may get, in percent
+THRESHOLD = 25
+# Allocations this much over the baseline are noise, whatever the threshold
+SLACK_BYTES = 64
+# Time each codec for at least this long per repeat
+MIN_TIME = 0.05
+REPEAT = 5
+
+# The captured PDUs: (name, codec class, direction, bytes after the header)
+PDUS = [
+    ('negotiate request', NegotiateProtocol, Direction.REQUEST, negotiate_protocol_req_buf_2[4 + 64:]),
+    ('negotiate reply', NegotiateProtocol, Direction.REPLY, negotiate_protocol_rep_buf_1[4 + 64:]),
+    ('session setup request', SessionSetup, Direction.REQUEST, session_setup_req_buf_1[4 + 64:]),
+    ('session setup reply', SessionSetup, Direction.REPLY, session_setup_rep_buf_1[4 + 64:]),
+    ('tree connect request', TreeConnect, Direction.REQUEST, tree_connect_req_buf_1[4 + 64:]),
+    ('tree connect reply', TreeConnect, Direction.REPLY, tree_connect_rep_buf_1[4 + 64:]),
+    ('tree disconnect', TreeDisconnect, Direction.REQUEST, tree_disconnect_req_buf_1),
+    ('create request', Create, Direction.REQUEST, create_req_buf_1[4 + 64:]),
+    ('create reply', Create, Direction.REPLY, create_rep_buf_1[4 + 64:]),
+    ('close request', Close, Direction.REQUEST, close_req_buf_1),
+    ('close reply', Close, Direction.REPLY, close_rep_buf_1),
+    ('read request', Read, Direction.REQUEST, read_req_buf_1[4 + 64:]),
+    ('write reply', Write, Direction.REPLY, write_rep_buf_1),
+    ('query info request', QueryInfo, Direction.REQUEST, query_info_req_buf_1),
+    ('query info reply', QueryInfo, Direction.REPLY, query_info_rep_buf_1),
+    ('query dir request', QueryDirectory, Direction.REQUEST, query_directory_req_buf_1),
+    ('query dir reply', QueryDirectory, Direction.REPLY, query_directory_rep_buf_1),
+    ]
+
+FILE_INFOS = [
+    (FileInfoClass.BASIC_INFORMATION, file_info_basic_buf_1),
+    (FileInfoClass.STANDARD_INFORMATION, file_info_standard_buf_1),
+    (FileInfoClass.INTERNAL_INFORMATION, file_info_internal_buf_1),
+    (FileInfoClass.EA_INFORMATION, file_info_ea_buf_1),
+    (FileInfoClass.ACCESS_INFORMATION, file_info_access_buf_1),
+    (FileInfoClass.POSITION_INFORMATION, file_info_position_buf_1),
+    (FileInfoClass.MODE_INFORMATION, file_info_mode_buf_1),
+    (FileInfoClass.ALIGNMENT_INFORMATION, file_info_alignment_buf_1),
+    (FileInfoClass.ALL_INFORMATION, file_info_all_buf_1),
+    ]
+
+FS_INFOS = [
+    (FSInfoClass.VOLUME, fs_volume_buf_1),
+    (FSInfoClass.DEVICE, fs_device_buf_1),
+    (FSInfoClass.ATTRIBUTE, fs_attribute_buf_1),
+    (FSInfoClass.FULL_SIZE, fs_full_size_buf_1),
+    (FSInfoClass.SECTOR_SIZE, fs_sector_size_buf_1),
+    ]
+
+PAYLOAD_SIZES = [4096, 65536, 1048576]
+
+NEGOTIATE_CONTEXTS = {
+    SMB2_PREAUTH_INTEGRITY_CAPABILITIES: {
+        'context_type': SMB2_PREAUTH_INTEGRITY_CAPABILITIES,
+        'hash_algorithms': [SHA_512], 'salt': bytes(32)},
+    SMB2_ENCRYPTION_CAPABILITIES: {
+        'context_type': SMB2_ENCRYPTION_CAPABILITIES,
+        'ciphers': [AES_128_GCM, AES_128_CCM]},
+    }
+
+CREATE_REPLY = {'oplock_level': 0, 'flags': 0, 'create_action': 1,
+                'creation_time': (1600000000, 0, 0),
+                'last_access_time': (1600000000, 0, 0),
+                'last_write_time': (1600000000, 0, 0),
+                'change_time': (1600000000, 0, 0),
+                'allocation_size': 4096, 'end_of_file': 100,
+                'file_attributes': 0x20, 'file_id': (1, 2),
+                'contexts': {'QFid': {'disk_file_id': 5, 'volume_id': 6},
+                             'RqLs': {'lease_key': bytes(16),
+                                      'lease_state': 7}}}
+
+
+_CALIBRATION_S = struct.Struct('<IHHIHHIIQIIQ16s')
+_CALIBRATION_BUF = bytes(64)
+
+def calibration():
+    """
+    Plain Python work, unpacking and building small objects like the
+    codecs do, that the codecs are timed relative to
+    """
+    _d = {}
+    for i in range(16):
+        _d[i] = list(_CALIBRATION_S.unpack_from(_CALIBRATION_BUF, 0))
+    return _d
+
+def dir_entries(num):
+    return [{'file_index': 0,
+             'creation_time': (0, 0, 0),
+             'last_access_time': (1600000000 + i, 0, 0),
+             'last_write_time': (1600000000 + i, 0, 0),
+             'change_time': (1600000000 + i, 0, 0),
+             'end_of_file': i * 100,
+             'allocation_size': i * 100,
+             'file_attributes': 0x20,
+             'ea_size': 0,
+             'file_id': 1000000 + i,
+             'file_name': b'file-%07d.dat' % i}
+            for i in range(num)]
+
+def codecs():
+    """
+    Returns a list of (name, function to time)
+    """
+    _c = []
+
+    _h = memoryview(create_req_buf)[4:4 + 64]
+    _hdr = Header.decode(_h)
+    _c.append(('header decode', lambda: Header.decode(_h)))
+    _c.append(('header encode', lambda: Header.encode(_hdr)))
+
+    _e = memoryview(error_response_buf_1)[4 + 64:]
+    _err = ErrorResponse.decode(_e)
+    _c.append(('error response decode', lambda: ErrorResponse.decode(_e)))
+    _c.append(('error response encode', lambda: ErrorResponse.encode(_err)))
+
+    for name, cls, d, buf in PDUS:
+        _b = memoryview(buf)
+        _pdu = dict(cls.decode(d, _b))
+        _c.append((name + ' decode', lambda cls=cls, d=d, _b=_b: cls.decode(d, _b)))
+        _c.append((name + ' encode', lambda cls=cls, d=d, _p=_pdu: cls.encode(d, _p)))
+
+    # Negotiate and create with contexts
+    _rep = dict(NegotiateProtocol.decode(Direction.REPLY,
+                                         memoryview(negotiate_protocol_rep_buf_1)[4 + 64:]))
+    _rep.update({'dialect_revision': VERSION_0311, 'contexts': NEGOTIATE_CONTEXTS})
+    _nb = memoryview(NegotiateProtocol.encode(Direction.REPLY, _rep))
+    _c.append(('negotiate 3.1.1 reply decode',
+               lambda: NegotiateProtocol.decode(Direction.REPLY, _nb).contexts))
+    _c.append(('negotiate 3.1.1 reply encode',
+               lambda _rep=_rep: NegotiateProtocol.encode(Direction.REPLY, _rep)))
+    _cb = memoryview(Create.encode(Direction.REPLY, CREATE_REPLY))
+    _c.append(('create contexts reply decode',
+               lambda: Create.decode(Direction.REPLY, _cb).contexts))
+    _c.append(('create contexts reply encode',
+               lambda: Create.encode(Direction.REPLY, CREATE_REPLY)))
+
+    # Reads and writes at several payload sizes
+    for size in PAYLOAD_SIZES:
+        _rep = {'data_remaining': 0, 'data': bytes(size)}
+        _rb = memoryview(Read.encode(Direction.REPLY, _rep))
+        _c.append(('read reply %d decode' % size,
+                   lambda _rb=_rb: Read.decode(Direction.REPLY, _rb)))
+        _c.append(('read reply %d encode' % size,
+                   lambda _rep=_rep: Read.encode(Direction.REPLY, _rep)))
+        _req = {'offset': 0, 'file_id': (1, 2), 'flags': 0, 'data': bytes(size)}
+        _wb = memoryview(Write.encode(Direction.REQUEST, _req))
+        _c.append(('write request %d decode' % size,
+                   lambda _wb=_wb: Write.decode(Direction.REQUEST, _wb)))
+        _c.append(('write request %d encode' % size,
+                   lambda _req=_req: Write.encode(Direction.REQUEST, _req)))
+    _hrep = {'data_remaining': 0, 'data_length': 65536}
+    _c.append(('read reply header encode',
+               lambda: Read.encode(Direction.REPLY, _hrep)))
+
+    # Directory listings
+    _dic = DirInfoClass.FILE_ID_FULL_INFORMATION
+    for num in [100, 1000]:
+        _entries = dir_entries(num)
+        _db = memoryview(DirInfo.encode(_dic, _entries))
+        _c.append(('dir info %d decode' % num,
+                   lambda _db=_db: DirInfo.decode(_dic, _db)))
+        _c.append(('dir info %d batch encode' % num,
+                   lambda _e=_entries: DirInfo.encode_batch(_dic, iter(_e), 1 << 20, 8)))
+
+    # File and file system info classes
+    for cls, infos in [(FileInfo, FILE_INFOS), (FSInfo, FS_INFOS)]:
+        for c, buf in infos:
+            _b = memoryview(buf)
+            _i = dict(cls.decode(c, _b))
+            _name = c.name.lower().replace('_information', '').replace('_', ' ')
+            _name = ('file info ' if cls is FileInfo else 'fs info ') + _name
+            _c.append((_name + ' decode', lambda cls=cls, c=c, _b=_b: cls.decode(c, _b)))
+            _c.append((_name + ' encode', lambda cls=cls, c=c, _i=_i: cls.encode(c, _i)))
+
+    return _c
+
+def _number(func):
+    """
+    The number of calls that take at least MIN_TIME
+    """
+    _n = 1
+    while timeit.timeit(func, number=_n) < MIN_TIME:
+        _n = _n * 2
+    return _n
+
+def measure(func, cal, cal_n):
+    """
+    Returns ops/s, the ops/s relative to the calibration loop cal, that
+    runs cal_n times per repeat, and the peak number of bytes allocated
+    by one call. The calibration loop is timed next to every repeat, so
+    that changes in the speed of the machine while we run cancel out.
+    """
+    _n = _number(func)
+    _ops = []
+    _rel = []
+    for _ in range(REPEAT):
+        _c = cal_n / timeit.timeit(cal, number=cal_n)
+        _o = _n / timeit.timeit(func, number=_n)
+        _ops.append(_o)
+        _rel.append(_o / _c)
+
+    # Once to fill any caches, then measure the next call
+    tracemalloc.start()
+    func()
+    tracemalloc.reset_peak()
+    _base = tracemalloc.get_traced_memory()[0]
+    func()
+    _peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return max(_ops), statistics.median(_rel), _peak - _base
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the smb2 codecs')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='percent a codec may regress (default %d)' % THRESHOLD)
+    parser.add_argument('--baselines', default=BASELINES,
+                        help='JSON file with the baselines')
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the new baselines')
+    parser.add_argument('names', nargs='*',
+                        help='only run the codecs with one of these in their name')
+    args = parser.parse_args()
+
+    _baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            _baselines = json.load(f)
+
+    _cal_n = _number(calibration)
+
+    _results = {}
+    _regressions = []
+    _new = []
+    print('%-34s %12s %10s %10s %8s %10s %10s' % ('codec', 'ops/s', 'relative',
+                                                  'baseline', 'change',
+                                                  'bytes', 'baseline'))
+    for name, func in codecs():
+        if args.names and not [n for n in args.names if n in name]:
+            continue
+        _ops, _rel, _bytes = measure(func, calibration, _cal_n)
+        _results[name] = {'relative': round(_rel, 4), 'bytes': _bytes}
+
+        _base = _baselines.get(name)
+        if not _base or 'relative' not in _base:
+            _new.append(name)
+            print('%-34s %12.0f %10.4f %10s %8s %10d %10s' % (name, _ops, _rel,
+                                                              '-', 'new',
+                                                              _bytes, '-'))
+            continue
+        _change = (_rel - _base['relative']) * 100 / _base['relative']
+        _mark = ''
+        if _change < -args.threshold:
+            _mark = ' SLOWER'
+        if _bytes > _base['bytes'] * (1 + args.threshold / 100) + SLACK_BYTES:
+            _mark = _mark + ' ALLOCATES MORE'
+        if _mark:
+            _regressions.append(name)
+        print('%-34s %12.0f %10.4f %10.4f %7.1f%% %10d %10d%s' % (name, _ops, _rel,
+                                                                _base['relative'],
+                                                                _change, _bytes,
+                                                                _base['bytes'], _mark))
+
+    if args.save:
+        _baselines.update(_results)
+        with open(args.baselines, 'w') as f:
+            json.dump(_baselines, f, indent=4, sort_keys=True)
+            f.write('\n')
+        print('Saved baselines to', args.baselines)
+        return
+
+    if _new:
+        print('%d codecs have no baseline, record them with --save' % len(_new))
+        sys.exit(1)
+
+    if _regressions:
+        print('%d codecs regressed by more than %g%%:' % (len(_regressions),
+                                                          args.threshold))
+        for name in _regressions:
+            print('   ', name)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
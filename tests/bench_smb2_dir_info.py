@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+#
+# Microbenchmark: FILE_ID_FULL_DIR_INFORMATION entries encoded per second
+# while listing a 1M entry directory in Query Directory sized replies,
+# one entry at a time and in batches with and without numpy.
+#
+# Run from the tests directory:
+#   PYTHONPATH=.. python bench_smb2_dir_info.py [entries]
+#
+
+import sys
+import time
+
+import smb2.dir_info
+import smb2.unicode
+from smb2.dir_info import DirInfo, DirInfoClass
+
+ENTRIES = 1000000
+# What Windows clients ask for
+OUTPUT_BUFFER_LENGTH = 65536
+# Make the entries in chunks, to keep the memory use down
+CHUNK = 100000
+
+DIC = DirInfoClass.FILE_ID_FULL_INFORMATION
+
+
+def make_entries(start, num):
+    # What File.scandir() makes for each entry
+    return [{'file_index': 0,
+             'creation_time': (0, 0, 0),
+             'last_access_time': (1600000000 + i, 0, 0),
+             'last_write_time': (1600000000 + i, 0, 0),
+             'change_time': (1600000000 + i, 0, 0),
+             'end_of_file': i * 100,
+             'allocation_size': i * 100,
+             'file_attributes': 0x220,
+             'ea_size': 0,
+             'file_id': 1000000 + i,
+             'file_name': b'file-%07d.dat' % i}
+            for i in range(start, start + num)]
+
+def per_entry(entries):
+    # A reply built by concatenating one encoded entry at a time
+    _pos = 0
+    while _pos < len(entries):
+        _b = bytearray(8)
+        while _pos < len(entries):
+            _i = DirInfo.encode_single(DIC, entries[_pos])
+            if len(_b) - 8 + len(_i) > OUTPUT_BUFFER_LENGTH:
+                break
+            _b = _b + _i
+            _pos = _pos + 1
+
+def sized(entries):
+    # Each entry sized first, then encoded into a buffer of the right size
+    _pos = 0
+    while _pos < len(entries):
+        _num = 0
+        _size = 0
+        while _pos + _num < len(entries):
+            _len = DirInfo.encoded_size_single(DIC, entries[_pos + _num])
+            if _size + _len > OUTPUT_BUFFER_LENGTH:
+                break
+            _size = _size + _len
+            _num = _num + 1
+        _b = bytearray(8 + _size)
+        DirInfo.encode_into(DIC, _b, 8, entries[_pos:_pos + _num])
+        _pos = _pos + _num
+
+def batch(entries):
+    _pos = 0
+    while _pos < len(entries):
+        # As srv_query_dir() does it, from a generator over the entries
+        _b, _num = DirInfo.encode_batch(DIC, (entries[i] for i in
+                                              range(_pos, len(entries))),
+                                        OUTPUT_BUFFER_LENGTH, 8)
+        _pos = _pos + _num
+
+def run(func, entries):
+    smb2.unicode._path_cache.clear()
+    _t = 0
+    for _start in range(0, entries, CHUNK):
+        _e = make_entries(_start, min(CHUNK, entries - _start))
+        _s = time.perf_counter()
+        func(_e)
+        _t = _t + time.perf_counter() - _s
+    return entries / _t
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else ENTRIES
+    _benches = [('per entry', per_entry, False),
+                ('sized', sized, False),
+                ('batch', batch, False)]
+    if smb2.dir_info.numpy:
+        _benches.append(('batch numpy', batch, True))
+    else:
+        print('numpy is not installed, skipping the numpy backend')
+
+    print('%d entries, %d byte replies' % (entries, OUTPUT_BUFFER_LENGTH))
+    print('%-12s %14s' % ('encoder', 'entries/s'))
+    for name, func, use_numpy in _benches:
+        smb2.dir_info.USE_NUMPY = use_numpy
+        print('%-12s %14.0f' % (name, run(func, entries)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+#
+# Microbenchmark: SMB2 headers decoded and encoded per second, for sync and
+# async requests and replies.
+#
+# Run from the tests directory:
+#   PYTHONPATH=.. python bench_smb2_header.py
+#
+
+import timeit
+
+from smb2.header import *
+
+HEADERS = {
+    'sync request': {'protocol_id': SMB2_MAGIC,
+                     'credit_charge': 1,
+                     'channel_sequence': 0,
+                     'command': Command.READ.value,
+                     'credit_request': 256,
+                     'flags': 0,
+                     'message_id': 1234,
+                     'process_id': 0xfeff,
+                     'tree_id': 5,
+                     'session_id': 0x1122334455667788},
+    'sync reply': {'protocol_id': SMB2_MAGIC,
+                   'credit_charge': 1,
+                   'status': Status.SUCCESS.value,
+                   'command': Command.READ.value,
+                   'credit_response': 256,
+                   'flags': RESPONSE | SIGNED,
+                   'message_id': 1234,
+                   'process_id': 0xfeff,
+                   'tree_id': 5,
+                   'session_id': 0x1122334455667788,
+                   'signature': bytes(range(16))},
+    'async reply': {'protocol_id': SMB2_MAGIC,
+                    'credit_charge': 1,
+                    'status': Status.PENDING.value,
+                    'command': Command.READ.value,
+                    'credit_response': 1,
+                    'flags': RESPONSE | ASYNC,
+                    'message_id': 1234,
+                    'async_id': 7,
+                    'session_id': 0x1122334455667788},
+    }
+NUMBER = 100000
+
+
+def main():
+    print('%-14s %14s %14s' % ('header', 'decode/s', 'encode/s'))
+    for name, hdr in HEADERS.items():
+        buf = Header.encode(hdr)
+        _d = min(timeit.repeat(lambda: Header.decode(buf),
+                               number=NUMBER, repeat=3))
+        _e = min(timeit.repeat(lambda: Header.encode(hdr),
+                               number=NUMBER, repeat=3))
+        print('%-14s %14.0f %14.0f' % (name, NUMBER / _d, NUMBER / _e))
+
+if __name__ == "__main__":
+    main()
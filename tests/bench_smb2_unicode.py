@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+#
+# Microbenchmark: UTF8 <-> UTF16-LE name conversion, for 255 character
+# names and for the names of a 100k entry directory listing, against the
+# per code point converters smb2.unicode used to have.
+#
+# Run from the tests directory:
+#   PYTHONPATH=.. python bench_smb2_unicode.py
+#
+
+import struct
+import timeit
+
+from smb2.unicode import UCS2toPath, PathtoUCS2, UTF8toUCS2Len
+import smb2.unicode
+
+NUMBER = 10000
+ENTRIES = 100000
+
+#
+# The previous converters. They only get BMP characters of up to two
+# UTF8 bytes right, so they are only timed on those.
+#
+def old_UCS2toUTF8(ucs2):
+    def ucs2_to_utf8(cp):
+        if cp > 0x07ff:
+            return struct.pack('<BBB', 0xe0 | (cp >> 12),
+                               0x80 | ((cp >> 6) & 0xbf),
+                               0x80 | (cp & 0xbf))
+        if cp > 0x007f:
+            return struct.pack('<BB', 0xc0 | (cp >> 6), 0x80 | (cp & 0xbf))
+        return struct.pack('<B', cp)
+
+    u = struct.unpack_from('<' + 'H' * (len(ucs2) >> 1), ucs2, 0)
+    utf8 = bytearray(0)
+    for cp in u:
+        utf8 = utf8 + ucs2_to_utf8(cp)
+    return utf8
+
+def old_UTF8toUCS2(utf8):
+    ucs2 = bytearray(0)
+    while len(utf8):
+        if utf8[0] & 0x80 == 0:
+            ucs2 = ucs2 + struct.pack('<H', utf8[0])
+            utf8 = utf8[1:]
+        else:
+            ucs2 = ucs2 + struct.pack('<H', ((utf8[0] & 0x1f) << 6) |
+                                      (utf8[1] & 0x3f))
+            utf8 = utf8[2:]
+    return ucs2
+
+def old_UTF8toUCS2Len(utf8):
+    if utf8.isascii():
+        return len(utf8) * 2
+    return len(old_UTF8toUCS2(utf8))
+
+NAMES = {
+    'ascii': ('x' * 255, True),
+    'latin': ('é' * 255, True),
+    'cjk': ('日' * 255, False),
+    'astral': ('\U0001f600' * 127 + 'x', False),
+    }
+
+
+def listing(names, size, encode):
+    # What a QUERY_DIRECTORY does for each entry: size it, then encode it
+    _n = 0
+    for name in names:
+        _n = _n + size(name)
+        encode(name)
+    return _n
+
+def main():
+    print('%-8s %14s %14s %14s %14s' % ('name', 'old decode/s', 'decode/s',
+                                        'old encode/s', 'encode/s'))
+    for label, (name, old) in NAMES.items():
+        utf8 = name.encode('utf-8')
+        ucs2 = name.encode('utf-16-le')
+        view = memoryview(ucs2)
+        _d = min(timeit.repeat(lambda: UCS2toPath(view), number=NUMBER, repeat=3))
+        # Without the cache, as for names seen only once
+        _e = min(timeit.repeat(lambda: (PathtoUCS2(utf8), smb2.unicode._path_cache.clear()),
+                               number=NUMBER, repeat=3))
+        if old:
+            _od = min(timeit.repeat(lambda: old_UCS2toUTF8(view).replace(b'\\', b'/'),
+                                    number=NUMBER // 10, repeat=3)) * 10
+            _oe = min(timeit.repeat(lambda: old_UTF8toUCS2(utf8).replace(b'/', b'\\'),
+                                    number=NUMBER // 10, repeat=3)) * 10
+            print('%-8s %14.0f %14.0f %14.0f %14.0f' % (label, NUMBER / _od, NUMBER / _d,
+                                                        NUMBER / _oe, NUMBER / _e))
+        else:
+            print('%-8s %14s %14.0f %14s %14.0f' % (label, '-', NUMBER / _d,
+                                                    '-', NUMBER / _e))
+
+    print()
+    print('%d entry listing' % ENTRIES)
+    for label, fmt in [('ascii', 'file-%06d.txt'), ('latin', 'fïchier-%06d.txt')]:
+        names = [(fmt % i).encode('utf-8') for i in range(ENTRIES)]
+        _o = timeit.timeit(lambda: listing(names, old_UTF8toUCS2Len,
+                                           lambda n: old_UTF8toUCS2(n).replace(b'/', b'\\')),
+                           number=1)
+        smb2.unicode._path_cache.clear()
+        _c = timeit.timeit(lambda: listing(names, UTF8toUCS2Len, PathtoUCS2), number=1)
+        # A second listing of a directory that fits in the cache
+        names = names[:smb2.unicode._CACHE_SIZE]
+        listing(names, UTF8toUCS2Len, PathtoUCS2)
+        _w = timeit.timeit(lambda: listing(names, UTF8toUCS2Len, PathtoUCS2), number=1)
+        print('%-8s old %10.0f names/s, new %10.0f names/s, cached %10.0f names/s' %
+              (label, ENTRIES / _o, ENTRIES / _c, len(names) / _w))
+
+if __name__ == "__main__":
+    main()
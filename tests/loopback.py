@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+#
+# Helpers to run the server on the loopback interface from the benchmarks,
+# or in this process without any socket.
+# The server needs a server/config.py, the share list and port from it are
+# overridden here.
+#
+
+import asyncio
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'server'))
+
+from config import Config
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _run(port, settings):
+    from async_server import serve
+    from main import run_master
+
+    # The server logs every connection, keep the benchmark output readable
+    sys.stdout = open(os.devnull, 'w')
+    for k, v in settings.items():
+        setattr(Config, k, v)
+    if Config.workers > 1:
+        run_master('127.0.0.1', port, Config.workers)
+    else:
+        asyncio.run(serve('127.0.0.1', port))
+
+def _settings(share, settings):
+    settings.update({'shares': {'Share': share},
+                     'guest_login': True,
+                     'signing_required': False})
+    return settings
+
+def start_server(share, **settings):
+    """
+    Start a server for 'share' in a child process and wait until it accepts
+    connections. Any keyword argument overrides the matching Config value.
+    """
+    settings.setdefault('workers', 1)
+    _settings(share, settings)
+    port = free_port()
+    p = multiprocessing.get_context('fork').Process(target=_run,
+                                                    args=(port, settings),
+                                                    daemon=True)
+    p.start()
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return p, port
+
+async def memory_client(share, **settings):
+    """
+    Connect a Client to a Server for 'share' that runs in this process and
+    event loop, over a MemoryTransport instead of a socket. Any keyword
+    argument overrides the matching Config value, for this whole process.
+    """
+    from server import Server
+    from transport import MemoryTransport
+    from smb2_client import Client
+
+    for k, v in _settings(share, settings).items():
+        setattr(Config, k, v)
+    t = MemoryTransport()
+    t.srv = Server(t)
+    c = Client(t.reader, t)
+    await c.login('localhost')
+    return c
+
+def raise_fd_limit():
+    try:
+        import resource
+        _s, _h = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (_h, _h))
+    except (ImportError, ValueError):
+        True
+
+async def _clients(port, num, start, duration, func):
+    from smb2_client import Client
+
+    async def _client():
+        c = await Client.connect('127.0.0.1', port)
+        ops = await func(c, time.monotonic() + duration)
+        c.close_connection()
+        return ops
+
+    await asyncio.sleep(max(start - time.time(), 0))
+    return sum(await asyncio.gather(*[_client() for _ in range(num)]))
+
+def _client_process(port, num, start, duration, func, q):
+    raise_fd_limit()
+    q.put(asyncio.run(_clients(port, num, start, duration, func)))
+
+def run_clients(port, clients, duration, func, processes=None):
+    """
+    Run 'clients' concurrent connections spread over a number of client
+    processes. func(client, deadline) is a coroutine that drives one
+    connection until the deadline and returns the number of operations it
+    completed. Returns the aggregate operations per second.
+    """
+    ctx = multiprocessing.get_context('fork')
+    q = ctx.Queue()
+    _np = min(processes or max(os.cpu_count() // 2, 1), clients)
+    start = time.time() + 1.0
+    procs = []
+    for i in range(_np):
+        _n = clients // _np + (1 if i < clients % _np else 0)
+        p = ctx.Process(target=_client_process,
+                        args=(port, _n, start, duration, func, q))
+        p.start()
+        procs.append(p)
+    ops = sum([q.get() for _ in procs])
+    for p in procs:
+        p.join()
+    return ops / duration
@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+#
+# A minimal asyncio SMB2 client built on top of the smb2/ codecs.
+# It is only used to drive the server from the benchmarks and only
+# supports guest sessions without signing. Replies are matched to their
+# requests by message id, so one connection can have many requests in
+# flight, and lease and oplock breaks are acknowledged as they arrive.
+#
+
+import asyncio
+import struct
+
+from smb2.header import *
+from smb2.negotiate_protocol import *
+from smb2.session_setup import *
+from smb2.tree_connect import *
+from smb2.create import *
+from smb2.close import *
+from smb2.read import *
+from smb2.write import *
+from smb2.flush import *
+from smb2.query_info import *
+from smb2.set_info import *
+from smb2.query_directory import *
+from smb2.file_info import *
+from smb2.dir_info import *
+from smb2.oplock_break import *
+
+
+class Client(object):
+    """
+    A class for a SMB2 client connection
+    """
+
+    def __init__(self, reader, writer, **kwargs):
+        self._r = reader
+        self._w = writer
+        self._message_id = 0
+        self.session_id = 0
+        self.tree_id = 0
+        # message id -> future of the reply
+        self._replies = {}
+        # message id -> async id, of the requests that went async
+        self.async_ids = {}
+        self._reader = None
+        # The lease state of every lease key and the oplock level of
+        # every file id, as the server granted and then broke them
+        self.leases = {}
+        self.oplocks = {}
+        # Called with every decoded break before it is acknowledged,
+        # it may return a coroutine that is awaited first
+        self.on_break = None
+
+    @staticmethod
+    async def connect(host, port, share='Share'):
+        """
+        Connect, negotiate, log in as guest and connect to the share
+        """
+        reader, writer = await asyncio.open_connection(host, port)
+        c = Client(reader, writer)
+        await c.login(host, share)
+        return c
+
+    async def login(self, host, share='Share'):
+        """
+        Negotiate, log in as guest and connect to the share
+        """
+        await self.negotiate()
+        await self.session_setup()
+        await self.tree_connect(host, share)
+
+    def close_connection(self):
+        self._w.close()
+        if self._reader:
+            self._reader.cancel()
+
+    def _encode(self, command, body, credit_charge=1):
+        hdr = Header.encode({'protocol_id': SMB2_MAGIC,
+                             'credit_charge': credit_charge,
+                             'channel_sequence': 0,
+                             'command': command.value,
+                             'credit_request': 256,
+                             'flags': 0,
+                             'message_id': self._message_id,
+                             'process_id': 0xfeff,
+                             'tree_id': self.tree_id,
+                             'session_id': self.session_id})
+        self._message_id = self._message_id + max(credit_charge, 1)
+        spl = bytearray(4)
+        struct.pack_into('>I', spl, 0, len(hdr) + len(body))
+        return spl + hdr + body
+
+    async def _read_replies(self):
+        try:
+            while True:
+                spl = await self._r.readexactly(4)
+                buf = await self._r.readexactly(struct.unpack_from('>I', spl, 0)[0])
+                hdr = Header.decode(buf[:64])
+                if hdr['message_id'] == 0xffffffffffffffff:
+                    self._break(buf[64:])
+                    continue
+                # Skip interim responses, the final reply follows later
+                if hdr['status'] == Status.PENDING.value:
+                    self.async_ids[hdr['message_id']] = hdr['async_id']
+                    continue
+                self.async_ids.pop(hdr['message_id'], None)
+                _f = self._replies.pop(hdr['message_id'], None)
+                if _f and not _f.done():
+                    _f.set_result((hdr, buf[64:]))
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            for _f in self._replies.values():
+                if not _f.done():
+                    _f.set_exception(e)
+            self._replies = {}
+
+    def _break(self, buf):
+        b = OplockBreak.decode(Direction.REPLY, buf)
+        if 'lease_key' in b:
+            self.leases[bytes(b.lease_key)] = b.new_lease_state
+            if not b.flags & SMB2_NOTIFY_BREAK_LEASE_FLAG_ACK_REQUIRED:
+                _ack = None
+            else:
+                _ack = {'lease_key': b.lease_key,
+                        'lease_state': b.new_lease_state}
+        else:
+            # Only breaks from exclusive and batch oplocks are acknowledged
+            _ack = None
+            if self.oplocks.get(b.file_id) in (Oplock.LEVEL_EXCLUSIVE.value,
+                                               Oplock.LEVEL_BATCH.value):
+                _ack = {'oplock_level': b.oplock_level,
+                        'file_id': b.file_id}
+            self.oplocks[b.file_id] = b.oplock_level
+        asyncio.ensure_future(self._ack_break(b, _ack))
+
+    async def _ack_break(self, b, ack):
+        if self.on_break:
+            _r = self.on_break(b)
+            if asyncio.iscoroutine(_r):
+                await _r
+        if ack:
+            await self.request(Command.OPLOCK_BREAK,
+                               OplockBreak.encode(Direction.REQUEST, ack))
+
+    async def request(self, command, body, credit_charge=1):
+        """
+        Send a single command and wait for its reply
+        """
+        _f = asyncio.get_running_loop().create_future()
+        self._replies[self._message_id] = _f
+        self._w.write(self._encode(command, body, credit_charge))
+        if not self._reader:
+            self._reader = asyncio.ensure_future(self._read_replies())
+        return await _f
+
+    def cancel(self, message_id):
+        """
+        Cancel the request with message_id, by its async id once it went
+        async. A CANCEL takes no credits and gets no reply of its own.
+        """
+        _aid = self.async_ids.get(message_id)
+        hdr = Header.encode({'protocol_id': SMB2_MAGIC,
+                             'credit_charge': 0,
+                             'channel_sequence': 0,
+                             'command': Command.CANCEL.value,
+                             'credit_request': 0,
+                             'flags': ASYNC if _aid else 0,
+                             'message_id': message_id,
+                             'async_id': _aid,
+                             'process_id': 0xfeff,
+                             'tree_id': self.tree_id,
+                             'session_id': self.session_id})
+        body = struct.pack('<HH', 4, 0)
+        spl = bytearray(4)
+        struct.pack_into('>I', spl, 0, len(hdr) + len(body))
+        self._w.write(spl + hdr + body)
+
+    async def negotiate(self):
+        hdr, buf = await self.request(Command.NEGOTIATE_PROTOCOL,
+                NegotiateProtocol.encode(Direction.REQUEST,
+                                         {'security_mode': 0,
+                                          'capabilities': 0,
+                                          'client_guid': bytes(16),
+                                          'dialects': [VERSION_0302]}))
+        return NegotiateProtocol.decode(Direction.REPLY, buf)
+
+    async def session_setup(self):
+        # The server falls back to a guest login when authentication fails
+        hdr, buf = await self.request(Command.SESSION_SETUP,
+                SessionSetup.encode(Direction.REQUEST,
+                                    {'flags': 0,
+                                     'security_mode': 0,
+                                     'capabilities': 0,
+                                     'security_buffer': bytes(16)}))
+        self.session_id = hdr['session_id']
+
+    async def tree_connect(self, host, share):
+        hdr, buf = await self.request(Command.TREE_CONNECT,
+                TreeConnect.encode(Direction.REQUEST,
+                                   {'path': bytes('//' + host + '/' + share,
+                                                  encoding='utf-8')}))
+        self.tree_id = hdr['tree_id']
+
+    async def create(self, path, disposition=Disposition.OPEN,
+                     create_options=0,
+                     desired_access=FILE_GENERIC_READ | FILE_GENERIC_WRITE,
+                     oplock_level=Oplock.LEVEL_NONE, lease_key=None,
+                     lease_state=0, parent_lease_key=None):
+        """
+        Returns the file id. With a lease_key we ask for a lease of
+        lease_state, what we get is in leases, otherwise for an oplock
+        of oplock_level, what we get is in oplocks. parent_lease_key is
+        the key of our lease on the directory the file is in.
+        """
+        if create_options & FILE_DIRECTORY_FILE:
+            desired_access = FILE_GENERIC_READ
+        contexts = {}
+        if lease_key is not None:
+            oplock_level = Oplock.LEVEL_LEASE
+            contexts.update({'RqLs': {'lease_key': lease_key,
+                                      'lease_state': lease_state}})
+            if parent_lease_key is not None:
+                contexts['RqLs'].update({'lease_flags': SMB2_LEASE_FLAG_PARENT_LEASE_KEY_SET,
+                                         'parent_lease_key': parent_lease_key,
+                                         'epoch': 0})
+        hdr, buf = await self.request(Command.CREATE,
+                Create.encode(Direction.REQUEST,
+                              {'requested_oplock_level': oplock_level.value,
+                               'impersonation_level': Impersonation.IMPERSONATION.value,
+                               'desired_access': desired_access,
+                               'file_attributes': 0,
+                               'share_access': FILE_SHARE_READ | FILE_SHARE_WRITE,
+                               'create_disposition': disposition.value,
+                               'create_options': create_options,
+                               'path': bytes(path, encoding='utf-8'),
+                               'contexts': contexts}))
+        if hdr['status'] != Status.SUCCESS.value:
+            raise OSError(hdr['status'], 'Create failed')
+        rep = Create.decode(Direction.REPLY, buf)
+        if 'RqLs' in rep.contexts:
+            self.leases[bytes(lease_key)] = rep.contexts['RqLs']['lease_state']
+        elif rep.oplock_level != Oplock.LEVEL_NONE.value:
+            self.oplocks[rep.file_id] = rep.oplock_level
+        return rep.file_id
+
+    async def close(self, file_id):
+        self.oplocks.pop(file_id, None)
+        await self.request(Command.CLOSE,
+                Close.encode(Direction.REQUEST,
+                             {'flags': 0,
+                              'file_id': file_id}))
+
+    async def read(self, file_id, offset, length):
+        hdr, buf = await self.request(Command.READ,
+                Read.encode(Direction.REQUEST,
+                            {'flags': 0,
+                             'length': length,
+                             'offset': offset,
+                             'file_id': file_id,
+                             'minimum_count': 0,
+                             'channel': 0,
+                             'remaining_bytes': 0}),
+                credit_charge=(length + 65535) // 65536)
+        if hdr['status'] != Status.SUCCESS.value:
+            return b''
+        return Read.decode(Direction.REPLY, buf).get('data', b'')
+
+    async def write(self, file_id, offset, data):
+        hdr, buf = await self.request(Command.WRITE,
+                Write.encode(Direction.REQUEST,
+                             {'offset': offset,
+                              'file_id': file_id,
+                              'flags': 0,
+                              'data': data}),
+                credit_charge=(len(data) + 65535) // 65536)
+        if hdr['status'] != Status.SUCCESS.value:
+            return 0
+        return Write.decode(Direction.REPLY, buf)['count']
+
+    async def flush(self, file_id):
+        await self.request(Command.FLUSH,
+                Flush.encode(Direction.REQUEST,
+                             {'file_id': file_id}))
+
+    async def query_info(self, file_id, info_class=FileInfoClass.ALL_INFORMATION):
+        hdr, buf = await self.request(Command.QUERY_INFO,
+                QueryInfo.encode(Direction.REQUEST,
+                                 {'info_type': SMB2_0_INFO_FILE,
+                                  'file_info_class': info_class.value,
+                                  'output_buffer_length': 4096,
+                                  'flags': 0,
+                                  'file_id': file_id}))
+        return QueryInfo.decode(Direction.REPLY, buf)
+
+    async def set_info(self, file_id, info_class, info):
+        hdr, buf = await self.request(Command.SET_INFO,
+                SetInfo.encode(Direction.REQUEST,
+                               {'info_type': SMB2_0_INFO_FILE,
+                                'file_info_class': info_class.value,
+                                'file_id': file_id,
+                                'buffer': FileInfo.encode(info_class, info)}))
+        return hdr['status']
+
+    async def query_directory(self, file_id, pattern='*', flags=0,
+                              output_buffer_length=65536):
+        """
+        Returns a list of entries, or None once there are no more files
+        """
+        hdr, buf = await self.request(Command.QUERY_DIRECTORY,
+                QueryDirectory.encode(Direction.REQUEST,
+                                      {'info_class': DirInfoClass.FILE_ID_FULL_INFORMATION.value,
+                                       'flags': flags,
+                                       'file_index': 0,
+                                       'file_id': file_id,
+                                       'output_buffer_length': output_buffer_length,
+                                       'name': bytes(pattern, encoding='utf-8')}))
+        if hdr['status'] != Status.SUCCESS.value:
+            return None
+        return DirInfo.decode(DirInfoClass.FILE_ID_FULL_INFORMATION,
+                              QueryDirectory.decode(Direction.REPLY, buf)['data'])
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import asyncio
+import os
+import tempfile
+
+if not os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   '..', 'server', 'config.py')):
+    print('No server/config.py, skipping the Cancel server tests')
+    exit(0)
+
+from loopback import memory_client
+from smb2.header import Status
+from smb2.create import Disposition
+from smb2.create import SMB2_LEASE_READ_CACHING, SMB2_LEASE_WRITE_CACHING
+from smb2.create import SMB2_LEASE_HANDLE_CACHING
+
+RWH = SMB2_LEASE_READ_CACHING | SMB2_LEASE_WRITE_CACHING | \
+    SMB2_LEASE_HANDLE_CACHING
+
+async def blocked_open(holder, c, name, key):
+    """
+    Start an open of name by c that waits for a lease break that the
+    holder never acknowledges. Returns the file id of the holder and the
+    message id and task of the open.
+    """
+    fid = await holder.create(name, disposition=Disposition.OPEN_IF,
+                              lease_key=key, lease_state=RWH)
+    if holder.leases[key] != RWH:
+        print('No write lease for the holder')
+        exit(1)
+    mid = c._message_id
+    return fid, mid, asyncio.ensure_future(c.create(name))
+
+async def cancelled(task):
+    try:
+        await task
+    except OSError as e:
+        return e.args[0] == Status.CANCELLED.value
+    return False
+
+async def run(share):
+    holder = await memory_client(share, leases=True, lease_break_timeout=3600)
+
+    async def _never_ack(b):
+        await asyncio.sleep(3600)
+    holder.on_break = _never_ack
+
+    print('Cancel a pending request by its async id #1')
+    c = await memory_client(share, pending_timeout=0.01)
+    _, mid, task = await blocked_open(holder, c, 'file1', b'lease-key-000001')
+    while mid not in c.async_ids:
+        await asyncio.sleep(0.01)
+    c.cancel(mid)
+    if not await cancelled(task):
+        print('The request was not cancelled')
+        exit(1)
+
+    print('Cancel a request before it goes async #2')
+    c = await memory_client(share, pending_timeout=3600)
+    _, mid, task = await blocked_open(holder, c, 'file2', b'lease-key-000002')
+    await asyncio.sleep(0.1)
+    c.cancel(mid)
+    if not await cancelled(task):
+        print('The request was not cancelled')
+        exit(1)
+
+    print('Keep the connection after a cancel #3')
+    fid = await c.create('file3', disposition=Disposition.OPEN_IF)
+    await c.close(fid)
+
+    print('Ignore a cancel of a request that is not running #4')
+    c.cancel(mid)
+    fid = await c.create('file3')
+    await c.close(fid)
+    c.close_connection()
+    holder.close_connection()
+
+    print('Grant a write lease again after a cancelled open #5')
+    holder = await memory_client(share, pending_timeout=0.01)
+    acked = asyncio.Event()
+    async def _ack_later(b):
+        await acked.wait()
+    holder.on_break = _ack_later
+    c = await memory_client(share)
+    fid, mid, task = await blocked_open(holder, c, 'file4', b'lease-key-000004')
+    while mid not in c.async_ids:
+        await asyncio.sleep(0.01)
+    c.cancel(mid)
+    if not await cancelled(task):
+        print('The request was not cancelled')
+        exit(1)
+    acked.set()
+    await asyncio.sleep(0.1)
+    await holder.close(fid)
+    await c.create('file4', lease_key=b'lease-key-000005', lease_state=RWH)
+    if c.leases[b'lease-key-000005'] != RWH:
+        print('The cancelled open is still counted')
+        exit(1)
+    c.close_connection()
+    holder.close_connection()
+
+def main():
+    with tempfile.TemporaryDirectory() as share:
+        asyncio.run(asyncio.wait_for(run(share), 30))
+
+
+if __name__ == "__main__":
+    main()
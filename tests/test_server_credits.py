@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import asyncio
+import os
+import tempfile
+
+if not os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   '..', 'server', 'config.py')):
+    print('No server/config.py, skipping the Credit tests')
+    exit(0)
+
+from loopback import memory_client
+from config import Config
+from credits import Credits, counters
+
+
+def hdr(mid, charge=1, request=1):
+    return {'message_id': mid, 'credit_charge': charge, 'credit_request': request}
+
+def consume_fails(c, h):
+    try:
+        c.consume(h)
+    except ValueError:
+        return True
+    return False
+
+def check(name, value, expected):
+    if value != expected:
+        print(name, value, 'expected', expected)
+        exit(1)
+
+async def cancel_consumed(share):
+    c = await memory_client(share)
+    srv = c._w.srv
+    _stats = srv.credits.stats()
+    # The tree connect had message id 2
+    c.cancel(2)
+    await asyncio.sleep(0.1)
+    check('Credits after a cancel', srv.credits.stats(), _stats)
+    await c.negotiate()
+    c.close_connection()
+
+def main():
+    Config.max_credits = 8192
+    Config.busy_requests = 4096
+
+    print('Consume and grant single credits #1')
+    c = Credits()
+    check('Window', c.window(), 1)
+    c.consume(hdr(0))
+    check('Window', c.window(), 0)
+    check('Grant', c.grant(hdr(0, request=10)), 10)
+    check('Window', (c.low, c.high, c.window()), (1, 11, 10))
+    if not consume_fails(c, hdr(0)):
+        print('Consumed message id 0 twice')
+        exit(1)
+    if not consume_fails(c, hdr(11)):
+        print('Consumed a message id above the window')
+        exit(1)
+
+    print('Consume message ids out of order #2')
+    c.consume(hdr(5))
+    c.consume(hdr(3))
+    check('Low', c.low, 1)
+    c.consume(hdr(1))
+    c.consume(hdr(2))
+    c.consume(hdr(4))
+    check('Low', c.low, 6)
+    if not consume_fails(c, hdr(3)):
+        print('Consumed message id 3 twice')
+        exit(1)
+
+    print('Charge multi-credit requests #3')
+    c = Credits()
+    c.consume(hdr(0))
+    c.grant(hdr(0, request=64))
+    c.multi_credit = True
+    check('Charge ok', c.charge_ok(hdr(1, charge=1), 65536), True)
+    check('Charge ok', c.charge_ok(hdr(1, charge=1), 65537), False)
+    check('Charge ok', c.charge_ok(hdr(1, charge=2), 131072), True)
+    check('Charge ok', c.charge_ok(hdr(1, charge=0), 0), True)
+    c.consume(hdr(1, charge=4))
+    check('Window', (c.low, c.window(), c.inflight), (5, 60, 4))
+    # Every message id of the charge must be in the window
+    if not consume_fails(c, hdr(62, charge=4)):
+        print('Consumed message ids past the window')
+        exit(1)
+    check('Grant', c.grant(hdr(1, charge=4, request=4)), 4)
+    check('In flight', c.inflight, 0)
+
+    print('Only give back what was consumed while busy #4')
+    Config.busy_requests = 0
+    c = Credits()
+    c.consume(hdr(0))
+    c.grant(hdr(0, request=8))
+    c.consume(hdr(1))
+    c.consume(hdr(2))
+    _throttled = counters['throttled']
+    check('Grant', c.grant(hdr(1, request=100)), 1)
+    check('Throttled', counters['throttled'], _throttled + 1)
+    check('Grant', c.grant(hdr(2, request=100)), 100)
+    Config.busy_requests = 4096
+
+    print('Never grant more than max_credits #5')
+    Config.max_credits = 16
+    c = Credits()
+    c.consume(hdr(0))
+    check('Grant', c.grant(hdr(0, request=100)), 16)
+    c.consume(hdr(1))
+    check('Grant', c.grant(hdr(1, request=100)), 1)
+    check('Window', c.window(), 16)
+    Config.max_credits = 8192
+
+    print('Leave the credits alone on a cancel of a consumed id #6')
+    with tempfile.TemporaryDirectory() as share:
+        asyncio.run(asyncio.wait_for(cancel_consumed(share), 30))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import asyncio
+import os
+import tempfile
+
+if not os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   '..', 'server', 'config.py')):
+    print('No server/config.py, skipping the Directory lease server tests')
+    exit(0)
+
+from loopback import memory_client
+from smb2.create import Disposition, FILE_DIRECTORY_FILE
+from smb2.create import SMB2_LEASE_READ_CACHING, SMB2_LEASE_WRITE_CACHING
+from smb2.create import SMB2_LEASE_HANDLE_CACHING
+from smb2.file_info import FileInfoClass
+
+R = SMB2_LEASE_READ_CACHING
+W = SMB2_LEASE_WRITE_CACHING
+H = SMB2_LEASE_HANDLE_CACHING
+
+DIR_KEY = b'dir-lease-key-01'
+
+async def lease_dir(c):
+    """
+    Open dir under DIR_KEY, which gets the lease again once it was broken
+    """
+    fid = await c.create('dir', create_options=FILE_DIRECTORY_FILE,
+                         lease_key=DIR_KEY, lease_state=R | W | H)
+    # Never write caching on a directory
+    if c.leases[DIR_KEY] != R | H:
+        print('Wrong directory lease', c.leases[DIR_KEY])
+        exit(1)
+    return fid
+
+async def check_lease(c, expected):
+    # Breaks are not waited for, and acknowledged after the reply
+    await asyncio.sleep(0.1)
+    if c.leases[DIR_KEY] != expected:
+        print('Wrong directory lease', c.leases[DIR_KEY], 'expected', expected)
+        exit(1)
+
+async def delete(c, path):
+    fid = await c.create(path)
+    await c.set_info(fid, FileInfoClass.DISPOSITION_INFORMATION,
+                     {'delete_pending': 1})
+    await c.close(fid)
+
+async def run(share):
+    a = await memory_client(share, leases=True, dir_leases=True,
+                            lease_break_timeout=5)
+    b = await memory_client(share)
+    from dircache import dir_cache
+    from leases import counters
+    if not dir_cache().watching:
+        print('No inotify, no directory leases')
+        a.close_connection()
+        b.close_connection()
+        return
+    os.mkdir(os.path.join(share, 'dir'))
+
+    print('Grant a read and handle lease on a directory #1')
+    fa = await lease_dir(a)
+
+    print('Break it when another client creates an entry #2')
+    fb = await b.create('dir/file1', disposition=Disposition.CREATE)
+    await check_lease(a, 0)
+    await a.close(await lease_dir(a))
+
+    print('Break it when another client renames an entry #3')
+    await b.set_info(fb, FileInfoClass.RENAME_INFORMATION,
+                     {'replace_if_exists': 0, 'filename': 'dir/file2'})
+    await check_lease(a, 0)
+    await b.close(fb)
+    await a.close(await lease_dir(a))
+
+    print('Break it when another client deletes an entry #4')
+    await delete(b, 'dir/file2')
+    await check_lease(a, 0)
+    await a.close(await lease_dir(a))
+
+    print('Keep it for the changes made under the lease #5')
+    _breaks = counters['breaks']
+    f = await a.create('dir/file3', disposition=Disposition.CREATE,
+                       lease_key=b'lease-key-000003', lease_state=R | W | H,
+                       parent_lease_key=DIR_KEY)
+    await check_lease(a, R | H)
+    await a.write(f, 0, b'data')
+    await check_lease(a, R | H)
+    await a.set_info(f, FileInfoClass.RENAME_INFORMATION,
+                     {'replace_if_exists': 0, 'filename': 'dir/file4'})
+    await check_lease(a, R | H)
+    await a.set_info(f, FileInfoClass.DISPOSITION_INFORMATION,
+                     {'delete_pending': 1})
+    await a.close(f)
+    await check_lease(a, R | H)
+    if counters['breaks'] != _breaks or os.listdir(os.path.join(share, 'dir')):
+        print('Broke the lease of the client that made the change')
+        exit(1)
+
+    print('Still break it for the changes of other clients #6')
+    fb = await b.create('dir/file5', disposition=Disposition.CREATE)
+    await check_lease(a, 0)
+    await b.close(fb)
+    await a.close(fa)
+
+    a.close_connection()
+    b.close_connection()
+
+def main():
+    with tempfile.TemporaryDirectory() as share:
+        asyncio.run(asyncio.wait_for(run(share), 30))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import asyncio
+import os
+import tempfile
+
+if not os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   '..', 'server', 'config.py')):
+    print('No server/config.py, skipping the Directory cache tests')
+    exit(0)
+
+from loopback import memory_client
+from config import Config
+from dircache import DirCache, dir_cache, counters
+from smb2.create import Disposition, FILE_DIRECTORY_FILE
+from smb2.file_info import FileInfoClass
+
+async def evict(share):
+    Config.dir_cache_entries = 5
+    cache = DirCache()
+    cache.attach(asyncio.get_running_loop())
+    keys = []
+    fds = []
+    for name in ['d1', 'd2', 'd3']:
+        os.mkdir(os.path.join(share, name))
+        fds.append(os.open(os.path.join(share, name), os.O_RDONLY | os.O_DIRECTORY))
+        _st = os.fstat(fds[-1])
+        keys.append((_st.st_dev, _st.st_ino))
+
+    def _fill(i):
+        cache.put(keys[i], cache.watch(keys[i], fds[i]), [{}, {}])
+
+    _fill(0)
+    _fill(1)
+    # d1 is now used more recently than d2
+    cache.get(keys[0])
+    _evictions = counters['evictions']
+    _fill(2)
+    if cache.get(keys[1]) is not None or counters['evictions'] != _evictions + 1:
+        print('The least recently used directory was not evicted')
+        exit(1)
+    if cache.get(keys[0]) is None or cache.get(keys[2]) is None:
+        print('Evicted the wrong directory')
+        exit(1)
+    for fd in fds:
+        os.close(fd)
+    Config.dir_cache_entries = 100000
+
+async def listing(c, path=''):
+    """
+    The names and sizes in path, counting the cache hits
+    """
+    fid = await c.create(path, create_options=FILE_DIRECTORY_FILE)
+    entries = await c.query_directory(fid, pattern='')
+    await c.close(fid)
+    return {e.file_name: e.end_of_file for e in entries or []}
+
+async def cached_listing(c, path, expected):
+    _hits = counters['hits']
+    if await listing(c, path) != expected:
+        print('Wrong entries', await listing(c, path), 'expected', expected)
+        exit(1)
+    # Listed from the cache the second time
+    if await listing(c, path) != expected or counters['hits'] != _hits + 1:
+        print('The entries were not cached')
+        exit(1)
+
+async def invalidate(share):
+    c = await memory_client(share)
+    if not dir_cache().watching:
+        print('No inotify, the entries are not cached')
+        c.close_connection()
+        return
+    os.mkdir(os.path.join(share, 'dir'))
+    open(os.path.join(share, 'dir', 'a'), 'w').close()
+    await cached_listing(c, 'dir', {b'a': 0})
+    # Stop reading the inotify events, so that only what the server drops
+    # itself is seen
+    asyncio.get_running_loop().remove_reader(dir_cache()._fd)
+
+    print('Drop the entries when a file is created #3')
+    fid = await c.create('dir/b', disposition=Disposition.CREATE)
+    await cached_listing(c, 'dir', {b'a': 0, b'b': 0})
+
+    print('Drop the entries when a file is written #4')
+    await c.write(fid, 0, b'data')
+    await cached_listing(c, 'dir', {b'a': 0, b'b': 4})
+
+    print('Drop the entries when a file is renamed #5')
+    await c.set_info(fid, FileInfoClass.RENAME_INFORMATION,
+                     {'replace_if_exists': 0, 'filename': 'dir/c'})
+    await cached_listing(c, 'dir', {b'a': 0, b'c': 4})
+    await c.close(fid)
+
+    print('Drop the entries when a file is unlinked #6')
+    fid = await c.create('dir/a')
+    await c.set_info(fid, FileInfoClass.DISPOSITION_INFORMATION,
+                     {'delete_pending': 1})
+    await c.close(fid)
+    await cached_listing(c, 'dir', {b'c': 4})
+    c.close_connection()
+
+def main():
+    print('Evict the least recently used directory #1')
+    with tempfile.TemporaryDirectory() as share:
+        asyncio.run(evict(share))
+
+    print('Cache the entries of a directory #2')
+    with tempfile.TemporaryDirectory() as share:
+        asyncio.run(asyncio.wait_for(invalidate(share), 30))
+
+
+if __name__ == "__main__":
+    main()
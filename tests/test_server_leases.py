@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import asyncio
+import os
+import tempfile
+import time
+
+if not os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   '..', 'server', 'config.py')):
+    print('No server/config.py, skipping the Lease server tests')
+    exit(0)
+
+from loopback import memory_client
+from smb2.header import Status
+from smb2.create import Disposition, Oplock
+from smb2.create import SMB2_LEASE_READ_CACHING, SMB2_LEASE_WRITE_CACHING
+from smb2.create import SMB2_LEASE_HANDLE_CACHING
+
+R = SMB2_LEASE_READ_CACHING
+W = SMB2_LEASE_WRITE_CACHING
+H = SMB2_LEASE_HANDLE_CACHING
+
+async def run(share):
+    a = await memory_client(share, leases=True, lease_break_timeout=35)
+    b = await memory_client(share)
+    from leases import counters
+
+    print('Grant a read, write and handle lease #1')
+    fa = await a.create('file1', disposition=Disposition.OPEN_IF,
+                        lease_key=b'lease-key-000001', lease_state=R | W | H)
+    if a.leases[b'lease-key-000001'] != R | W | H:
+        print('Wrong lease', a.leases[b'lease-key-000001'])
+        exit(1)
+
+    print('Break to read and handle on a conflicting open #2')
+    _breaks = counters['breaks']
+    fb = await b.create('file1')
+    # The open waited for the acknowledgment
+    if a.leases[b'lease-key-000001'] != R | H or counters['breaks'] != _breaks + 1:
+        print('Wrong lease after the break', a.leases[b'lease-key-000001'])
+        exit(1)
+
+    print('Break the lease on a write, without waiting for it #3')
+    await b.write(fb, 0, b'data')
+    await asyncio.sleep(0.1)
+    # Nothing is cached without read caching
+    if a.leases[b'lease-key-000001'] != 0:
+        print('Wrong lease after the write', a.leases[b'lease-key-000001'])
+        exit(1)
+    await a.close(fa)
+    await b.close(fb)
+
+    print('Time out a break that is not acknowledged #4')
+    c = await memory_client(share, lease_break_timeout=0.5)
+    async def _never_ack(brk):
+        await asyncio.sleep(3600)
+    c.on_break = _never_ack
+    fc = await c.create('file2', disposition=Disposition.OPEN_IF,
+                        lease_key=b'lease-key-000002', lease_state=R | W | H)
+    _timeouts = counters['timeouts']
+    _start = time.monotonic()
+    fb = await b.create('file2')
+    if time.monotonic() - _start < 0.4 or counters['timeouts'] != _timeouts + 1:
+        print('The break did not time out')
+        exit(1)
+    await b.close(fb)
+    c.close_connection()
+
+    print('Downgrade a batch oplock to level II, then to none #5')
+    fa = await a.create('file3', disposition=Disposition.OPEN_IF,
+                        oplock_level=Oplock.LEVEL_BATCH)
+    if a.oplocks[fa] != Oplock.LEVEL_BATCH.value:
+        print('Wrong oplock', a.oplocks[fa])
+        exit(1)
+    fb = await b.create('file3')
+    if a.oplocks[fa] != Oplock.LEVEL_II.value:
+        print('Wrong oplock after the open', a.oplocks[fa])
+        exit(1)
+    await b.write(fb, 0, b'data')
+    await asyncio.sleep(0.1)
+    if a.oplocks[fa] != Oplock.LEVEL_NONE.value:
+        print('Wrong oplock after the write', a.oplocks[fa])
+        exit(1)
+    await a.close(fa)
+    await b.close(fb)
+
+    print('Refuse a lease key used for another file, before creating it #6')
+    fa = await a.create('file4', disposition=Disposition.OPEN_IF,
+                        lease_key=b'lease-key-000004', lease_state=R | H)
+    try:
+        await a.create('file5', disposition=Disposition.OPEN_IF,
+                       lease_key=b'lease-key-000004', lease_state=R | H)
+        print('Used a lease key for two files')
+        exit(1)
+    except OSError as e:
+        if e.args[0] != Status.INVALID_PARAMETER.value:
+            print('Wrong status', hex(e.args[0]))
+            exit(1)
+    if os.path.exists(os.path.join(share, 'file5')):
+        print('Created the file anyway')
+        exit(1)
+    await a.close(fa)
+
+    a.close_connection()
+    b.close_connection()
+
+def main():
+    with tempfile.TemporaryDirectory() as share:
+        asyncio.run(asyncio.wait_for(run(share), 30))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import asyncio
+import os
+import tempfile
+
+if not os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   '..', 'server', 'config.py')):
+    print('No server/config.py, skipping the Query Directory server tests')
+    exit(0)
+
+from loopback import memory_client
+from smb2.header import Command, Direction, Status
+from smb2.create import FILE_DIRECTORY_FILE
+from smb2.dir_info import DirInfoClass
+from smb2.query_directory import QueryDirectory
+
+names = [b'a.txt', b'b.txt', b'c.dat']
+
+async def run(share):
+    # Read the directories as we go, not from the cache
+    c = await memory_client(share, dir_cache_entries=0)
+    for name in names:
+        open(os.path.join(share, name.decode()), 'w').close()
+
+    print('List a directory without a search pattern #1')
+    fid = await c.create('', create_options=FILE_DIRECTORY_FILE)
+    entries = await c.query_directory(fid, pattern='')
+    if entries is None or sorted([e.file_name for e in entries]) != names:
+        print('Wrong entries', entries)
+        exit(1)
+    if await c.query_directory(fid, pattern='') is not None:
+        print('Entries after the end of the directory')
+        exit(1)
+    await c.close(fid)
+
+    print('List an empty directory without a search pattern #2')
+    os.mkdir(os.path.join(share, 'empty'))
+    fid = await c.create('empty', create_options=FILE_DIRECTORY_FILE)
+    hdr, buf = await c.request(Command.QUERY_DIRECTORY,
+            QueryDirectory.encode(Direction.REQUEST,
+                                  {'info_class': DirInfoClass.FILE_ID_FULL_INFORMATION.value,
+                                   'flags': 0,
+                                   'file_index': 0,
+                                   'file_id': fid,
+                                   'output_buffer_length': 65536}))
+    # Like '*', not a name that was not found
+    if hdr['status'] != Status.NO_MORE_FILES.value:
+        print('Wrong status', hex(hdr['status']))
+        exit(1)
+    await c.close(fid)
+
+    print('Run queries of the same handle concurrently #3')
+    os.mkdir(os.path.join(share, 'many'))
+    many = sorted([b'file%04d' % i for i in range(1000)])
+    for name in many:
+        open(os.path.join(share, 'many', name.decode()), 'w').close()
+    fid = await c.create('many', create_options=FILE_DIRECTORY_FILE)
+    seen = []
+    async def _query():
+        while True:
+            entries = await c.query_directory(fid, output_buffer_length=1024)
+            if entries is None:
+                return
+            seen.extend([e.file_name for e in entries])
+    await asyncio.gather(*[_query() for _ in range(8)])
+    if sorted(seen) != many:
+        print('Wrong entries', len(seen))
+        exit(1)
+    await c.close(fid)
+
+    print('List a name that is not UTF8 #4')
+    os.mkdir(os.path.join(share, 'latin1'))
+    open(os.path.join(os.fsencode(share), b'latin1', b'caf\xe9'), 'w').close()
+    fid = await c.create('latin1', create_options=FILE_DIRECTORY_FILE)
+    entries = await c.query_directory(fid, pattern='')
+    if entries is None or [e.file_name for e in entries] != [b'caf\xe9']:
+        print('Wrong entries', entries)
+        exit(1)
+    await c.close(fid)
+    c.close_connection()
+
+def main():
+    with tempfile.TemporaryDirectory() as share:
+        asyncio.run(run(share))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import asyncio
+import os
+import tempfile
+
+if not os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   '..', 'server', 'config.py')):
+    print('No server/config.py, skipping the Read server tests')
+    exit(0)
+
+from loopback import memory_client
+from smb2.header import Command, Direction, Status
+from smb2.create import Disposition
+from smb2.file_info import FileInfo, FileInfoClass
+from smb2.read import Read
+
+SIZE = 131072
+
+async def read(c, fid, offset, length):
+    """
+    Returns the status and the data of a read
+    """
+    hdr, buf = await c.request(Command.READ,
+            Read.encode(Direction.REQUEST,
+                        {'flags': 0,
+                         'length': length,
+                         'offset': offset,
+                         'file_id': fid,
+                         'minimum_count': 0,
+                         'channel': 0,
+                         'remaining_bytes': 0}),
+            credit_charge=(length + 65535) // 65536)
+    if hdr['status'] != Status.SUCCESS.value:
+        return hdr['status'], b''
+    return hdr['status'], bytes(Read.decode(Direction.REPLY, buf).get('data', b''))
+
+async def run(share):
+    # Long enough that only a shared cache sees the truncates in time
+    c = await memory_client(share, stat_cache_ttl=3600)
+
+    print('Read through one handle after truncating through another #1')
+    a = await c.create('file', disposition=Disposition.OPEN_IF)
+    b = await c.create('file')
+    await c.write(a, 0, bytes(SIZE))
+    status, data = await read(c, b, 0, SIZE)
+    if status != Status.SUCCESS.value or len(data) != SIZE:
+        print('Wrong read before the truncate', hex(status), len(data))
+        exit(1)
+
+    # Shorter, but large enough to be sent with sendfile
+    await c.set_info(a, FileInfoClass.END_OF_FILE_INFORMATION,
+                     {'end_of_file': SIZE // 2 + 4096})
+    status, data = await read(c, b, 0, SIZE)
+    if status != Status.SUCCESS.value or len(data) != SIZE // 2 + 4096:
+        print('Wrong read after the shrink', hex(status), len(data))
+        exit(1)
+
+    await c.set_info(a, FileInfoClass.END_OF_FILE_INFORMATION,
+                     {'end_of_file': 0})
+    status, data = await read(c, b, 0, SIZE)
+    if status != Status.END_OF_FILE.value:
+        print('Wrong status after the truncate', hex(status), len(data))
+        exit(1)
+
+    print('Query the size through the other handle #2')
+    fi = FileInfo.decode(FileInfoClass.STANDARD_INFORMATION,
+                         (await c.query_info(b, FileInfoClass.STANDARD_INFORMATION))['buffer'])
+    if fi['end_of_file'] != 0:
+        print('Wrong end of file', fi['end_of_file'])
+        exit(1)
+
+    print('Read after the file was truncated outside of the server #3')
+    with open(os.path.join(share, 'file'), 'wb') as f:
+        f.write(bytes(SIZE))
+    status, data = await read(c, b, 0, SIZE)
+    if status != Status.SUCCESS.value or len(data) != SIZE:
+        print('Wrong read before the truncate', hex(status), len(data))
+        exit(1)
+    os.truncate(os.path.join(share, 'file'), SIZE // 2 + 4096)
+    status, data = await read(c, b, 0, SIZE)
+    if status != Status.SUCCESS.value or len(data) != SIZE // 2 + 4096:
+        print('Wrong read after the shrink', hex(status), len(data))
+        exit(1)
+    os.truncate(os.path.join(share, 'file'), 0)
+    status, data = await read(c, b, 0, SIZE)
+    if status != Status.END_OF_FILE.value:
+        print('Wrong status after the truncate', hex(status), len(data))
+        exit(1)
+
+    await c.close(a)
+    await c.close(b)
+    c.close_connection()
+
+def main():
+    with tempfile.TemporaryDirectory() as share:
+        asyncio.run(asyncio.wait_for(run(share), 30))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import asyncio
+import os
+import tempfile
+
+if not os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   '..', 'server', 'config.py')):
+    print('No server/config.py, skipping the Set Info server tests')
+    exit(0)
+
+from loopback import memory_client
+from smb2.header import Status
+from smb2.create import Disposition, FILE_DIRECTORY_FILE, FILE_DELETE_ON_CLOSE
+from smb2.file_info import FileInfoClass
+
+def check_status(status):
+    if status != Status.SUCCESS.value:
+        print('Wrong status', hex(status))
+        exit(1)
+
+async def run(share):
+    c = await memory_client(share)
+
+    print('Truncate a file #1')
+    fid = await c.create('file1', disposition=Disposition.OPEN_IF)
+    await c.write(fid, 0, b'x' * 1000)
+    check_status(await c.set_info(fid, FileInfoClass.END_OF_FILE_INFORMATION,
+                                  {'end_of_file': 10}))
+    if os.path.getsize(os.path.join(share, 'file1')) != 10:
+        print('Wrong size', os.path.getsize(os.path.join(share, 'file1')))
+        exit(1)
+
+    print('Set the times of a file #2')
+    check_status(await c.set_info(fid, FileInfoClass.BASIC_INFORMATION,
+                                  {'creation_time': (0, 0, 0),
+                                   'last_access_time': (1000000000, 0, 0),
+                                   'last_write_time': (1000000000, 0, 0),
+                                   'change_time': (0, 0, 0),
+                                   'file_attributes': 0}))
+    if int(os.stat(os.path.join(share, 'file1')).st_mtime) != 1000000000:
+        print('Wrong mtime', os.stat(os.path.join(share, 'file1')).st_mtime)
+        exit(1)
+
+    print('Rename a file #3')
+    check_status(await c.set_info(fid, FileInfoClass.RENAME_INFORMATION,
+                                  {'replace_if_exists': 0,
+                                   'filename': 'file2'}))
+    if sorted(os.listdir(share)) != ['file2']:
+        print('Wrong names', os.listdir(share))
+        exit(1)
+    await c.close(fid)
+
+    print('Delete a file on close #4')
+    fid = await c.create('file2')
+    check_status(await c.set_info(fid, FileInfoClass.DISPOSITION_INFORMATION,
+                                  {'delete_pending': 1}))
+    await c.close(fid)
+    if os.listdir(share):
+        print('Not deleted', os.listdir(share))
+        exit(1)
+
+    print('Create a directory and delete it on close #5')
+    fid = await c.create('dir1', disposition=Disposition.CREATE,
+                         create_options=FILE_DIRECTORY_FILE | FILE_DELETE_ON_CLOSE)
+    if not os.path.isdir(os.path.join(share, 'dir1')):
+        print('No directory')
+        exit(1)
+    await c.close(fid)
+    if os.listdir(share):
+        print('Not deleted', os.listdir(share))
+        exit(1)
+    c.close_connection()
+
+def main():
+    with tempfile.TemporaryDirectory() as share:
+        asyncio.run(asyncio.wait_for(run(share), 30))
+
+
+if __name__ == "__main__":
+    main()
@@ -114,6 +114,18 @@ def main():
         pr(buf)
         exit(1)
 
+    print('Encode a Create Reply into a buffer at an offset #1')
+    _size = Create.encoded_size(Direction.REPLY, cmd)
+    if _size != len(buf):
+        print('Wrong encoded size', _size, len(buf))
+        exit(1)
+    _b = bytearray(8 + _size + 8)
+    _end = Create.encode_into(Direction.REPLY, _b, 8, cmd)
+    if _end != 8 + _size or _b[8:_end] != buf or any(_b[:8] + _b[_end:]):
+        print('Encoded content mismatch')
+        pr(_b)
+        exit(1)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from smb2.header import Direction
+from smb2.oplock_break import OplockBreak
+
+oplock_break_buf_1 = bytes([
+    0x18, 0x00, 0x01, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x05, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x05, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00
+])
+
+lease_break_notification_buf_1 = bytes([
+    0x2c, 0x00, 0x02, 0x00, 0x01, 0x00, 0x00, 0x00,
+    0x6c, 0x65, 0x61, 0x73, 0x65, 0x2d, 0x6b, 0x65,
+    0x79, 0x2d, 0x30, 0x30, 0x30, 0x30, 0x30, 0x31,
+    0x07, 0x00, 0x00, 0x00, 0x03, 0x00, 0x00, 0x00,
+    0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x00, 0x00, 0x00, 0x00
+])
+
+lease_break_ack_buf_1 = bytes([
+    0x24, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x6c, 0x65, 0x61, 0x73, 0x65, 0x2d, 0x6b, 0x65,
+    0x79, 0x2d, 0x30, 0x30, 0x30, 0x30, 0x30, 0x31,
+    0x03, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x00, 0x00, 0x00, 0x00
+])
+
+
+def pr(buf):
+    for i in buf:
+        print("%02x " % i, end='')
+    print()
+
+def check(name, direction, buf):
+    ob = OplockBreak()
+    cmd = ob.decode(direction, buf)
+    out = ob.encode(direction, cmd)
+
+    if buf != out:
+        print(name, 're-encoded content mismatch')
+        print('Original:')
+        pr(buf)
+        print('Encoded:')
+        pr(out)
+        exit(1)
+    return cmd
+
+def main():
+    print('Decode and re-encode an Oplock Break Acknowledgment #1')
+    cmd = check('Oplock Break', Direction.REQUEST, oplock_break_buf_1)
+    if cmd['oplock_level'] != 1 or cmd['file_id'] != (5, 5):
+        print('Wrong oplock level or file id')
+        exit(1)
+
+    print('Decode and re-encode a Lease Break Notification #1')
+    cmd = check('Lease Break Notification', Direction.REPLY,
+                lease_break_notification_buf_1)
+    if cmd['lease_key'] != b'lease-key-000001' or cmd['new_epoch'] != 2 or \
+       cmd['current_lease_state'] != 7 or cmd['new_lease_state'] != 3:
+        print('Wrong lease break')
+        exit(1)
+
+    print('Decode and re-encode a Lease Break Acknowledgment #1')
+    cmd = check('Lease Break Acknowledgment', Direction.REQUEST,
+                lease_break_ack_buf_1)
+    if cmd['lease_key'] != b'lease-key-000001' or cmd['lease_state'] != 3:
+        print('Wrong lease state')
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,8 @@
 
 from smb2.header import Direction
 from smb2.query_directory import QueryDirectory
+import smb2.dir_info
+from smb2.dir_info import DirInfo, DirInfoClass
 
 query_directory_req_buf_1 = bytes([
     0x21, 0x00, 0x26, 0x00, 0x00, 0x00, 0x00, 0x00,
@@ -12,6 +14,14 @@ query_directory_req_buf_1 = bytes([
     0x2a, 0x00
 ])
 
+# No search pattern, FileNameLength is 0
+query_directory_req_buf_2 = bytes([
+    0x21, 0x00, 0x25, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x01, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x01, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x60, 0x00, 0x00, 0x00, 0x00, 0x00, 0x01, 0x00
+])
+
 query_directory_rep_buf_1 = bytes([
     0x09, 0x00, 0x48, 0x00, 0xd6, 0x02, 0x00, 0x00,
     0x58, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
@@ -127,6 +137,20 @@ def main():
         pr(buf)
         exit(1)
 
+    print('Decode and re-encode a QueryDirectory Request without a pattern #2')
+    cmd = qi.decode(Direction.REQUEST, query_directory_req_buf_2)
+    if cmd.name != b'':
+        print('Wrong search pattern', cmd.name)
+        exit(1)
+    buf = qi.encode(Direction.REQUEST, cmd)
+    if query_directory_req_buf_2 != buf:
+        print('Re-encoded content mismatch')
+        print('Original:')
+        pr(query_directory_req_buf_2)
+        print('Encoded:')
+        pr(buf)
+        exit(1)
+
     print('Decode and re-encode a QueryDirectory Reply #1')
     qi = QueryDirectory()
     cmd = qi.decode(Direction.REPLY, query_directory_rep_buf_1)
@@ -140,6 +164,29 @@ def main():
         pr(buf)
         exit(1)
 
+    print('Batch encode the entries of a QueryDirectory Reply #2')
+    dic = DirInfoClass.FILE_ID_FULL_INFORMATION
+    entries = DirInfo.decode(dic, cmd.data)
+    for backend in ['python', 'numpy']:
+        if backend == 'numpy' and not smb2.dir_info.numpy:
+            continue
+        smb2.dir_info.USE_NUMPY = backend == 'numpy'
+        # Room for all but the last entry
+        buf, num = DirInfo.encode_batch(dic, iter(entries),
+                                        len(cmd.data) - 16, reserve=8)
+        if num != len(entries) - 1:
+            print('Wrong number of entries', num, backend)
+            exit(1)
+        buf, num = DirInfo.encode_batch(dic, iter(entries), 65536, reserve=8)
+        # Windows leaves junk in the padding, so compare with DirInfo.encode
+        if num != len(entries) or buf[8:] != DirInfo.encode(dic, entries):
+            print('Batch encoded entries mismatch', backend)
+            print('Original:')
+            pr(DirInfo.encode(dic, entries))
+            print('Encoded:')
+            pr(buf[8:])
+            exit(1)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from smb2.header import Direction
+from smb2.read import Read, ReadRequest
+from smb2.tree_connect import TreeConnect
+from test_smb2_tree_connect import tree_connect_req_buf_1
+
+read_req_buf_1 = bytes([
+    0x31, 0x00, 0x50, 0x00,  0x00, 0x00, 0x01, 0x00,
+    0x00, 0x10, 0x00, 0x00,  0x00, 0x00, 0x00, 0x00,
+    0x05, 0x00, 0x00, 0x00,  0x00, 0x00, 0x00, 0x00,
+    0x07, 0x00, 0x00, 0x00,  0x00, 0x00, 0x00, 0x00,
+    0x00, 0x00, 0x00, 0x00,  0x00, 0x00, 0x00, 0x00,
+    0x00, 0x00, 0x00, 0x00,  0x00, 0x00, 0x00, 0x00,
+    0x00
+])
+
+def main():
+    print('Access a decoded Read request as attributes and as a dict #1')
+    cmd = Read.decode(Direction.REQUEST, read_req_buf_1)
+    if not isinstance(cmd, ReadRequest):
+        print('Decoded request is not a ReadRequest', type(cmd))
+        exit(1)
+    if cmd.length != 65536 or cmd['length'] != 65536:
+        print('Wrong length', cmd.length, cmd['length'])
+        exit(1)
+    if cmd.file_id != (5, 7) or cmd.get('file_id') != (5, 7):
+        print('Wrong file_id', cmd.file_id)
+        exit(1)
+    if 'read_channel' in cmd or cmd.get('read_channel', 1) != 1:
+        print('Unset field is in the record')
+        exit(1)
+    try:
+        cmd['read_channel']
+        print('Unset field did not raise KeyError')
+        exit(1)
+    except KeyError:
+        True
+
+    print('Compare a decoded Read request with a dict #2')
+    d = dict(cmd)
+    if d != cmd or cmd != d or len(d) != len(cmd):
+        print('Record and dict differ', cmd, d)
+        exit(1)
+    if set(d.keys()) != {'structure_size', 'flags', 'length', 'offset',
+                         'file_id', 'minimum_count', 'channel',
+                         'remaining_bytes'}:
+        print('Wrong keys', d.keys())
+        exit(1)
+
+    print('Re-encode a Read request from the record and the dict #3')
+    if Read.encode(Direction.REQUEST, cmd) != Read.encode(Direction.REQUEST, d):
+        print('Record and dict encode differently')
+        exit(1)
+
+    print('Build a record from a dict #4')
+    r = ReadRequest({'length': 1}, offset=2)
+    r.update({'flags': 3})
+    if r != {'length': 1, 'offset': 2, 'flags': 3}:
+        print('Wrong record', r)
+        exit(1)
+    try:
+        r['no_such_field'] = 1
+        print('Unknown field did not raise KeyError')
+        exit(1)
+    except KeyError:
+        True
+
+    print('Decode a path only when it is read #5')
+    _frame = memoryview(bytearray(tree_connect_req_buf_1))
+    cmd = TreeConnect.decode(Direction.REQUEST, _frame[4 + 64:])
+    if not isinstance(cmd._path_raw, memoryview) or cmd._path_raw.obj is not _frame.obj:
+        print('Path is not a view into the frame')
+        exit(1)
+    _path = cmd.path
+    if not isinstance(_path, (bytes, bytearray)) or hasattr(cmd, '_path_raw'):
+        print('Path was not decoded on access', _path)
+        exit(1)
+    if cmd['path'] != _path or not 'path' in cmd:
+        print('Decoded path is not in the record')
+        exit(1)
+    cmd.path = b'/other'
+    if cmd.path != b'/other':
+        print('Path could not be set', cmd.path)
+        exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from smb2.record import Record, Lazy
+from smb2.schema import Codec, Field, Buffer, Array, PATH
+
+#
+# A made up PDU that uses most of what a layout can describe
+#
+class TestPdu(Record):
+    __slots__ = ('structure_size', 'flags', 'file_id', 'extra',
+                 'values', '_name', '_name_raw', 'data')
+    name = Lazy(PATH.decode)
+
+_pdu = Codec(TestPdu, 32, [
+    Field('structure_size', 0, 'H', value=33),
+    Field('flags', 2, 'H'),
+    Field('file_id', 8, 'QQ'),
+    Field('extra', 24, 'I', when=('flags', lambda f: f & 1)),
+    ], [
+    Buffer('values', length=(4, 'H'), count=True, codec=Array('H'),
+           required=True, missing=[]),
+    Buffer('name', offset=(28, 'H'), length=(30, 'H'), codec=PATH, align=8,
+           required=True, missing=b''),
+    Buffer('data'),
+    ])
+
+def main():
+    print('Encode and decode a PDU with all kinds of fields #1')
+    pdu = {'flags': 1, 'file_id': (5, 7), 'extra': 9, 'values': [1, 2, 3],
+           'name': b'a/b', 'data': b'xyz'}
+    buf = _pdu.encode(pdu)
+    # 32 fixed, 6 values, pad to 40, 6 name and 3 data
+    if len(buf) != 49 or _pdu.encoded_size(pdu) != 49:
+        print('Wrong size', len(buf), _pdu.encoded_size(pdu))
+        exit(1)
+    if buf[40:46] != 'a\\b'.encode('utf-16-le'):
+        print('Name not aligned or not converted', bytes(buf[40:46]))
+        exit(1)
+    cmd = _pdu.decode(memoryview(buf))
+    if cmd.structure_size != 33 or cmd.extra != 9 or cmd.values != [1, 2, 3]:
+        print('Wrong fields', cmd)
+        exit(1)
+    if cmd.name != b'a/b' or bytes(cmd.data) != b'xyz':
+        print('Wrong buffers', cmd.name, bytes(cmd.data))
+        exit(1)
+
+    print('Encode into a larger buffer at an offset #2')
+    b = bytearray(8 + 49)
+    if _pdu.encode_into(b, 8, pdu) != 8 + 49 or b[8:] != buf:
+        print('Encoding at an offset differs')
+        exit(1)
+
+    print('Fields and buffers that are not there #3')
+    buf = _pdu.encode({'flags': 0, 'file_id': (1, 2), 'values': [],
+                       'name': b'', 'extra': 9})
+    cmd = _pdu.decode(memoryview(buf))
+    if 'extra' in cmd or cmd.values != [] or cmd.name != b'':
+        print('Wrong empty fields', cmd)
+        exit(1)
+    if len(cmd.data):
+        print('Data should be empty', bytes(cmd.data))
+        exit(1)
+
+if __name__ == "__main__":
+    main()
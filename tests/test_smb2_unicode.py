@@ -1,7 +1,8 @@
 #!/usr/bin/env python
 # coding: utf-8
 
-from smb2.unicode import UCS2toUTF8, UTF8toUCS2
+from smb2.unicode import UCS2toUTF8, UTF8toUCS2, UTF8toUCS2Len
+from smb2.unicode import UCS2toPath, PathtoUCS2
 
 ucs2_buf_1 = bytes([
     0x5c, 0x00, 0x5c, 0x00, 0x77, 0x00, 0x69, 0x00,
@@ -41,7 +42,61 @@ def main():
         print('Encoded:')
         pr(utf8)
         exit(1)
-        
+
+    print('Convert names outside ASCII and the BMP #2')
+    for name in ['caf\u00e9', '\u65e5\u672c\u8a9e', 'smile\U0001f600',
+                 '\U00010000\U0010ffff', 'x' * 255, '\u00e9' * 255]:
+        utf8 = name.encode('utf-8')
+        ucs2 = UTF8toUCS2(utf8)
+        if ucs2 != name.encode('utf-16-le'):
+            print('Wrong UCS2 for', repr(name))
+            pr(ucs2)
+            exit(1)
+        if UTF8toUCS2Len(utf8) != len(ucs2) or UTF8toUCS2(name) != ucs2:
+            print('Wrong UCS2 length for', repr(name))
+            exit(1)
+        # Names sliced out of a frame, or a directory buffer
+        if UTF8toUCS2Len(memoryview(utf8)) != len(ucs2) or \
+           UTF8toUCS2Len(bytearray(utf8)) != len(ucs2):
+            print('Wrong UCS2 length of a view of', repr(name))
+            exit(1)
+        if UCS2toUTF8(memoryview(ucs2)) != utf8:
+            print('Name does not round trip', repr(name))
+            exit(1)
+
+    print('Keep a lone surrogate #3')
+    ucs2 = bytes([0x41, 0x00, 0x00, 0xd8, 0x42, 0x00])
+    if UTF8toUCS2(UCS2toUTF8(ucs2)) != ucs2:
+        print('Lone surrogate does not round trip')
+        exit(1)
+
+    print('Keep the bytes of a name that is not UTF8 #4')
+    utf8 = b'caf\xe9 \xff'
+    ucs2 = UTF8toUCS2(utf8)
+    if ucs2 != 'caf\udce9 \udcff'.encode('utf-16-le', 'surrogatepass') or \
+       UTF8toUCS2Len(utf8) != len(ucs2) or PathtoUCS2(utf8) != ucs2:
+        print('Wrong UCS2 for a name that is not UTF8')
+        pr(ucs2)
+        exit(1)
+    if UCS2toUTF8(ucs2) != utf8 or UCS2toPath(ucs2) != utf8:
+        print('Name that is not UTF8 does not round trip')
+        exit(1)
+
+    print('Convert paths and their separators #5')
+    # U+2F5C has a '/' and a '\\' byte in UTF16-LE
+    path = '/dir\u2f5c/f\u00e9'.encode('utf-8')
+    ucs2 = PathtoUCS2(path)
+    if ucs2 != '\\dir\u2f5c\\f\u00e9'.encode('utf-16-le'):
+        print('Wrong UCS2 path')
+        pr(ucs2)
+        exit(1)
+    if PathtoUCS2(path) is not ucs2:
+        print('Path was not cached')
+        exit(1)
+    if UCS2toPath(ucs2) != path:
+        print('Path does not round trip')
+        exit(1)
+
 
 if __name__ == "__main__":
     main()
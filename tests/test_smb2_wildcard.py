@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from smb2.wildcard import compile_pattern, is_wildcard
+
+# (pattern, name, match)
+matches = [
+    (b'*', b'anything.txt', True),
+    (b'*.txt', b'a.txt', True),
+    (b'*.txt', b'a.txt.bak', False),
+    (b'a?c', b'abc', True),
+    (b'a?c', b'ac', False),
+    (b'a?c', 'aéc'.encode('utf-8'), True),
+    (b'a?c', 'a\U0001f600c'.encode('utf-8'), True),
+    # DOS_STAR: up to the last '.'
+    (b'<.txt', b'a.b.txt', True),
+    (b'<', b'abc', True),
+    (b'<', b'a.b', False),
+    # '*.' on the client, names without an extension
+    (b'<"', b'abc', True),
+    (b'<"', b'a.b', False),
+    # DOS_QM: a character, or none at a '.' or at the end
+    (b'>>.txt', b'a.txt', True),
+    (b'>>.txt', b'ab.txt', True),
+    (b'>>.txt', b'abc.txt', False),
+    (b'a>>', b'a', True),
+    (b'a>>', b'abc', True),
+    (b'a>>', b'abcd', False),
+    # DOS_DOT: a '.' or the end
+    (b'abc"', b'abc', True),
+    (b'abc"txt', b'abc.txt', True),
+    # No wildcards, case sensitive
+    (b'File.TXT', b'File.TXT', True),
+    (b'File.TXT', b'file.txt', False),
+    (b'a+b(c)', b'a+b(c)', True),
+    ]
+
+def main():
+    print('Match names against MS-FSA wildcards #1')
+    for pattern, name, match in matches:
+        _m = compile_pattern(pattern)
+        if (_m is None or _m(name) is not None) != match:
+            print('Pattern', pattern, 'name', name, 'should match' if match else 'should not match')
+            exit(1)
+
+    print('Patterns that match everything #2')
+    if compile_pattern(b'*') is not None or compile_pattern(b'') is not None:
+        print('* should not need matching')
+        exit(1)
+
+    print('Tell wildcards from plain names #3')
+    if is_wildcard(b'file.txt') or not is_wildcard(b'file.<') or not is_wildcard(b'a"b'):
+        print('Wrong wildcard detection')
+        exit(1)
+
+if __name__ == "__main__":
+    main()
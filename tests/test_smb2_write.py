@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+from smb2.header import Direction
+from smb2.write import Write
+
+write_req_buf_1 = bytes([
+    0x31, 0x00, 0x70, 0x00, 0x0d, 0x00, 0x00, 0x00,
+    0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x07, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x07, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+    0x68, 0x65, 0x6c, 0x6c, 0x6f, 0x20, 0x77, 0x6f,
+    0x72, 0x6c, 0x64, 0x0d, 0x0a
+])
+
+write_rep_buf_1 = bytes([
+    0x11, 0x00, 0x00, 0x00, 0x0d, 0x00, 0x00, 0x00,
+    0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
+])
+
+def pr(buf):
+    pos = 0
+    for i in buf:
+        print("%02x " % i, end='')
+        pos = pos + 1
+        if pos == 8:
+            print(' ', end='')
+        if pos == 16:
+            pos = 0
+            print('')
+    print()
+
+def main():
+    print('Decode and re-encode a Write Request #1')
+    w = Write()
+    cmd = w.decode(Direction.REQUEST, write_req_buf_1)
+    buf = w.encode(Direction.REQUEST, cmd)
+
+    if write_req_buf_1 != buf:
+        print('Re-encoded content mismatch')
+        print('Original:')
+        pr(write_req_buf_1)
+        print('Encoded:')
+        pr(buf)
+        exit(1)
+
+    print('Decode and re-encode a Write Reply #1')
+    w = Write()
+    cmd = w.decode(Direction.REPLY, write_rep_buf_1)
+    buf = w.encode(Direction.REPLY, cmd)
+
+    if write_rep_buf_1 != buf:
+        print('Re-encoded content mismatch')
+        print('Original:')
+        pr(write_rep_buf_1)
+        print('Encoded:')
+        pr(buf)
+        exit(1)
+
+if __name__ == "__main__":
+    main()